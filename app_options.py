@@ -0,0 +1,54 @@
+##############################
+# The command line options shared by the web server(main.py) and the command line app(cmdapp.py)
+#
+# Each option is defined once, here, as tornado refuses to define an option twice
+# and both modules may be imported in one process(e.g, by the tests)
+##############################
+from tornado.options import define
+
+################
+# Mysql, Redis config
+#################
+define("port", default=8000, help="run on the given port", type=int)
+define("mysql_port", default=3306, help="db's port", type=int)
+define("mysql_host", default="localhost", help="db database host")
+define("mysql_user", default="root", help="db database user")
+define("mysql_password", default="kid1412", help="db database password")
+define("mysql_database", default="archive", help="db database name")
+
+define("redis_port", default=6379, help="redis port", type=int)
+define("redis_host", default="127.0.0.1", help="key-value cache host")
+define("redis_db", default= None, help="key-value db")
+
+##############################
+# Use pickle will be faster
+##############################
+define("refresh_pickle", default=False, help="refresh pickle or not")
+
+##############################
+# How many doc/kw to recommend
+###############################
+define("recom_kw_num", default=5, help="recommended keyword number at each iter")
+define("recom_doc_num", default=10, help="recommended document number at each iter")
+define("samp_doc_num", default=5, help="extra document number apart from the recommended ones")
+
+##############################
+# Filtering
+##############################
+define("kw_fb_threshold", default=0., help="The feedback threshold used when filtering keywords")
+define("doc_fb_threshold", default=0.1, help="The feedback threshold used when filtering documents")
+
+##############################
+# LinRel parameters
+##############################
+define("linrel_kw_mu", default=1., help="Value for \mu in the linrel algorithm for keyword")
+define("linrel_kw_c", default=0.2, help="Value for c in the linrel algorithm for keyword")
+define("linrel_doc_mu", default=1., help="Value for \mu in the linrel algorithm for document")
+define("linrel_doc_c", default=0.2, help="Value for c in the linrel algorithm for document")
+define("linrel_solver", default="cholesky", help="How the linrel matrix is inverted: inv or cholesky")
+
+##############################
+# Feedback propagation parameter
+##############################
+define("kw_alpha", default=0.7, help="The weight value used for keyword feedback summarization")
+define("doc_alpha", default=0.7, help="The weight value used for document feedback summarization")
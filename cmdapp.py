@@ -7,37 +7,21 @@ import torndb
 import redis
 
 from scinet3.model import (Document, Keyword)
+import scinet3.app_options #the options shared with the web server
 
 ################
 # Mysql, Redis config
 #################
-define("port", default=8000, help="run on the given port", type=int)
-define("mysql_port", default=3306, help="db's port", type=int)
-define("mysql_host", default="localhost", help="db database host")
-define("mysql_user", default="root", help="db database user")
-define("mysql_password", default="kid1412", help="db database password")
-define("mysql_database", default="archive", help="db database name")
 define("mysql_keyword_fieldname", default="keywords", help="name of field that stores the keywords")
 
-define("redis_port", default=6379, help="redis port", type=int)
-define("redis_host", default="127.0.0.1", help="key-value cache host")
-define("redis_db", default= None, help="key-value db")
-
 define("mysql_table", default='archive_500', help="db table to be used")
 
-
-##############################
-# Use pickle will be faster
-##############################
-define("refresh_pickle", default=False, help="refresh pickle or not")
+define("vectorized_session", default=False, help="Keep the keyword/document feedbacks in session as float32 vectors")
 
 ##############################
 # How many doc/kw to recommend
 ###############################
-define("recom_kw_num", default=5, help="recommended keyword number at each iter")
-define("recom_doc_num", default=10, help="recommended document number at each iter")
 define("samp_kw_num_from_doc", default=5, help="sampled keyword number from documents")
-define("samp_doc_num", default=5, help="extra document number apart from the recommended ones")
 
 ##############################
 # Sampling/filtering(to be use before LinRel for dimension reduction)
@@ -48,24 +32,24 @@ define("filter_those_with_fb", default=True, help="Whether we consider only thos
 define("kw_samplers", default=None, help="The names of samplers to use, separated by comma")
 define("doc_samplers", default=None, help="The names of samplers to use, separated by comma")
 
-define("kw_fb_threshold", default=0., help="The feedback threshold used for `kw_fb_filter`")
-define("doc_fb_threshold", default=0.1, help="The feedback threshold used for `doc_fb_filter`")
-
 
 ##############################
 # LinRel parameters
 ##############################
-define("linrel_kw_mu", default=1., help="Value for \mu in the linrel algorithm for keyword")
-define("linrel_kw_c", default=0.2, help="Value for c in the linrel algorithm for keyword")
-define("linrel_doc_mu", default=1., help="Value for \mu in the linrel algorithm for document")
-define("linrel_doc_c", default=0.2, help="Value for c in the linrel algorithm for document")
+define("linrel_incremental", default=False, help="Keep the linrel state in session and update it with the new feedback only, requires linrel_fb_only")
+define("linrel_fb_only", default=True, help="Use only the keywords/documents with feedback as linrel training rows")
+define("linrel_block_size", default=None, type=int, help="Score the candidates in blocks of this many rows to bound the memory usage")
 
 
 ##############################
 # Feedback propagation parameter
 ##############################
-define("kw_alpha", default=0.7, help="The weight value used for keyword feedback summarization")
-define("doc_alpha", default=0.7, help="The weight value used for document feedback summarization")
+define("fb_propagator", default="onepass", help="How the feedbacks are propagated: onepass or iterative")
+define("ppgt_damping", default=0.5, help="The damping factor of the iterative propagator, in [0, 1)")
+define("ppgt_tol", default=1e-6, help="The convergence tolerance of the iterative propagator")
+define("ppgt_max_iter", default=50, help="The maximum iteration number of the iterative propagator")
+define("fb_updater", default="override", help="How the feedbacks are updated: override, vectorized_override, mean or ema")
+define("fb_ema_beta", default=0.5, help="The weight of the latest feedback in the exponential moving average")
 
 class CmdApp():
     """
@@ -103,24 +87,7 @@ class CmdApp():
         }
         """
         print "propagation started..."
-        for doc_fb in feedbacks.get("docs", []):
-            doc_id, fb = doc_fb
-            doc = Document.get(doc_id)
-            
-            self.ppgt.fb_from_doc(doc, fb, session)
-
-        for kw_fb in feedbacks.get("kws", []):
-            kw_id, fb = kw_fb
-            kw = Keyword.get(kw_id)
-            
-            self.ppgt.fb_from_kw(kw, fb, session)
-
-        for dockw_fb in feedbacks.get("dockws", []):
-            kw_id, doc_id, fb = dockw_fb
-            doc = Document.get(doc_id)
-            kw = Keyword.get(kw_id)
-            
-            self.ppgt.fb_from_dockw(kw, doc, fb, session)
+        self.ppgt.propagate(feedbacks, session)
 
         # propagation is done
         # updates the feedback value 
@@ -261,16 +228,31 @@ def main(desired_doc, desired_kw, session):
                                          options.linrel_doc_mu, options.linrel_doc_c, 
                                          kw_filters = kw_filters, doc_filters = doc_filters,
                                          kw_samplers = kw_samplers, doc_samplers = doc_samplers,
+                                         linrel_solver = options.linrel_solver,
+                                         linrel_incremental = options.linrel_incremental,
+                                         linrel_fb_only = options.linrel_fb_only,
+                                         linrel_block_size = options.linrel_block_size,
                                          **fmim_dict)
 
     ######################
     # This is our main app
     ######################
     # The choice of propagator and updater should be congifurable 
-    from scinet3.fb_propagator import OnePassPropagator
-    from scinet3.fb_updater import OverrideUpdater
+    from scinet3.fb_propagator import (OnePassPropagator, IterativePropagator)
+    from scinet3.fb_updater import (OverrideUpdater, VectorizedOverrideUpdater, MeanUpdater, EMAUpdater)
     
-    app = CmdApp(OnePassPropagator, OverrideUpdater, init_recommender, main_recommender)
+    IterativePropagator.config(damping = options.ppgt_damping, 
+                               tol = options.ppgt_tol, 
+                               max_iter = options.ppgt_max_iter)
+    propagators = {"onepass": OnePassPropagator,
+                   "iterative": IterativePropagator}
+    updaters = {"override": OverrideUpdater,
+                "vectorized_override": VectorizedOverrideUpdater,
+                "mean": MeanUpdater,
+                "ema": EMAUpdater}
+    EMAUpdater.set_beta(options.fb_ema_beta)
+    
+    app = CmdApp(propagators[options.fb_propagator], updaters[options.fb_updater], init_recommender, main_recommender)
 
     #######################
     # Our main app starts!!
@@ -283,30 +265,32 @@ def main(desired_doc, desired_kw, session):
         if iter_n > MAX_ITER:
                 break
         print "At iteration %d / %d" %(iter_n, MAX_ITER)
-                        
-        if just_started:
-            docs, kws = app.recommend(start = just_started, query = robot.initial_query)
-        else:
-            docs, kws = app.recommend(start = just_started, session = session)
 
-        just_started = False
-        
-        kws_to_be_displayed = filter(lambda kw: kw.has_key("recommended") and kw["recommended"], #kinda weird, kw.get("recommended", False) **should** be OK, but ...
-                                     kws)
-        
-        # session records recommendation
-        session.add_doc_recom_list(docs)
-        session.add_kw_recom_list(kws_to_be_displayed)
-        
-        if AUTO_INTERACT:# if robot is asked to come into stage            
-            feedback = robot.give_feedback(docs, kws_to_be_displayed)
-        else:
-            feedback = app.interact_with_user(docs, kws_to_be_displayed)
-        
-        # add user feedback
-        session.user_fb_hist_append(feedback)
-        
-        app.receive_feedbacks(session, feedback)
+        #the session state is read once and written back once per iteration
+        with session.snapshot() as snapshot:
+            if just_started:
+                docs, kws = app.recommend(start = just_started, query = robot.initial_query)
+            else:
+                docs, kws = app.recommend(start = just_started, session = snapshot)
+
+            just_started = False
+
+            kws_to_be_displayed = filter(lambda kw: kw.has_key("recommended") and kw["recommended"], #kinda weird, kw.get("recommended", False) **should** be OK, but ...
+                                         kws)
+
+            # session records recommendation
+            snapshot.add_doc_recom_list(docs)
+            snapshot.add_kw_recom_list(kws_to_be_displayed)
+
+            if AUTO_INTERACT:# if robot is asked to come into stage            
+                feedback = robot.give_feedback(docs, kws_to_be_displayed)
+            else:
+                feedback = app.interact_with_user(docs, kws_to_be_displayed)
+
+            # add user feedback
+            snapshot.user_fb_hist_append(feedback)
+
+            app.receive_feedbacks(snapshot, feedback)
 
 if __name__ == "__main__":    
     tornado.options.parse_command_line()
@@ -329,10 +313,13 @@ if __name__ == "__main__":
     #########################
     # Redis-based session confuguration
     #########################
-    from scinet3.session import RedisRecommendationSessionHandler
+    from scinet3.session import (RedisRecommendationSessionHandler, VectorizedRecommendationSessionHandler)
     redis_conn = redis.StrictRedis(host=options.redis_host, port=options.redis_port, db=options.redis_db)
 
-    session = RedisRecommendationSessionHandler.get_session(redis_conn, None)
+    if options.vectorized_session:
+        session = VectorizedRecommendationSessionHandler.get_session(redis_conn, None)
+    else:
+        session = RedisRecommendationSessionHandler.get_session(redis_conn, None)
     
     #########################
     # Desired docs/kws
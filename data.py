@@ -4,16 +4,19 @@
 # 2. document/keyword-to-matrix-index mapping and inverse mapping
 #############################
 
-__all__ = ["load_fmim"]
+__all__ = ["load_fmim", "save_index_bundle", "load_index_bundle", 
+           "ArrayIndexMapping", "ArrayReverseIndexMapping", "ids_to_rows", "rows_to_ids", "has_ids", "csr_row"]
 
-import sys, os, random, types, traceback
+import sys, os, io, random, types, traceback, shutil
 
 import torndb
 
-from json import loads, dumps
+from json import loads, dumps, load as load_json, dump as dump_json
 from pickle import dump, load
+from array import array
 
-from scipy.sparse import lil_matrix
+import numpy as np
+from scipy.sparse import lil_matrix, coo_matrix, csr_matrix, csc_matrix
 from sklearn.feature_extraction.text import TfidfTransformer
 
 from setting import MYSQL_CONN_SETTING
@@ -94,31 +97,59 @@ def test_matrix():
     return gen_kw_doc_matrix(docs, keywords = kws)
 
 
-def gen_kw_doc_matrix(docs, keywords, kw_field_name, doc_n = None, tfidf=True):
+def gen_kw_doc_matrix(docs, keywords = None, kw_field_name = "keywords", doc_n = None, tfidf=True):
     """
     build feature matrix and index mapping
     
-    docs: list of dict
+    The (keyword, document) pairs are accumulated in one pass over `docs` 
+    and turned into the matrix by one COO to CSR conversion, which sums up the duplicates.
+
+    docs: iterable of dict(a generator or database cursor is fine), each should have `id` and `kw_field_name`
+    keywords(optional): list of string, the keyword vocabulary. 
+                        If not given, it is built in the same pass(sorted, as `get_all_keywords` does)
+    kw_field_name: string, the field in doc that holds the list of keywords
+    doc_n(optional): integer, number of documents. If not given, the number of documents in `docs` is used
     """
-    kw_ind_map = dict((kw, ind) for ind, kw in enumerate(keywords)) #keyword to row index mapping
+    if keywords is not None:
+        kw_ind_map = dict((kw, ind) for ind, kw in enumerate(keywords)) #keyword to row index mapping
+    else:
+        kw_ind_map = {} #filled as keywords appear
+        
     doc_ind_map = {}
 
-    #if doc number is not given, get it
-    if doc_n is None and not isinstance(docs, types.GeneratorType):
-        doc_n = len(docs) 
-    kw2doc_m = lil_matrix((len(keywords), doc_n))
-    
+    kw_idx, doc_idx = array('i'), array('i')
     for doc_ind, doc in enumerate(docs):
         doc_id = doc['id']
         doc_ind_map[doc_id] = doc_ind #save the which row is doc associated with
-        keywords = doc[kw_field_name]
             
-        for kw in keywords:
+        for kw in doc[kw_field_name]:
             if kw:
-                kw_ind = kw_ind_map[kw]
-                kw2doc_m[kw_ind, doc_ind] += 1
+                if keywords is not None:
+                    kw_ind = kw_ind_map[kw]
+                else:
+                    kw_ind = kw_ind_map.setdefault(kw, len(kw_ind_map))
+                    
+                kw_idx.append(kw_ind)
+                doc_idx.append(doc_ind)
+
+    kw_idx = np.array(kw_idx, dtype = np.int32)
+    doc_idx = np.array(doc_idx, dtype = np.int32)
+    
+    if keywords is None: #sort the vocabulary and re-index the keywords accordingly
+        sorted_kws = sorted(kw_ind_map.keys())
+        
+        new_ind = np.empty(len(sorted_kws), dtype = np.int32)
+        new_ind[np.array([kw_ind_map[kw] for kw in sorted_kws], dtype = np.int32)] = np.arange(len(sorted_kws))
+        kw_idx = new_ind[kw_idx]
+        
+        kw_ind_map = dict((kw, ind) for ind, kw in enumerate(sorted_kws))
 
-    kw2doc_m = kw2doc_m.tocsr() #to Compressed Sparse Column format for faster row indexing and arithmatic operation    
+    if doc_n is None:
+        doc_n = len(doc_ind_map)
+        
+    #to Compressed Sparse Row format for faster row indexing and arithmatic operation
+    kw2doc_m = coo_matrix((np.ones(len(kw_idx)), (kw_idx, doc_idx)), 
+                          shape = (len(kw_ind_map), doc_n)).tocsr()
     doc2kw_m = kw2doc_m.T #just transpose it
     if tfidf:
         print 'tfidf...'
@@ -132,10 +163,118 @@ def gen_kw_doc_matrix(docs, keywords, kw_field_name, doc_n = None, tfidf=True):
             "doc2kw_m": doc2kw_m, 
             "kw2doc_m": kw2doc_m}
 
+INDEX_BUNDLE_VERSION = 1
+
+#the matrices in the bundle and their formats
+INDEX_BUNDLE_MATRICES = [("kw2doc_m", csr_matrix), ("doc2kw_m", csr_matrix), 
+                         ("kw2doc_m_csc", csc_matrix), ("doc2kw_m_csc", csc_matrix)]
+
+def save_index_bundle(path, fmim):
+    """
+    Save the feature matrices and index mappings as an index bundle, a directory containing:
+    
+    - meta.json: the bundle version and the matrix shapes
+    - <matrix>.indptr.npy, <matrix>.indices.npy, <matrix>.data.npy: the raw arrays of each matrix
+    - vocabulary.txt: the keywords, utf-8 encoded, one per line in row order
+    - doc_ids.npy: the document ids in row order
+
+    The bundle is written to a temporary directory first and then renamed, 
+    so readers never see a half written bundle
+
+    Param:
+    path: string, the bundle directory
+    fmim: FeatureMatrixAndIndexMapping
+    """
+    tmp_path = "%s.tmp%d" %(path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    meta = {"version": INDEX_BUNDLE_VERSION, "shapes": {}}
+    for name, _ in INDEX_BUNDLE_MATRICES:
+        m = getattr(fmim, name)
+        meta["shapes"][name] = list(m.shape)
+        for field in ("indptr", "indices", "data"):
+            np.save(os.path.join(tmp_path, "%s.%s.npy" %(name, field)), getattr(m, field))
+
+    kw_ind_r = fmim.kw_ind_r
+    keywords = rows_to_ids(kw_ind_r, np.arange(len(kw_ind_r)))
+    for kw in keywords:
+        assert u"\n" not in kw, "keyword should not contain newline, but is %r" %kw
+    with io.open(os.path.join(tmp_path, "vocabulary.txt"), "w", encoding = "utf8") as f:
+        f.write(u"\n".join(map(unicode, keywords)))
+
+    doc_ind_r = fmim.doc_ind_r
+    np.save(os.path.join(tmp_path, "doc_ids.npy"), 
+            np.array(rows_to_ids(doc_ind_r, np.arange(len(doc_ind_r))), dtype = np.int64))
+
+    #meta.json goes last, as it marks the bundle as complete
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        dump_json(meta, f)
+    
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+def index_bundle_version(path):
+    """
+    The version of the index bundle at `path`, None if there is no complete bundle
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return load_json(f).get("version")
+
+def load_index_bundle(path, mmap_mode = "r"):
+    """
+    Load the index bundle saved by `save_index_bundle`
+
+    The matrix arrays are memory-mapped(read-only by default) rather than read into the heap, 
+    so the loading is near-instant and processes loading the same bundle share the physical pages.
+
+    The index mappings are array-backed(see `ArrayIndexMapping`)
+    
+    Param:
+    path: string, the bundle directory
+    mmap_mode: see `numpy.load`. If None, the arrays are read into memory
+
+    Return:
+    FeatureMatrixAndIndexMapping
+    """
+    version = index_bundle_version(path)
+    if version != INDEX_BUNDLE_VERSION:
+        raise ValueError("index bundle version should be %r, but is %r" %(INDEX_BUNDLE_VERSION, version))
+
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = load_json(f)
+    
+    matrices = {}
+    for name, matrix_cls in INDEX_BUNDLE_MATRICES:
+        data, indices, indptr = [np.load(os.path.join(path, "%s.%s.npy" %(name, field)), mmap_mode = mmap_mode)
+                                 for field in ("data", "indices", "indptr")]
+        matrices[name] = matrix_cls((data, indices, indptr), shape = tuple(meta["shapes"][name]), copy = False)
+
+    with io.open(os.path.join(path, "vocabulary.txt"), encoding = "utf8") as f:
+        content = f.read()
+    keywords = (content.split(u"\n") if content else [])
+    
+    kw_ind = ArrayIndexMapping(keywords)
+    doc_ind = ArrayIndexMapping(np.load(os.path.join(path, "doc_ids.npy")))
+
+    return FeatureMatrixAndIndexMapping(kw_ind = kw_ind,
+                                        doc_ind = doc_ind,
+                                        kw_ind_r = kw_ind.reverse(),
+                                        doc_ind_r = doc_ind.reverse(),
+                                        **matrices)
+
 def load_fmim(db, table="brown", keyword_field_name = 'processed_keywords', tfidf=True, refresh = False):
     """
     Get FeatureMatrixAndIndexMapping object:
     
+    The index bundle(see `save_index_bundle`) at `pickles/<table>_index` is used as the cache. 
+    It is regenerated if missing or of another version.
+
     Param:
     db: Connection, the database conncetion
     table: string, the table to be used
@@ -144,38 +283,389 @@ def load_fmim(db, table="brown", keyword_field_name = 'processed_keywords', tfid
     refresh: boolean,  refresh the cache or not. If False, read from cache. Otherwise, read from db and cache it
     """
     
-    pic_path = 'pickles/%s_linrel_matrix.pic' %table
-    if os.path.exists(pic_path) and not refresh:
-        print 'linrel matrix pickle exists, load it'
-        return FeatureMatrixAndIndexMapping(**load(open(pic_path)))
+    bundle_path = 'pickles/%s_index' %table
+    if index_bundle_version(bundle_path) == INDEX_BUNDLE_VERSION and not refresh:
+        print 'index bundle exists, load it'
+        return load_index_bundle(bundle_path)
     else:
-        print 'linrel matrix pickle NOT exist, generate it'
-        all_keywords= get_all_keywords(db, table, keyword_field_name = keyword_field_name)
+        print 'index bundle NOT exist or outdated, generate it'
 
+        def parsed_docs(rows):
+            for row in rows:
+                row[keyword_field_name] = loads(row[keyword_field_name]) #parse the json raw string
+                yield row
+                
         try:
-            #get the number of documents
-            doc_n = db.get("SELECT count(id) from %s;" %table)['count(id)']
-            
-            #generate the matrix
-            docs = db.query("SELECT id, %s from %s;" %(keyword_field_name, table))
+            #stream the rows from the db and
+            #generate the matrix as well as the keyword vocabulary in one pass
+            docs = db.iter("SELECT id, %s from %s;" %(keyword_field_name, table))
+            return_val = gen_kw_doc_matrix(parsed_docs(docs), kw_field_name = keyword_field_name, tfidf = tfidf)
         except:
             traceback.print_exc(file=sys.stdout)
             return
         finally:
             db.close()
             
-        for doc in docs:
-            doc[keyword_field_name] = loads(doc[keyword_field_name]) #parse the json raw string
+        #cache it and load it back memory-mapped
+        save_index_bundle(bundle_path, FeatureMatrixAndIndexMapping(**return_val))
+        
+        return load_index_bundle(bundle_path)
 
-        #generate the summary data.....
-        return_val = gen_kw_doc_matrix(docs, all_keywords, keyword_field_name, doc_n = doc_n)
+
+class StringIdArray(object):
+    """
+    String ids, utf-8 encoded and concatenated into one buffer: the i-th one is buffer[offsets[i]:offsets[i+1]]
+
+    Unlike a fixed-width numpy string array, no entry is padded to the longest one.
+    A fixed-width array of the first `PREFIX_SIZE` bytes(`prefixes`) is kept for the binary search by numpy
+    """
+    PREFIX_SIZE = 8
+    
+    def __init__(self, ids):
+        """
+        ids: list of string or unicode
+        """
+        encoded = [(_id.encode("utf-8") if isinstance(_id, unicode) else _id) 
+                   for _id in ids]
+
+        self.buffer = "".join(encoded)
+        self.offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+        self.offsets[1:] = np.cumsum([len(_id) for _id in encoded])
+        
+        self.prefixes = np.array([_id[:self.PREFIX_SIZE] for _id in encoded], dtype = "S%d" %self.PREFIX_SIZE)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, i):
+        """
+        the i-th id, encoded
+        """
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def decoded(self, rows = None):
+        """
+        the ids at the rows(all if None), as a list of unicode
+        """
+        if rows is None:
+            rows = xrange(len(self))
+        return [self.get(i).decode("utf-8") for i in rows]
+
+def _id_array(ids):
+    """
+    array of object ids: int64 numpy array for integers, `StringIdArray` for strings
+    """
+    if isinstance(ids, StringIdArray) or (isinstance(ids, np.ndarray) and ids.dtype.kind == "i"):
+        return ids
+    
+    ids = list(ids)
+    if ids and isinstance(ids[0], basestring):
+        return StringIdArray(ids)
+    else:
+        return np.array(ids, dtype = np.int64)
+
+def _python_ids(id_array, rows = None):
+    """
+    inverse of `_id_array`, as a list, of the ids at the rows(all if None)
+    """
+    if isinstance(id_array, StringIdArray):
+        return id_array.decoded(rows)
+    elif rows is None:
+        return id_array.tolist()
+    else:
+        return id_array[rows].tolist()
+    
+class ArrayIndexMapping(object):
+    """
+    Object id to matrix row index mapping, backed by numpy arrays instead of a dict
+
+    The ids are kept sorted and looked up by binary search(`numpy.searchsorted`), 
+    with an int32 array mapping the sorted positions to the rows(not needed if the ids are sorted in row order).
+    String ids are searched by their fixed-width prefixes first(see `StringIdArray`), 
+    then among those sharing the prefix.
+
+    It can be used as a read-only dict. 
+    Besides, `rows` and `contains` translate a list of ids in one go
+    """
+    def __init__(self, ids):
+        """
+        ids: list or array of integer or string, the object ids in row order
+        """
+        self._ids = _id_array(ids)
+
+        if isinstance(self._ids, StringIdArray):
+            n = len(self._ids)
+            if all(self._ids.get(i) <= self._ids.get(i + 1) for i in xrange(n - 1)): #already sorted, e.g, the keyword vocabulary
+                self._sorted_rows = None
+                self._sorted_ids = self._ids.prefixes
+            else:
+                order = np.array(sorted(xrange(n), key = self._ids.get), dtype = np.int64)
+                self._sorted_rows = order.astype(np.int32)
+                self._sorted_ids = self._ids.prefixes[order]
+        elif (self._ids[1:] >= self._ids[:-1]).all(): #already sorted
+            self._sorted_ids = self._ids
+            self._sorted_rows = None
+        else:
+            order = np.argsort(self._ids, kind = "mergesort")
+            self._sorted_ids = self._ids[order]
+            self._sorted_rows = order.astype(np.int32)
+
+    def _row_at(self, pos):
+        """the row of the sorted position"""
+        return (pos if self._sorted_rows is None else int(self._sorted_rows[pos]))
+        
+    def _lookup_strings(self, ids):
+        """
+        `_lookup` for string ids
+        """
+        ids = [(_id.encode("utf-8") if isinstance(_id, unicode) else _id) for _id in ids]
+        prefixes = np.array([_id[:StringIdArray.PREFIX_SIZE] for _id in ids], 
+                            dtype = self._sorted_ids.dtype)
+        
+        #the sorted positions sharing the prefix
+        lows = np.searchsorted(self._sorted_ids, prefixes, side = "left")
+        highs = np.searchsorted(self._sorted_ids, prefixes, side = "right")
+        
+        rows = np.zeros(len(ids), dtype = np.int32)
+        found = np.zeros(len(ids), dtype = bool)
+        for i, (_id, low, high) in enumerate(zip(ids, lows.tolist(), highs.tolist())):
+            while low < high: #binary search by the whole id
+                mid = (low + high) // 2
+                if self._ids.get(self._row_at(mid)) < _id:
+                    low = mid + 1
+                else:
+                    high = mid
+            if low < highs[i] and self._ids.get(self._row_at(low)) == _id:
+                rows[i], found[i] = self._row_at(low), True
+
+        return rows, found
+            
+    def _lookup(self, ids):
+        """
+        Return:
+        (array of int32: the rows, array of bool: whether the id exists)
+        """
+        ids = list(ids)
+        if not ids or not len(self._ids):
+            return np.zeros(len(ids), dtype = np.int32), np.zeros(len(ids), dtype = bool)
+            
+        if isinstance(self._ids, StringIdArray):
+            return self._lookup_strings(ids)
+            
+        keys = np.array(ids, dtype = self._ids.dtype)
         
-        #cache it...
-        dump(return_val, open(pic_path, 'w'))
+        pos = np.searchsorted(self._sorted_ids, keys).clip(0, len(self._sorted_ids) - 1)
+        found = (self._sorted_ids[pos] == keys)
         
-        return FeatureMatrixAndIndexMapping(**return_val)
+        if self._sorted_rows is None:
+            return pos.astype(np.int32), found
+        else:
+            return self._sorted_rows[pos], found
+            
+    def rows(self, ids):
+        """
+        the rows of the ids
+        
+        Param:
+        ids: list of integer or string
+        
+        Return:
+        array of int32
+        
+        Raise:
+        KeyError if any id does not exist
+        """
+        ids = list(ids)
+        rows, found = self._lookup(ids)
+        if not found.all():
+            raise KeyError(ids[np.flatnonzero(~found)[0]])
+        return rows
+
+    def contains(self, ids):
+        """
+        Return:
+        array of bool, whether each id exists
+        """
+        return self._lookup(ids)[1]
+
+    def reverse(self):
+        """
+        the inverse mapping, sharing the id array
+        """
+        return ArrayReverseIndexMapping(self._ids)
+        
+    def __getitem__(self, _id):
+        rows, found = self._lookup([_id])
+        if not found[0]:
+            raise KeyError(_id)
+        return int(rows[0])
+
+    def get(self, _id, default = None):
+        try:
+            return self[_id]
+        except KeyError:
+            return default
+
+    def has_key(self, _id):
+        return bool(self.contains([_id])[0])
+
+    __contains__ = has_key
+        
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """the ids in row order"""
+        return _python_ids(self._ids)
+
+    def values(self):
+        return range(len(self._ids))
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, ArrayIndexMapping)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return (eq if eq is NotImplemented else not eq)
+
+    def __repr__(self):
+        return "ArrayIndexMapping(%d ids)" %len(self)
+
+class ArrayReverseIndexMapping(object):
+    """
+    Matrix row index to object id mapping, backed by the id array in row order
+
+    It can be used as a read-only dict. Besides, `ids` translates a list of rows in one go
+    """
+    def __init__(self, ids):
+        """
+        ids: list or array of integer or string, the object ids in row order
+        """
+        self._ids = _id_array(ids)
+
+    def ids(self, rows):
+        """
+        the ids at the rows
+        
+        Param:
+        rows: list or array of integer
+        
+        Return:
+        list of integer or string
+        
+        Raise:
+        KeyError if any row is out of range
+        """
+        rows = np.asarray(rows, dtype = np.int64)
+        out_of_range = (rows < 0) | (rows >= len(self._ids))
+        if out_of_range.any():
+            raise KeyError(rows[out_of_range][0])
+        return _python_ids(self._ids, rows.tolist())
+        
+    def __getitem__(self, ind):
+        try:
+            ind = int(ind)
+        except (TypeError, ValueError):
+            raise KeyError(ind)
+        return self.ids([ind])[0]
+        
+    def get(self, ind, default = None):
+        try:
+            return self[ind]
+        except KeyError:
+            return default
+
+    def has_key(self, ind):
+        try:
+            return 0 <= int(ind) < len(self._ids)
+        except (TypeError, ValueError):
+            return False
+
+    __contains__ = has_key
+    
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return range(len(self._ids))
+
+    def values(self):
+        return _python_ids(self._ids)
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, ArrayReverseIndexMapping)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return (eq if eq is NotImplemented else not eq)
+
+    def __repr__(self):
+        return "ArrayReverseIndexMapping(%d ids)" %len(self)
+        
+def ids_to_rows(id2ind_map, ids):
+    """
+    translate the ids to matrix rows, by `ArrayIndexMapping.rows` or by a dict
+    
+    Return:
+    array of int32
+    """
+    if isinstance(id2ind_map, ArrayIndexMapping):
+        return id2ind_map.rows(ids)
+    else:
+        return np.array([id2ind_map[_id] for _id in ids], dtype = np.int32)
 
+def rows_to_ids(ind2id_map, rows):
+    """
+    translate the matrix rows to ids, by `ArrayReverseIndexMapping.ids` or by a dict
+    
+    Return:
+    list
+    """
+    if isinstance(ind2id_map, ArrayReverseIndexMapping):
+        return ind2id_map.ids(rows)
+    else:
+        return [ind2id_map[ind] for ind in np.asarray(rows).tolist()]
+
+def csr_row(m, row):
+    """
+    the column indices and values of the nonzero entries in the row of the CSR matrix
 
+    They are views over the matrix arrays, nothing is copied
+    
+    Return:
+    (array of int, array of float)
+    """
+    start, end = m.indptr[row], m.indptr[row + 1]
+    return m.indices[start:end], m.data[start:end]
+
+def has_ids(id2ind_map, ids):
+    """
+    whether each of the ids is in the mapping
+    
+    Return:
+    array of bool
+    """
+    if isinstance(id2ind_map, ArrayIndexMapping):
+        return id2ind_map.contains(ids)
+    else:
+        return np.array([id2ind_map.has_key(_id) for _id in ids], dtype = bool)
+        
 class FeatureMatrixAndIndexMapping(object):
     """
     Feature matrix and indexing mapping for documents and keywords
@@ -183,16 +673,32 @@ class FeatureMatrixAndIndexMapping(object):
     Comment:
     The "_" prefixing all the properties is strange. Better make it public
     """
-    DICT_FIELDS = ["kw_ind", "doc_ind", "kw_ind_r", "doc_ind_r", "kw2doc_m", "doc2kw_m"]
+    DICT_FIELDS = ["kw_ind", "doc_ind", "kw_ind_r", "doc_ind_r", "kw2doc_m", "doc2kw_m", "kw2doc_m_csc", "doc2kw_m_csc"]
     
     @property
     def kw2doc_m(self):
+        """in CSR format"""
         return self.__kw2doc_m
 
     @property
     def doc2kw_m(self):
+        """in CSR format"""
         return self.__doc2kw_m
 
+    @property
+    def kw2doc_m_csc(self):
+        """kw2doc_m in CSC format, for column selection"""
+        if self.__kw2doc_m_csc is None:#cache it if not exist
+            self.__kw2doc_m_csc = self.__kw2doc_m.tocsc()
+        return self.__kw2doc_m_csc
+
+    @property
+    def doc2kw_m_csc(self):
+        """doc2kw_m in CSC format, for column selection"""
+        if self.__doc2kw_m_csc is None:#cache it if not exist
+            self.__doc2kw_m_csc = self.__doc2kw_m.tocsc()
+        return self.__doc2kw_m_csc
+
     @property
     def kw_ind(self):
         return self.__kw_ind
@@ -204,13 +710,19 @@ class FeatureMatrixAndIndexMapping(object):
     @property
     def kw_ind_r(self):                
         if self.__kw_ind_r is None:#cache it if not exist
-            self.__kw_ind_r = dict([(ind, kw ) for kw, ind in self.__kw_ind.items()])
+            if isinstance(self.__kw_ind, ArrayIndexMapping):
+                self.__kw_ind_r = self.__kw_ind.reverse()
+            else:
+                self.__kw_ind_r = dict([(ind, kw ) for kw, ind in self.__kw_ind.items()])
         return self.__kw_ind_r
 
     @property
     def doc_ind_r(self):
         if self.__doc_ind_r is None:#cache it if not exist
-            self.__doc_ind_r = dict([(ind, doc_id ) for doc_id, ind in self.__doc_ind.items()])
+            if isinstance(self.__doc_ind, ArrayIndexMapping):
+                self.__doc_ind_r = self.__doc_ind.reverse()
+            else:
+                self.__doc_ind_r = dict([(ind, doc_id ) for doc_id, ind in self.__doc_ind.items()])
         return self.__doc_ind_r
 
     @property
@@ -219,15 +731,20 @@ class FeatureMatrixAndIndexMapping(object):
         return dict([(field, getattr(self, "%s" %field))
                      for field in  self.__class__.DICT_FIELDS])
 
-    def __init__(self, kw_ind, doc_ind, kw2doc_m, doc2kw_m, kw_ind_r = None, doc_ind_r = None):
+    def __init__(self, kw_ind, doc_ind, kw2doc_m, doc2kw_m, kw_ind_r = None, doc_ind_r = None, 
+                 kw2doc_m_csc = None, doc2kw_m_csc = None):
         """
-        kw_ind: keyword id to matrix row index mapping
-        doc_ind: doc id to matirx row index mapping
+        kw_ind: keyword id to matrix row index mapping, dict or ArrayIndexMapping
+        doc_ind: doc id to matirx row index mapping, dict or ArrayIndexMapping
         doc2kw_m: doc to keyword matrix
         kw2doc_m: keyword to doc matrix
+        kw2doc_m_csc, doc2kw_m_csc: the above two matrices in CSC format, computed if not given
         """
-        self.__doc2kw_m = doc2kw_m
-        self.__kw2doc_m = kw2doc_m
+        self.__doc2kw_m = doc2kw_m.tocsr()
+        self.__kw2doc_m = kw2doc_m.tocsr()
+
+        self.__doc2kw_m_csc = doc2kw_m_csc
+        self.__kw2doc_m_csc = kw2doc_m_csc
         
         self.__kw_ind = kw_ind
         self.__doc_ind = doc_ind
@@ -1,13 +1,94 @@
 import functools
+import threading
+import time
 
+from scinet3.util.cache import LRUCache
 
-def memoized(obj):
-    cache = obj.cache = {}
+#the memoized functions, by "module.function:line", for inspecting the caches at runtime
+memoized_functions = {}
+
+def _key_of(arg):
+    """
+    the hashable cache key of the argument
+
+    Objects with `memo_key`(e.g, Document, Keyword and the model lists) are identified by it,
+    other arguments should be hashable themselves
+    """
+    memo_key = getattr(arg, "memo_key", None)
+    if memo_key is not None:
+        return memo_key
+    hash(arg) #raise TypeError if unhashable
+    return arg
+
+def memoized(obj = None, maxsize = 10000, ttl = None):
+    """
+    Cache the results of the function, by the arguments
+
+    It can be used as `@memoized` or `@memoized(maxsize = ..., ttl = ...)`
+
+    The cache holds at most `maxsize` results(None for unbounded), the least recently used are evicted.
+    If `ttl` is given, the results expire after `ttl` seconds.
+    Calls with unhashable arguments are not cached.
+
+    The decorated function has:
+    - `cache_info()`: dict of the number of "hits", "misses", "evictions", the "size" and "maxsize"
+    - `cache_clear()`: empty the cache and reset the counters
+    """
+    if obj is None:
+        return lambda obj: memoized(obj, maxsize = maxsize, ttl = ttl)
+
+    cache = LRUCache(maxsize)
+    lock = threading.RLock()
+    stats = {"hits": 0, "misses": 0}
 
     @functools.wraps(obj)
     def memoizer(*args, **kwargs):
-        key = str(args) + str(kwargs)
-        if key not in cache:
-            cache[key] = obj(*args, **kwargs)
-        return cache[key]
+        try:
+            key = (tuple([_key_of(arg) for arg in args]),
+                   tuple(sorted([(name, _key_of(value)) for name, value in kwargs.items()])))
+        except TypeError: #unhashable
+            with lock:
+                stats["misses"] += 1
+            return obj(*args, **kwargs)
+
+        with lock:
+            entry = cache.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                stats["hits"] += 1
+                return entry[0]
+            stats["misses"] += 1
+
+        #computed out of the lock, as it may call other memoized functions
+        value = obj(*args, **kwargs)
+
+        with lock:
+            cache.put(key, (value,
+                            (time.time() + ttl) if ttl is not None else None))
+        return value
+
+    def cache_info():
+        with lock:
+            return {"hits": stats["hits"], "misses": stats["misses"],
+                    "evictions": cache.evictions,
+                    "size": len(cache), "maxsize": cache.maxsize}
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+            cache.evictions = 0
+            stats["hits"] = stats["misses"] = 0
+
+    memoizer.cache = cache
+    memoizer.cache_info = cache_info
+    memoizer.cache_clear = cache_clear
+
+    memoized_functions["%s.%s:%d" %(obj.__module__, obj.__name__, obj.func_code.co_firstlineno)] = memoizer
     return memoizer
+
+def cache_infos():
+    """
+    Return:
+    dict, the name of memoized function -> its `cache_info()`
+    """
+    return dict([(name, func.cache_info())
+                 for name, func in memoized_functions.items()])
@@ -0,0 +1,218 @@
+#############################
+# Columnar document store:
+#
+# The document table is kept column by column,
+# aligned with the document matrix rows(`doc_ind`):
+# 1. string fields: utf-8 encoded, appended to one buffer per field, with start and end arrays
+# 2. integer/float fields: numpy arrays
+# 3. other fields: plain list
+#
+# The keywords are not stored, as they are in the feature matrix already.
+#############################
+
+__all__ = ["DocumentStore", "DocumentSequence"]
+
+from types import (IntType, LongType, FloatType, StringType, UnicodeType, NoneType)
+
+import numpy as np
+from cStringIO import StringIO
+
+class StringColumn(object):
+    """
+    strings appended to one buffer as the rows come, 
+    the one at position i is buffer[starts[i]:ends[i]]
+    """
+    def __init__(self, n):
+        self._buffer = StringIO()
+        self._size = 0
+        
+        self.starts = np.zeros(n, dtype = np.int64)
+        self.ends = np.zeros(n, dtype = np.int64)
+        self.nulls = np.ones(n, dtype = bool)
+        
+        self.buffer = None #set by `finish`
+
+    def accepts(self, value):
+        return type(value) in (StringType, UnicodeType)
+        
+    def set(self, pos, value):
+        if type(value) is UnicodeType:
+            value = value.encode("utf-8")
+
+        self._buffer.write(value)
+        self.starts[pos] = self._size
+        self._size += len(value)
+        self.ends[pos] = self._size
+        self.nulls[pos] = False
+
+    def finish(self):
+        self.buffer = self._buffer.getvalue()
+        self._buffer = None
+        return self
+        
+    def __getitem__(self, pos):
+        if self.nulls[pos]:
+            return None
+        return self.buffer[self.starts[pos]:self.ends[pos]].decode("utf-8")
+
+class ArrayColumn(object):
+    """
+    numbers kept in a numpy array, integers are turned into floats once a float comes
+    """
+    def __init__(self, n, dtype):
+        self.nulls = np.ones(n, dtype = bool)
+        self.values = np.zeros(n, dtype = dtype)
+
+    def accepts(self, value):
+        return type(value) in (IntType, LongType, FloatType)
+        
+    def set(self, pos, value):
+        if type(value) is FloatType and self.values.dtype != np.float64:
+            self.values = self.values.astype(np.float64)
+            
+        self.values[pos] = value
+        self.nulls[pos] = False
+
+    def finish(self):
+        return self
+        
+    def __getitem__(self, pos):
+        if self.nulls[pos]:
+            return None
+        return self.values[pos].item()
+
+class ListColumn(list):
+    """
+    values of any other type, in a plain list
+    """
+    def __init__(self, n, values = None):
+        list.__init__(self, values or [None] * n)
+
+    def accepts(self, value):
+        return True
+        
+    def set(self, pos, value):
+        self[pos] = value
+
+    def finish(self):
+        return self
+
+def _make_column(value, n):
+    """
+    the most compact column for the value, None if the type is not known yet
+    """
+    if value is None:
+        return None
+    elif type(value) in (StringType, UnicodeType):
+        return StringColumn(n)
+    elif type(value) in (IntType, LongType):
+        return ArrayColumn(n, np.int64)
+    elif type(value) is FloatType:
+        return ArrayColumn(n, np.float64)
+    else:
+        return ListColumn(n)
+
+class DocumentStore(object):
+    """
+    The document table in columns, the document at matrix row i is at position i
+    """
+    def __init__(self, doc_ind, rows, exclude_fields = ("keywords", )):
+        """
+        doc_ind: dict or ArrayIndexMapping, document id to matrix row
+        rows: iterable of dict, the table rows(a database cursor is fine). 
+              They are written into the columns one by one, not kept
+        exclude_fields: list of string, the fields not to be stored
+        """
+        n = len(doc_ind)
+
+        self.present = np.zeros(n, dtype = bool) #whether the document at the row is in the table
+        self.leftover_rows = [] #rows not in the matrix
+
+        columns = {} #field -> column, None if only None values are seen so far
+        for row in rows:
+            pos = doc_ind.get(row["id"])
+            if pos is None:
+                self.leftover_rows.append(row)
+                continue
+
+            self.present[pos] = True
+            for field, value in row.items():
+                if field in exclude_fields:
+                    continue
+
+                column = columns.get(field)
+                if column is None:
+                    column = columns[field] = _make_column(value, n)
+                    if column is None:
+                        continue
+                elif value is None:
+                    continue
+                elif not column.accepts(value): #mixed types, fall back to a list
+                    column.finish()
+                    column = columns[field] = ListColumn(n, [column[i] for i in xrange(n)])
+
+                column.set(pos, value)
+
+        self.doc_ind = doc_ind
+        self.fields = columns.keys()
+        self.columns = dict([(field, (ListColumn(n) if column is None else column.finish()))
+                             for field, column in columns.items()])
+
+    def has(self, doc_id):
+        """
+        whether the document is in the store
+        """
+        pos = self.doc_ind.get(doc_id)
+        return pos is not None and bool(self.present[pos])
+
+    def row(self, pos):
+        """
+        the fields of the document at `pos` as a dict
+        """
+        return dict([(field, self.columns[field][pos])
+                     for field in self.fields])
+
+    def positions(self):
+        """
+        the positions of the documents in the store
+        """
+        return np.flatnonzero(self.present)
+
+    def __len__(self):
+        return int(self.present.sum())
+
+class DocumentSequence(object):
+    """
+    Read-only sequence of the documents in the store,
+    the `Document` views are created when accessed
+    """
+    def __init__(self, store, view):
+        """
+        store: DocumentStore
+        view: function that makes the document at the given position
+        """
+        self.store = store
+        self.view = view
+        self._positions = store.positions()
+
+    @property
+    def ids(self):
+        """
+        the document ids, without creating the views
+        """
+        return self.store.columns["id"].values[self._positions].tolist()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.view(pos) for pos in self._positions[i].tolist()]
+        return self.view(int(self._positions[i]))
+
+    def __iter__(self):
+        for pos in self._positions.tolist():
+            yield self.view(pos)
+
+    def __repr__(self):
+        return "DocumentSequence(%d documents)" %len(self)
@@ -12,7 +12,35 @@
 # The **how** part is defined in **fb_receiver.py**.
 ##########################
 
+import numpy as np
+from scipy.sparse import diags
+
+from scinet3.model import (Document, Keyword)
+from scinet3.data import (ids_to_rows, rows_to_ids)
+from scinet3.util.cache import LRUCache
+
 class FeedbackPropagator(object):
+    @classmethod
+    def propagate(cls, feedbacks, session):
+        """
+        Propagate the whole feedback payload, one feedback at a time
+        
+        The format of feedback is:
+        {
+        "docs": [[doc_id, feedback_value], ...],
+        "kws": [[keyword_id, feedback_value], ...],
+        "dockws": [[keyword_id, doc_id, feedback_value], ...]
+        }
+        """
+        for doc_id, fb in feedbacks.get("docs", []):
+            cls.fb_from_doc(Document.get(doc_id), fb, session)
+
+        for kw_id, fb in feedbacks.get("kws", []):
+            cls.fb_from_kw(Keyword.get(kw_id), fb, session)
+
+        for kw_id, doc_id, fb in feedbacks.get("dockws", []):
+            cls.fb_from_dockw(Keyword.get(kw_id), Document.get(doc_id), fb, session)
+
     @classmethod
     def fb_from_doc(cls, doc, fb_numer, session):
         raise NotImplementedError
@@ -33,6 +61,19 @@ class OnePassPropagator(FeedbackPropagator):
     """
     Propagates the feedback only once
     """
+    @classmethod
+    def propagate(cls, feedbacks, session):
+        """
+        Propagate the whole feedback payload in a batch:
+        the receiver updates are merged in memory and written to the session in one pipeline
+        
+        feedbacks: see `FeedbackPropagator.propagate`
+        """
+        batch = session.write_batch()
+        
+        super(OnePassPropagator, cls).propagate(feedbacks, batch)
+
+        batch.flush()
     
     @classmethod
     def fb_from_doc(cls, doc, fb_numer, session):
@@ -62,12 +103,13 @@ class OnePassPropagator(FeedbackPropagator):
         kw.rec_fb_from_kw(kw, fb_numer, session)
         
         #from keywords to associated docs
-        for doc in kw.docs:
+        docs = kw.docs
+        for doc in docs:
             doc.rec_fb_from_kw(kw, fb_numer, session)
 
         #those objects' feedback shall be updated
         session.add_affected_kws(kw)
-        session.add_affected_docs(*kw.docs)
+        session.add_affected_docs(*docs)
         
     @classmethod
     def fb_from_dockw(cls, kw, doc, fb_numer, session):
@@ -87,6 +129,149 @@ class OnePassPropagator(FeedbackPropagator):
 
 class IterativePropagator(FeedbackPropagator):
     """
-    Iteratively propagates the feedback
+    Iteratively propagates the feedback over the keyword-document graph(`kw2doc_m`/`doc2kw_m`)
+    
+    The feedback values are the seed vectors `s_kw` and `s_doc`. 
+    The scores are the fixed point of:
+    
+    x_kw = s_kw + damping * P_kw2doc * x_doc
+    x_doc = s_doc + damping * P_doc2kw * x_kw
+    
+    where P_* are the row normalized matrices. 
+    The explicit feedbacks keep their full weight, only the propagated part is damped.
+    It is computed by sparse matrix-vector products(Gauss-Seidel style) 
+    until the scores change less than `tol` or `max_iter` iterations are done.
+    
+    The feedback from in-document keyword seeds the keyword.
+
+    The keywords/documents whose score is above `min_fb` receive the score as feedback from themselves 
+    and are marked as affected. 
+    As there is no feedback from the other kind of objects, 
+    the updater(e.g, `OverrideUpdater`) weights the score by alpha
     """
-    pass
+    damping = 0.5
+    tol = 1e-6
+    max_iter = 50
+    min_fb = 1e-3
+    
+    #matrix id -> (matrix, row normalized matrix)
+    #the matrix is kept, so its id is not reused while cached; the old corpora's matrices are evicted
+    _normalized_matrices = LRUCache(4)
+
+    @classmethod
+    def config(cls, **kwargs):
+        """
+        set `damping`, `tol`, `max_iter` or `min_fb`
+
+        The parameters are validated before any of them is set
+        """
+        for key in kwargs:
+            assert key in ("damping", "tol", "max_iter", "min_fb"), "unknown parameter %r" %key
+
+        damping = kwargs.get("damping", cls.damping)
+        tol = kwargs.get("tol", cls.tol)
+        max_iter = kwargs.get("max_iter", cls.max_iter)
+        min_fb = kwargs.get("min_fb", cls.min_fb)
+        
+        assert 0 <= damping < 1, "damping should be in [0, 1), but is %r" %damping
+        assert tol > 0, "tol should be positive, but is %r" %tol
+        assert max_iter >= 1, "max_iter should be at least 1, but is %r" %max_iter
+        assert min_fb >= 0, "min_fb should be non-negative, but is %r" %min_fb
+
+        for key, value in kwargs.items():
+            setattr(cls, key, value)
+
+    @classmethod
+    def _row_normalized(cls, m):
+        """
+        the matrix with each row divided by its sum, cached
+        """
+        entry = cls._normalized_matrices.get(id(m))
+        if entry is None or entry[0] is not m:
+            row_sums = np.asarray(m.sum(1)).ravel()
+            inv_row_sums = np.zeros(len(row_sums))
+            inv_row_sums[row_sums != 0] = 1. / row_sums[row_sums != 0]
+
+            entry = (m, diags(inv_row_sums, 0) * m)
+            cls._normalized_matrices.put(id(m), entry)
+        
+        return entry[1]
+
+    @classmethod
+    def seeds(cls, feedbacks):
+        """
+        the seed vectors from the feedback payload(see `FeedbackPropagator.propagate`)
+        
+        Return:
+        (array: keyword seeds over `Keyword.kw_ind`, array: document seeds over `Document.doc_ind`)
+        """
+        s_kw = np.zeros(Keyword.kw2doc_m.shape[0])
+        s_doc = np.zeros(Document.doc2kw_m.shape[0])
+        
+        def set_seeds(s, id2ind_map, ids, fbs):
+            if ids:
+                s[ids_to_rows(id2ind_map, ids)] = fbs
+                
+        set_seeds(s_doc, Document.doc_ind, 
+                  [doc_id for doc_id, _ in feedbacks.get("docs", [])], 
+                  [fb for _, fb in feedbacks.get("docs", [])])
+        
+        for name in ("kws", "dockws"):
+            set_seeds(s_kw, Keyword.kw_ind,
+                      [fb[0] for fb in feedbacks.get(name, [])], 
+                      [fb[-1] for fb in feedbacks.get(name, [])])
+            
+        return s_kw, s_doc
+    
+    @classmethod
+    def iterate(cls, s_kw, s_doc):
+        """
+        Param:
+        s_kw, s_doc: the seed vectors, see `seeds`
+
+        Return:
+        (array: keyword scores, array: document scores, integer: number of iterations done)
+        """
+        P_kw2doc = cls._row_normalized(Keyword.kw2doc_m)
+        P_doc2kw = cls._row_normalized(Document.doc2kw_m)
+
+        x_kw, x_doc = np.zeros(len(s_kw)), np.zeros(len(s_doc))
+        iter_n = 0
+        while iter_n < cls.max_iter:
+            new_x_kw = s_kw + cls.damping * P_kw2doc.dot(x_doc)
+            new_x_doc = s_doc + cls.damping * P_doc2kw.dot(new_x_kw) #the updated keyword scores are used right away
+
+            delta = max(np.abs(new_x_kw - x_kw).max(), np.abs(new_x_doc - x_doc).max())
+            x_kw, x_doc = new_x_kw, new_x_doc
+            iter_n += 1
+
+            if delta < cls.tol:
+                break
+            
+        return x_kw, x_doc, iter_n
+
+    @classmethod
+    def propagate(cls, feedbacks, session):
+        """
+        Propagate the whole feedback payload, see the class docstring
+
+        feedbacks: see `FeedbackPropagator.propagate`
+        """
+        x_kw, x_doc, _ = cls.iterate(*cls.seeds(feedbacks))
+        
+        batch = session.write_batch()
+
+        kw_idx = np.flatnonzero(x_kw > cls.min_fb)
+        kws = Keyword.get_many(rows_to_ids(Keyword.kw_ind_r, kw_idx))
+        for kw, fb in zip(kws, x_kw[kw_idx].tolist()):
+            kw.rec_fb_from_kw(kw, fb, batch)
+            
+        doc_idx = np.flatnonzero(x_doc > cls.min_fb)
+        docs = Document.get_many(rows_to_ids(Document.doc_ind_r, doc_idx))
+        for doc, fb in zip(docs, x_doc[doc_idx].tolist()):
+            doc.rec_fb_from_doc(doc, fb, batch)
+        
+        batch.add_affected_kws(*kws)
+        batch.add_affected_docs(*docs)
+
+        batch.flush()
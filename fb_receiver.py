@@ -109,8 +109,9 @@ class KeywordFeedbackReceiver(object):
         2. if there are no feedbacks from the keyword itself, then alpha value is set to 0
         3. Only the weights of documents being recommended most recently are considered for weighting
         """
+        last_recom_doc_ids = session.last_recom_doc_ids
         considered_docs = [doc for doc in self._doc_weight.keys() 
-                           if doc in session.last_recom_docs] #those appeared in last_recom_docs
+                           if doc.id in last_recom_doc_ids] #those appeared in last_recom_docs
 
         doc_weight_sum = sum([self._doc_weight[doc] 
                               for doc in considered_docs])
@@ -1,6 +1,11 @@
 """
 Defines the logic of how feedbacks of documents and keywords should be updated(e.g, replace or mixed with the old one?)
 """
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from scinet3.model import (Document, Keyword)
+from scinet3.data import (ids_to_rows, has_ids)
 
 class OverrideUpdater(object):
     """
@@ -18,12 +23,185 @@ class OverrideUpdater(object):
         
         session.clean_affected_objects()
 
+class VectorizedOverrideUpdater(OverrideUpdater):
+    """
+    The same as `OverrideUpdater`, but the weighted sums(see `fb_weighted_sum` in fb_receiver.py) 
+    are computed for all the affected objects at once, 
+    using the keyword/document matrix weights and sparse matrix products.
+    
+    The received feedbacks are read in one pipeline per kind and the results written in one batch.
+
+    Where `fb_weighted_sum` would divide by a zero weight sum, the quotient is taken as 0
+    """
+    @classmethod
+    def _received_fb_matrix(cls, fb_dicts, col_ind, col_n):
+        """
+        Sparse matrix, one row per receiver, holding the feedbacks received from the other kind of objects
+
+        fb_dicts: list of dict(object id -> feedback), one per receiver
+        col_ind: dict or ArrayIndexMapping, object id to matrix column index
+        col_n: integer, number of columns
+        """
+        rows, ids, data = [], [], []
+        for row, fbs in enumerate(fb_dicts):
+            for _id, fb in fbs.items():
+                rows.append(row)
+                ids.append(_id)
+                data.append(fb)
+        return csr_matrix((data, (rows, ids_to_rows(col_ind, ids))), shape = (len(fb_dicts), col_n))
+
+    @classmethod
+    def _weighted_sum(cls, alpha, self_fbs, numerators, denominators):
+        """
+        alpha * self_fbs + (1 - alpha) * numerators / denominators,  
+        or numerators / denominators where self_fbs is 0
+        """
+        ratio = np.zeros(len(numerators))
+        nonzero = (denominators != 0)
+        ratio[nonzero] = numerators[nonzero] / denominators[nonzero]
+
+        return np.where(self_fbs == 0, ratio, alpha * self_fbs + (1 - alpha) * ratio)
+
+    @classmethod
+    def update(cls, session):
+        kw_ids = list(session.sget("affected_kws"))
+        doc_ids = list(session.sget("affected_docs"))
+
+        #keywords
+        if kw_ids:
+            kw_idx = ids_to_rows(Keyword.kw_ind, kw_ids)
+            W = Keyword.kw2doc_m[kw_idx, :]
+            
+            self_fbs = np.array(session.get_many([Keyword._KEY_TMPL_FB_KW %kw_id for kw_id in kw_ids], 0.0), 
+                                dtype = np.float64)
+            F = cls._received_fb_matrix(session.hgetall_many([Keyword._KEY_TMPL_FB_DOC %kw_id for kw_id in kw_ids]), 
+                                        Keyword.doc_ind, W.shape[1])
+
+            #only the most recently recommended documents count in the weight sum, those not in the matrix are left out
+            last_recom_doc_ids = list(session.last_recom_doc_ids)
+            last_recom_doc_ids = [doc_id for doc_id, indexed in zip(last_recom_doc_ids, has_ids(Keyword.doc_ind, last_recom_doc_ids))
+                                  if indexed]
+            last_recom = np.zeros(W.shape[1])
+            last_recom[ids_to_rows(Keyword.doc_ind, last_recom_doc_ids)] = 1
+
+            fbs = cls._weighted_sum(Keyword.alpha, self_fbs, 
+                                    np.asarray(W.multiply(F).sum(1)).ravel(), 
+                                    W.dot(last_recom))
+            session.update_kw_fb_vec(kw_idx, fbs)
+            
+        #documents
+        if doc_ids:
+            doc_idx = ids_to_rows(Document.doc_ind, doc_ids)
+            W = Document.doc2kw_m[doc_idx, :]
+
+            self_fbs = np.array(session.get_many([Document._KEY_TMPL_FB_DOC %doc_id for doc_id in doc_ids], 0.0), 
+                                dtype = np.float64)
+            F = cls._received_fb_matrix(session.hgetall_many([Document._KEY_TMPL_FB_KW %doc_id for doc_id in doc_ids]), 
+                                        Document.kw_ind, W.shape[1])
+
+            fbs = cls._weighted_sum(Document.alpha, self_fbs, 
+                                    np.asarray(W.multiply(F).sum(1)).ravel(), 
+                                    np.asarray(W.sum(1)).ravel())
+            session.update_doc_fb_vec(doc_idx, fbs)
+
+        #the loop is done for all of them
+        session.delete(*([Keyword._KEY_TMPL_FB_KW %kw_id for kw_id in kw_ids] + 
+                         [Keyword._KEY_TMPL_FB_DOC %kw_id for kw_id in kw_ids] + 
+                         [Document._KEY_TMPL_FB_KW %doc_id for doc_id in doc_ids] + 
+                         [Document._KEY_TMPL_FB_DOC %doc_id for doc_id in doc_ids]))
+        
+        session.clean_affected_objects()
+
 class MeanUpdater(object):
     """
     The mean of all feedback values in history is calculated and updated
+
+    The feedback value of the current loop is the same as in `OverrideUpdater`.
+    Only the running count and sum of each keyword/document are kept in session(see `session.add_kw_fb_stats`), 
+    so the history is never scanned
     """
     @classmethod
-    def update(cls, session, docs, kws):
+    def _loop_fbs(cls, objs, session):
         """
+        the feedbacks of the current loop, after which the loop is done
+        
+        Return:
+        dict, object id -> feedback
         """
+        fbs = {}
+        for obj in objs:
+            fbs[obj.id] = obj.fb_weighted_sum(session)
+            obj.loop_done(session)
+        return fbs
+
+    #weight of the feedback in the exponential moving average kept in the statistics, None as it is not needed
+    beta = None
     
+    @classmethod
+    def _summarize(cls, fb, count, fb_sum, ema):
+        """
+        the feedback to be updated to
+        
+        fb: float, feedback of the current loop
+        count, fb_sum, ema: running count, sum and exponential moving average(None if `beta` is None), 
+                            the current loop included
+        """
+        return fb_sum / count
+
+    @classmethod
+    def _update(cls, objs, fbs, stats):
+        """
+        Return:
+        list of float, the feedbacks to be updated to, one for each object in `objs`
+        """
+        return [cls._summarize(fbs[obj.id], *stats[obj.id])
+                for obj in objs]
+
+    @classmethod
+    def _indexed(cls, id2ind_map, objs, new_fbs):
+        """
+        the matrix rows and new feedbacks of the objects, those not in the matrix are left out
+        
+        Return:
+        (list of int, list of float)
+        """
+        ids = [obj.id for obj in objs]
+        indexed = has_ids(id2ind_map, ids)
+        
+        return (ids_to_rows(id2ind_map, [_id for _id, ok in zip(ids, indexed) if ok]), 
+                [fb for fb, ok in zip(new_fbs, indexed) if ok])
+        
+    @classmethod
+    def update(cls, session):
+        kws = session.affected_kws
+        kw_fbs = cls._loop_fbs(kws, session)
+        new_kw_fbs = cls._update(kws, kw_fbs, session.add_kw_fb_stats(kw_fbs, cls.beta))
+        
+        docs = session.affected_docs
+        doc_fbs = cls._loop_fbs(docs, session)
+        new_doc_fbs = cls._update(docs, doc_fbs, session.add_doc_fb_stats(doc_fbs, cls.beta))
+
+        session.update_kw_fb_vec(*cls._indexed(Keyword.kw_ind, kws, new_kw_fbs))
+        session.update_doc_fb_vec(*cls._indexed(Document.doc_ind, docs, new_doc_fbs))
+        
+        session.clean_affected_objects()
+
+class EMAUpdater(MeanUpdater):
+    """
+    The exponential moving average of the feedback values is calculated and updated:
+    
+    beta * feedback of the current loop + (1 - beta) * the previous feedback
+
+    The average is kept in the running statistics(see `session.add_kw_fb_stats`), 
+    so the previous feedbacks are not read
+    """
+    beta = 0.5
+    
+    @classmethod
+    def set_beta(cls, beta):
+        assert 0 < beta <= 1, "beta should be in (0, 1], but is %r" %beta
+        cls.beta = beta
+        
+    @classmethod
+    def _summarize(cls, fb, count, fb_sum, ema):
+        return ema
@@ -6,6 +6,8 @@ import numpy as np
 from functools import partial
 from tornado.options import options
 from scinet3.modellist import (KeywordList, DocumentList)
+from scinet3.model import (Keyword, Document)
+from scinet3.data import rows_to_ids
 
 def fb_threshold_filter(threshold, obj2fb_list):
     """
@@ -35,6 +37,19 @@ def fb_threshold_filter(threshold, obj2fb_list):
             for ind in idx.tolist()]
 
 
+def fb_vec_threshold_filter(threshold, fb_vec):
+    """
+    Filter the entries of a sparse feedback vector by feedback value
+    
+    threshold: float, the threshold value
+    fb_vec: (array of row indices, array of feedback values)
+
+    Return:
+    list of integer: the row indices
+    """
+    idx, fbs = fb_vec
+    return idx[fbs >= threshold].tolist()
+
 def kw_fb_threshold_filter(threshold, session, kws = None,  with_fb = True):
     """
     Filter keywords by feedback value
@@ -48,8 +63,9 @@ def kw_fb_threshold_filter(threshold, session, kws = None,  with_fb = True):
     KeywordList
     """
 
-    if with_fb: #do the filtering beforehand
-        kw2fb_list = session.kw_feedbacks.items()
+    if with_fb: #do the filtering beforehand, on the feedback vector
+        return KeywordList(Keyword.get_many(rows_to_ids(Keyword.kw_ind_r, 
+                                                        fb_vec_threshold_filter(threshold, session.kw_fb_vec))))
     else:
         assert kws is not None, "kws should't be None"
         kw2fb_list = [(kw, kw.fb(session)) 
@@ -71,8 +87,9 @@ def doc_fb_threshold_filter(threshold, session, docs = None,  with_fb = True):
     DocumentList
     """
 
-    if with_fb: #do the filtering beforehand
-        doc2fb_list = session.doc_feedbacks.items()
+    if with_fb: #do the filtering beforehand, on the feedback vector
+        return DocumentList(Document.get_many(rows_to_ids(Document.doc_ind_r, 
+                                                          fb_vec_threshold_filter(threshold, session.doc_fb_vec))))
     else:
         assert docs is not None, "docs should't be None"
         doc2fb_list = [(doc, doc.fb(session)) 
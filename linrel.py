@@ -1,12 +1,177 @@
 """
 the linrel algorithm
 """
+from hashlib import md5
+
 import numpy as np
 from numpy.linalg import inv
 
-from scipy.sparse import eye
+from scipy.linalg import (cho_factor, cho_solve, cholesky, solve_triangular)
+from scipy.sparse import eye, isspmatrix
+
+from scinet3.util.numerical import top_k
+
+LINREL_FORMS = ("auto", "primal", "dual")
+LINREL_SOLVERS = ("inv", "cholesky")
+
+def _dense(M):
+    """
+    sparse or dense matrix to dense matrix
+    """
+    if isspmatrix(M):
+        return M.todense()
+    return np.asmatrix(M)
 
-def linrel(y_t, D_t, D, mu, c):
+def choose_form(D_t):
+    """
+    Choose the form that inverts the smaller matrix
+
+    Parameter:
+    D_t: the feature matrix for objects given feedback so far(one row per object)
+
+    Return:
+    "primal" if the feature number is not larger than the feedback number, "dual" otherwise
+    """
+    t, feature_n = D_t.shape
+    if feature_n <= t:
+        return "primal"
+    else:
+        return "dual"
+
+def _check_solver(solver):
+    if solver not in LINREL_SOLVERS:
+        raise ValueError("solver should be one of %r, but is %r" %(LINREL_SOLVERS, solver))
+
+def primal_projection(D_t, mu, solver = "inv"):
+    """
+    inv(D_t.T * D_t + mu * I) * D_t.T, which solves a feature_n x feature_n system
+
+    solver: "inv" computes the explicit inverse,
+            "cholesky" factors the (symmetric positive definite when mu > 0) matrix once and uses triangular solves
+
+    Return:
+    dense matrix of shape feature_n x t
+    """
+    _check_solver(solver)
+    feature_n = D_t.shape[1]
+
+    print "%s(%d x %d)" %(solver, feature_n, feature_n)
+
+    inter_M = _dense(D_t.T * D_t + mu * eye(feature_n, feature_n))
+
+    if solver == "cholesky":
+        return np.asmatrix(cho_solve(cho_factor(inter_M), _dense(D_t.T)))
+    else:
+        #inter_M is symmetric, so inv(inter_M) * D_t.T == (D_t * inv(inter_M)).T
+        return (D_t * inv(inter_M)).T
+
+def dual_projection(D_t, mu, solver = "inv"):
+    """
+    D_t.T * inv(D_t * D_t.T + mu * I), which solves a t x t system
+
+    By the push-through identity, it equals to `primal_projection(D_t, mu)`
+
+    solver: the same as in `primal_projection`
+
+    Return:
+    dense matrix of shape feature_n x t
+    """
+    _check_solver(solver)
+    t = D_t.shape[0]
+
+    print "%s(%d x %d)" %(solver, t, t)
+
+    inter_M = _dense(D_t * D_t.T + mu * eye(t, t))
+
+    if solver == "cholesky":
+        #inter_M is symmetric, so D_t.T * inv(inter_M) == (inv(inter_M) * D_t).T
+        return np.asmatrix(cho_solve(cho_factor(inter_M), _dense(D_t))).T
+    else:
+        return D_t.T * inv(inter_M)
+
+def projection(D_t, mu, form = "auto", solver = "inv"):
+    """
+    The feature_n x t matrix W, such that D * W is the LinRel a_t matrix
+
+    form, solver: see `linrel`
+    """
+    if form == "auto":
+        form = choose_form(D_t)
+
+    if form == "primal":
+        return primal_projection(D_t, mu, solver)
+    elif form == "dual":
+        return dual_projection(D_t, mu, solver)
+    else:
+        raise ValueError("form should be one of %r, but is %r" %(LINREL_FORMS, form))
+
+def linrel_scores(y_t, D, W, c):
+    """
+    LinRel scores given the projection matrix W(see `projection`)
+
+    Return:
+    the same as `linrel`
+    """
+    a_t = D * W
+
+    explt_scores = a_t * y_t
+    explr_scores = np.sqrt(np.array(np.power(a_t, 2).sum(1))) * c / 2
+
+    if hasattr(explt_scores, 'todense'): #if sparse, then to dense
+        explt_scores = explt_scores.todense()
+
+    scores = explt_scores + explr_scores
+    return scores, explt_scores, explr_scores
+
+def _to_array(M):
+    """
+    column matrix(sparse or dense) to 1d array
+    """
+    if isspmatrix(M):
+        M = M.toarray()
+    return np.asarray(M).ravel()
+
+def linrel_top_n(y_t, D, W, c, top_n, block_size = None):
+    """
+    The top_n rows of D by LinRel score given the projection matrix W(see `projection`)
+
+    D is evaluated in blocks of block_size rows with a running top_n,
+    so only a block_size x t slice of the a_t matrix is in memory at a time
+    
+    Parameter:
+    y_t, D, c: see `linrel`
+    W: the projection matrix
+    top_n: integer, the number of rows to select
+    block_size: integer, the number of rows per block. If None, D is evaluated as a whole
+
+    Return:
+    (row indices, scores, exploitation scores, exploration scores), all arrays ordered by score in descending order
+    """
+    n = D.shape[0]
+    block_size = block_size or max(n, 1)
+
+    best_idx = np.array([], dtype = np.int64)
+    best_scores, best_explt, best_explr = np.array([]), np.array([]), np.array([])
+    
+    for start in xrange(0, n, block_size):
+        a_t = D[start:start + block_size, :] * W
+
+        explt = _to_array(a_t * y_t)
+        explr = np.sqrt(_to_array(np.multiply(a_t, a_t).sum(1))) * c / 2
+        
+        #previous best rows come first and have smaller row indices,
+        #so ties are still broken by row index
+        idx = np.concatenate([best_idx, np.arange(start, start + a_t.shape[0])])
+        scores = np.concatenate([best_scores, explt + explr])
+        explt = np.concatenate([best_explt, explt])
+        explr = np.concatenate([best_explr, explr])
+
+        sel = top_k(scores, top_n)
+        best_idx, best_scores, best_explt, best_explr = idx[sel], scores[sel], explt[sel], explr[sel]
+
+    return best_idx, best_scores, best_explt, best_explr
+
+def linrel(y_t, D_t, D, mu, c, form = "auto", solver = "inv"):
     """
     Parameter:
     y_t: the feedbacks so far
@@ -14,28 +179,157 @@ def linrel(y_t, D_t, D, mu, c):
     D: the feature matrix for the whole object set
     mu: parameter \mu
     c: paramter c
+    form: "primal", "dual" or "auto".
+          "primal" inverts a feature_n x feature_n matrix, "dual" inverts a t x t matrix
+          "auto" picks the one that inverts the smaller matrix
+    solver: "inv" or "cholesky", how the regularized Gram matrix is inverted
 
     Return:
     scores: dense matrix
     exploration_scores: as the name implies
-    exploitation_scores: as the name implies 
+    exploitation_scores: as the name implies
     """
     print "doing linrel.."
-    feature_n = D_t.shape[1] #the feature number
-    
-    print "inv(%d x %d)" %(feature_n, feature_n)
-    
-    inter_M = (D_t.T * D_t + mu * eye(feature_n, feature_n)).todense()
-    
-    
-    
-    a_t = D * inv(inter_M) * D_t.T 
-    
-    explt_scores = a_t * y_t
-    explr_scores = np.sqrt(np.array(np.power(a_t, 2).sum(1))) * c / 2
-    
-    if hasattr(explt_scores, 'todense'): #if sparse, then to dense
-        explt_scores = explt_scores.todense()
+
+    W = projection(D_t, mu, form, solver)
+
+    return linrel_scores(y_t, D, W, c)
+
+def feature_key(M, cols = None):
+    """
+    Key of the feature columns, telling whether two feature matrices share the same columns
+
+    It is made of the shape and the number of non-zeros of the whole feature matrix(which change when the matrix is rebuilt), 
+    so nothing is hashed unless only some of the columns are selected
+
+    Parameter:
+    M: the whole feature matrix
+    cols(optional): array of integer, the columns of M selected(in order), None if all of them are
+
+    Return:
+    string
+    """
+    key = "%dx%d/%d" %(M.shape[0], M.shape[1], M.nnz)
+    if cols is not None:
+        key += "/%s" %md5(np.asarray(cols, dtype = np.int64).tostring()).hexdigest()
+    return key
+
+class LinRelState(object):
+    """
+    Dual form LinRel state that persists across the iterations of a session.
+
+    For the rows(identified by object ids) that received feedback so far, it keeps M = D_t * D_t.T + mu * I, 
+    factorized by the solver(see `LINREL_SOLVERS`): 
+    "inv" keeps inv(M), "cholesky" keeps the lower triangular factor L of M = L * L.T.
+    Rows arriving later are added by a block(bordered) update of the factor,
+    so an iteration with k new rows costs O(t^2 * k) instead of O(t^3).
+
+    The state is rebuilt when the feature set, mu or the solver changes, or when some of its rows are gone.
+    """
+    SESSION_KEY_TMPL = "linrel_state_%s"
+
+    def __init__(self, ids = None, factor = None, feature_key = None, mu = None, solver = None):
+        self.ids = list(ids or [])
+        self.factor = (factor if factor is not None else np.zeros((0, 0)))
+        self.feature_key = feature_key
+        self.mu = mu
+        self.solver = solver
+
+    @classmethod
+    def load(cls, session, name):
+        """
+        load the state called `name` from the session, an empty state if not there
+        """
+        data = session.get(cls.SESSION_KEY_TMPL %name)
+        if data is None:
+            return cls()
+        if data.has_key("inv_M"): #saved by the older versions
+            data["factor"], data["solver"] = data.pop("inv_M"), "inv"
+        return cls(**data)
+
+    def save(self, session, name):
+        session.set(self.SESSION_KEY_TMPL %name, 
+                    {"ids": self.ids, "factor": self.factor, 
+                     "feature_key": self.feature_key, "mu": self.mu, "solver": self.solver})
+
+    def update(self, ids, get_rows, feature_key, mu, solver = "inv"):
+        """
+        Incorporate the rows of `ids` into the state
+
+        Param:
+        ids: list, ids of the objects that received feedback
+        get_rows: function, list of ids -> feature matrix of the corresponding rows
+        feature_key: string, see `feature_key`
+        mu: parameter \mu
+        solver: "inv" or "cholesky", see `LINREL_SOLVERS`
+
+        Return:
+        list of ids, in the row order of the state
+        """
+        _check_solver(solver)
         
-    scores = explt_scores + explr_scores
-    return scores, explt_scores, explr_scores
+        if feature_key != self.feature_key or mu != self.mu or solver != self.solver or not set(self.ids) <= set(ids):
+            if self.ids:
+                print "rebuilding linrel state"
+            self.__init__(feature_key = feature_key, mu = mu, solver = solver)
+        
+        known_ids = set(self.ids)
+        new_ids = [_id for _id in ids if _id not in known_ids]
+
+        if new_ids:
+            print "adding %d rows to linrel state of %d rows" %(len(new_ids), len(self.ids))
+            self._add_rows(get_rows(self.ids), get_rows(new_ids))
+            self.ids += new_ids
+
+        return self.ids
+
+    def _add_rows(self, D_old, B):
+        """
+        Block update of the factor of:
+        
+        [[A, C], [C.T, E]], given the factor of A, where:
+        A = D_old * D_old.T + mu * I
+        C = D_old * B.T
+        E = B * B.T + mu * I
+        """
+        k = B.shape[0]
+        E = _dense(B * B.T + self.mu * eye(k, k))
+        
+        if len(self.ids) == 0:
+            if self.solver == "cholesky":
+                self.factor = cholesky(E, lower = True)
+            else:
+                self.factor = np.asarray(inv(E))
+            return
+        
+        C = _dense(D_old * B.T)
+
+        if self.solver == "cholesky":
+            #[[L, 0], [X, L_S]], where L * X.T = C and L_S is the factor of the Schur complement E - X * X.T
+            L = self.factor
+            X = np.asmatrix(solve_triangular(L, C, lower = True)).T
+            L_S = cholesky(E - X * X.T, lower = True)
+
+            self.factor = np.asarray(np.bmat([[L, np.zeros((L.shape[0], k))], 
+                                              [X, L_S]]))
+        else:
+            inv_A = np.asmatrix(self.factor)
+        
+            inv_A_C = inv_A * C
+            inv_S = inv(E - C.T * inv_A_C) #inverse of the Schur complement
+        
+            upper_right = - inv_A_C * inv_S
+            upper_left = inv_A - upper_right * inv_A_C.T
+        
+            self.factor = np.asarray(np.bmat([[upper_left, upper_right], 
+                                              [upper_right.T, inv_S]]))
+        
+    def projection(self, D_t):
+        """
+        D_t.T * inv(D_t * D_t.T + mu * I), D_t's rows should be in the order returned by `update`
+        """
+        if self.solver == "cholesky":
+            #the matrix is symmetric, so D_t.T * inv(M) == (inv(M) * D_t).T
+            return np.asmatrix(cho_solve((self.factor, True), _dense(D_t))).T
+        else:
+            return D_t.T * np.asmatrix(self.factor)
@@ -17,11 +17,32 @@ import scinet3.modellist
 
 from scinet3.decorators import memoized
 from scinet3.data import FeatureMatrixAndIndexMapping as fmim
+from scinet3.data import (rows_to_ids, csr_row)
+from scinet3.docstore import (DocumentStore, DocumentSequence)
 from scinet3.fb_receiver import KeywordFeedbackReceiver, DocumentFeedbackReceiver
-from scinet3.util.numerical import cosine_similarity
+from scinet3.util.numerical import (cosine_similarity, row_norms)
+from scinet3.util.cache import LRUCache
 
 class Model(dict):
-    pass
+    #the feature matrix whose row norms are in `_vec_norms`
+    _vec_norms_of = None
+    _vec_norms = None
+
+    @classmethod
+    def _row_norms(cls, m):
+        """
+        the row norms of the feature matrix `m`, computed once per matrix
+        """
+        if cls._vec_norms_of is not m:
+            cls._vec_norms, cls._vec_norms_of = row_norms(m), m
+        return cls._vec_norms
+        
+    @property
+    def memo_key(self):
+        """
+        the key identifying the object in the `memoized` caches
+        """
+        return (self.__class__.__name__, self['id'])
 
 class Document(DocumentFeedbackReceiver, Model):
     __all_docs_by_id = {}
@@ -29,6 +50,33 @@ class Document(DocumentFeedbackReceiver, Model):
     all_docs = []
     db_conn = None
     table = None
+
+    #the columnar document store, set by `load_all_from_db`
+    store = None
+
+    #number of ids per `WHERE id IN (...)` query in `get_many`
+    get_many_chunk_size = 500
+
+    #the ids found loaded and fetched from the database, by `get` and `get_many`
+    cache_hits = 0
+    cache_misses = 0
+
+    #load only the ids and keywords at startup, the other(display) fields are fetched when serialized
+    #see `set_lazy_fields`
+    lazy_fields = False
+
+    #document id -> the display fields, for the lazily loaded documents
+    display_fields_cache = LRUCache(10000)
+
+    #names of the display fields, read from the table by `load_all_from_db` if `lazy_fields` is set
+    display_field_names = frozenset()
+
+    #matrix row -> the Document made from the document store, see `_view`
+    #kept as long as the store, as the views carry the per-session state(scores, vectors, weights)
+    views = {}
+    
+    #the document store the cached views are made from
+    _views_of = None
     
     #whether all documents are loaded or not
     all_docs_loaded = False
@@ -43,6 +91,19 @@ class Document(DocumentFeedbackReceiver, Model):
 
         for key, value in kwargs.items():
             setattr(cls, key, value)
+
+    @classmethod
+    def set_lazy_fields(cls, lazy, cache_size = 10000):
+        """
+        Whether `load_all_from_db` loads only the ids and keywords.
+        
+        If so, the display fields(title, abstract, etc) are fetched in batches the first time they are needed, 
+        and kept in a LRU cache of at most `cache_size` documents
+        
+        It takes effect at the next `load_all_from_db`
+        """
+        cls.lazy_fields = lazy
+        cls.display_fields_cache = LRUCache(cache_size)
     
     @classmethod
     def __ensure_configured(cls):
@@ -52,19 +113,28 @@ class Document(DocumentFeedbackReceiver, Model):
         for field in fmim.DICT_FIELDS:
             assert getattr(cls, field) is not None, "%s should be not None" %field
         
+    @classmethod
+    def _keywords_at(cls, pos):
+        """
+        the keywords of the document at matrix row `pos`, read from the feature matrix
+        """
+        kw_idx, _ = csr_row(cls.doc2kw_m, pos)
+        return list(Keyword.get_many(rows_to_ids(cls.kw_ind_r, kw_idx)))
+        
     @classmethod
     def prepare_doc(cls, doc_dict):
         doc = Document(doc_dict)
         
-        #if keywords are not parsed,  parse it
+        #if keywords are not parsed,  take them from the feature matrix
+        #only those not in the matrix are parsed
         if not isinstance(doc['keywords'], list):
-            kw_strs = filter(None, json.loads(doc['keywords'])) #filter out None values
-            kws = [Keyword.get(kw_str) for kw_str in kw_strs]
-            doc['keywords'] = kws
-
-        #mutual binding for keywords
-        for kw in doc['keywords']: 
-            kw.add_assoc_doc(doc)
+            doc_ind = getattr(cls, "doc_ind", None)
+            pos = doc_ind.get(doc['id']) if doc_ind is not None else None
+            if pos is not None:
+                doc['keywords'] = cls._keywords_at(pos)
+            else:
+                kw_strs = filter(None, json.loads(doc['keywords'])) #filter out None values
+                doc['keywords'] = [Keyword.get(kw_str) for kw_str in kw_strs]
 
         #set dict keys as attributes
         for key, value in doc.items():
@@ -76,29 +146,91 @@ class Document(DocumentFeedbackReceiver, Model):
     def load_all_from_db(cls):
         """
         Method to initialize the whole dataset
+        
+        The rows are kept in the columnar document store(see `DocumentStore`), 
+        Document objects are created on demand by `get` and when iterating over `all_docs`
+
+        If `lazy_fields` is set, only the ids and keywords are loaded
+        
+        Return:
+        DocumentSequence, the same as `all_docs`
         """
         cls.__ensure_configured()
         
-        cls.all_docs = [] #empty it
-        
-        rows = cls.db_conn.query("SELECT * from %s" %(cls.table))
-        for row in rows:
-            doc = cls.prepare_doc(row)
-            #save it in the global dictionary
-            cls.__all_docs_by_id[doc['id']] = doc
-            cls.all_docs.append(doc)
-
+        if cls.lazy_fields:
+            cls.display_field_names = frozenset([key 
+                                                 for row in cls.db_conn.query("SELECT * from %s LIMIT 1" %(cls.table))
+                                                 for key in row.keys()
+                                                 if key not in ("id", "keywords")])
+            rows = cls.db_conn.iter("SELECT id, keywords from %s" %(cls.table))
+        else:
+            rows = cls.db_conn.iter("SELECT * from %s" %(cls.table))
+        cls.store = DocumentStore(cls.doc_ind, rows)
+
+        if cls.store.leftover_rows: 
+            print "%d documents are not in the feature matrix, they are left out of `all_docs`: %r" %(len(cls.store.leftover_rows), 
+                                                                                                      [row["id"] for row in cls.store.leftover_rows])
+            for row in cls.store.leftover_rows:
+                doc = cls.prepare_doc(row)
+                if cls.lazy_fields:
+                    doc['_lazy_fields'] = True
+                cls.__all_docs_by_id[doc['id']] = doc
+            cls.store.leftover_rows = []
+
+        cls.all_docs = DocumentSequence(cls.store, cls._view)
         cls.all_docs_loaded = True
 
-        return cls.__all_docs_by_id.values()
+        #the keywords of all documents, as the views do not create them all in advance
+        Keyword.get_many(cls.kw_ind.keys())
+
+        return cls.all_docs
+
+    @classmethod
+    def _view(cls, pos):
+        """
+        the Document at matrix row `pos`, made from the document store
+
+        The keywords are read from the feature matrix. 
+        The views are kept in `views` while the store is, so that the same Document(and its cached vector and weights) is returned
+        """
+        if cls._views_of is not cls.store:
+            cls.views = {}
+            cls._views_of = cls.store
+
+        doc = cls.views.get(pos)
+        if doc is None:
+            doc = Document(cls.store.row(pos))
+            doc['keywords'] = cls._keywords_at(pos)
+
+            if cls.lazy_fields:
+                doc['_lazy_fields'] = True
+
+            cls.views[pos] = doc
+        
+        return doc
         
     @classmethod
-    def get(cls, doc_id):
+    def _loaded(cls, doc_id):
+        """
+        the document if it is loaded(or in the document store), otherwise None
+        """
         if cls.__all_docs_by_id.has_key(doc_id):
             return cls.__all_docs_by_id[doc_id]
+        elif cls.store is not None and cls.store.has(doc_id):
+            return cls._view(cls.doc_ind[doc_id])
+        else:
+            return None
+        
+    @classmethod
+    def get(cls, doc_id):
+        doc = cls._loaded(doc_id)
+        if doc is not None:
+            cls.cache_hits += 1
+            return doc
         else:
             cls.__ensure_configured()
-            
+
+            cls.cache_misses += 1
             row = cls.db_conn.get("SELECT * from %s where id=%d" %(cls.table, doc_id))
             if row is None:
                 raise ValueError("%d does not exist in the database" %doc_id)
@@ -109,10 +241,115 @@ class Document(DocumentFeedbackReceiver, Model):
     @classmethod
     def get_many(cls, ids):
         """
-        get multiple documents by id
+        get multiple documents by id, in the same order
+        
+        The documents not loaded are fetched together, 
+        by `WHERE id IN (...)` queries of at most `get_many_chunk_size` ids
+        
+        Raise:
+        ValueError, listing all the ids not in the database
+        """
+        ids = list(ids)
+        
+        docs = {}
+        to_fetch = []
+        for doc_id in ids:
+            if docs.has_key(doc_id):
+                continue
+            doc = cls._loaded(doc_id)
+            if doc is not None:
+                docs[doc_id] = doc
+            else:
+                to_fetch.append(doc_id)
+                docs[doc_id] = None
+
+        cls.cache_hits += len(docs) - len(to_fetch)
+        cls.cache_misses += len(to_fetch)
+        
+        if to_fetch:
+            cls.__ensure_configured()
+
+            for i in xrange(0, len(to_fetch), cls.get_many_chunk_size):
+                chunk = to_fetch[i: i + cls.get_many_chunk_size]
+                rows = cls.db_conn.query("SELECT * from %s where id in (%s)" 
+                                         %(cls.table, ",".join(["%d" %doc_id for doc_id in chunk])))
+                for row in rows:
+                    doc = cls.prepare_doc(row)
+                    cls.__all_docs_by_id[doc.id] = doc
+                    docs[doc.id] = doc
+
+            not_exist = [doc_id for doc_id in to_fetch if docs[doc_id] is None]
+            if not_exist:
+                raise ValueError("%r do not exist in the database" %not_exist)
+                
+        return scinet3.modellist.DocumentList([docs[doc_id]
+                                               for doc_id in ids])
+
+    @classmethod
+    def cache_info(cls):
+        """
+        Return:
+        dict, the number of ids found loaded("hits") and fetched from the database("misses")
+        """
+        return {"hits": cls.cache_hits, "misses": cls.cache_misses}
+
+    @classmethod
+    def load_display_fields(cls, docs):
+        """
+        The display fields of the lazily loaded documents
+        
+        Those not in `display_fields_cache` are fetched together, 
+        by `WHERE id IN (...)` queries of at most `get_many_chunk_size` ids
+        
+        Param:
+        docs: list of Document
+        
+        Return:
+        dict, document id -> dict of the display fields
+        """
+        fields = {}
+        to_fetch = []
+        for doc in docs:
+            if fields.has_key(doc.id):
+                continue
+            cached = cls.display_fields_cache.get(doc.id)
+            if cached is not None:
+                fields[doc.id] = cached
+            else:
+                to_fetch.append(doc.id)
+                fields[doc.id] = {}
+
+        if to_fetch:
+            cls.__ensure_configured()
+            
+            for i in xrange(0, len(to_fetch), cls.get_many_chunk_size):
+                chunk = to_fetch[i: i + cls.get_many_chunk_size]
+                rows = cls.db_conn.query("SELECT * from %s where id in (%s)" 
+                                         %(cls.table, ",".join(["%d" %doc_id for doc_id in chunk])))
+                for row in rows:
+                    doc_fields = dict([(key, value) 
+                                       for key, value in row.items()
+                                       if key not in ("id", "keywords")])
+                    cls.display_fields_cache.put(row["id"], doc_fields)
+                    fields[row["id"]] = doc_fields
+
+        return fields
+
+    @classmethod
+    def dicts(cls, docs):
+        """
+        `Document.dict` of the documents, the display fields are loaded in one batch
+        
+        Param:
+        docs: list of Document
+        
+        Return:
+        list of dict
         """
-        return scinet3.modellist.DocumentList([cls.get(_id)
-                                               for _id in ids])
+        fields = cls.load_display_fields([doc for doc in docs 
+                                          if doc.has_key("_lazy_fields")])
+        return [doc._as_dict(fields.get(doc.id, {}))
+                for doc in docs]
 
     @property
     def vec(self):
@@ -121,6 +358,12 @@ class Document(DocumentFeedbackReceiver, Model):
             cls = self.__class__
             self._vec = cls.doc2kw_m[cls.doc_ind[self.id],:]
         return self._vec
+
+    @property
+    def vec_norm(self):
+        """ norm of the feature vector, from the precomputed row norms """
+        cls = self.__class__
+        return cls._row_norms(cls.doc2kw_m)[cls.doc_ind[self.id]]
     
     @memoized
     def similarity_to(self, other, metric="cosine"):
@@ -158,21 +401,34 @@ class Document(DocumentFeedbackReceiver, Model):
             
             cls = self.__class__
             
-            feature_vec = cls.doc2kw_m[cls.doc_ind[self.id],:]
-            _, kw_idx = np.nonzero(feature_vec)
+            kw_idx, weights = csr_row(cls.doc2kw_m, cls.doc_ind[self.id])
             
-            kws = [cls.kw_ind_r[ind] for ind in kw_idx]
+            kws = rows_to_ids(cls.kw_ind_r, kw_idx)
             
-            weights = feature_vec[0, kw_idx].toarray().flatten()
             self.__kw_weight = dict([(Keyword.get(kw_str),weight) 
-                                     for kw_str,weight in zip(kws, weights) ])
+                                     for kw_str,weight in zip(kws, weights.tolist()) ])
 
         return self.__kw_weight
 
+    def _as_dict(self, display_fields):
+        d = dict(display_fields)
+        d.update([(a, self[a]) for a in self.keys() if not a.startswith('_')])
+        return d
+        
     @property
     def dict(self):
-        attrs = [a for a in self.keys() if not a.startswith('_')]
-        return dict([(a, self[a]) for a in attrs])
+        return self.__class__.dicts([self])[0]
+
+    def __getattr__(self, name):
+        """
+        the display fields of the lazily loaded document, 
+        only the names in `display_field_names` are fetched, so typos and `hasattr` probes fail right away
+        """
+        if name in self.__class__.display_field_names and self.has_key("_lazy_fields"):
+            fields = self.__class__.load_display_fields([self])[self.id]
+            if fields.has_key(name):
+                return fields[name]
+        raise AttributeError(name)
 
     def fb(self, session):
         """
@@ -276,11 +532,10 @@ class Keyword(KeywordFeedbackReceiver, Model):
             
             cls = self.__class__
             
-            feature_vec = cls.kw2doc_m[cls.kw_ind[self.id],:]
-            _, doc_idx = np.nonzero(feature_vec)
+            doc_idx, weights = csr_row(cls.kw2doc_m, cls.kw_ind[self.id])
 
-            doc_ids, weights = ([cls.doc_ind_r[ind] for ind in doc_idx], 
-                                feature_vec[0, doc_idx].toarray().flatten())
+            doc_ids, weights = (rows_to_ids(cls.doc_ind_r, doc_idx), 
+                                weights.tolist())
             self.__doc_weight = dict([(Document.get(doc_id),weight) 
                                       for doc_id,weight in zip(doc_ids, weights) ])
 
@@ -303,6 +558,12 @@ class Keyword(KeywordFeedbackReceiver, Model):
             self._vec = cls.kw2doc_m[cls.kw_ind[self.id], :]
         return self._vec
 
+    @property
+    def vec_norm(self):
+        """ norm of the feature vector, from the precomputed row norms """
+        cls = self.__class__
+        return cls._row_norms(cls.kw2doc_m)[cls.kw_ind[self.id]]
+
     @memoized
     def similarity_to(self, other, metric="cosine"):
         """
@@ -334,14 +595,39 @@ class Keyword(KeywordFeedbackReceiver, Model):
         """
         return session.kw_feedbacks.get(self, 0)
         
-    def add_assoc_doc(self, doc):
-        self.docs.append(doc)
+    @property
+    def doc_rows(self):
+        """
+        The document matrix rows(`Document.doc_ind`) of the documents containing the keyword, 
+        a view over `kw2doc_m`(see `csr_row`)
+
+        If the document store is loaded, those not in the database table are left out(and the rows are copied)
+        """
+        cls = self.__class__
+        doc_idx, _ = csr_row(cls.kw2doc_m, cls.kw_ind[self.id])
+        if Document.store is not None:
+            doc_idx = doc_idx[Document.store.present[doc_idx]]
+        return doc_idx
+
+    @property
+    def doc_ids(self):
+        """
+        The ids of the documents containing the keyword, see `doc_rows`
+        """
+        return rows_to_ids(self.__class__.doc_ind_r, self.doc_rows)
+        
+    @property
+    def docs(self):
+        """
+        The documents containing the keyword, see `doc_rows`.
+
+        Use `doc_ids` or `doc_rows` if the Document objects are not needed
+        """
+        return list(Document.get_many(self.doc_ids))
         
     def __init__(self, kw_str):
         self['id'] = kw_str
         
-        self.docs = []
-
         self.__doc_weight = None
         
         super(Keyword, self).__init__()
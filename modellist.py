@@ -2,13 +2,14 @@
 # Modeling set of Document/Keyword
 #########################
 import pprint
+import numpy as np
 
 import scinet3.model
 
 from scinet3.decorators import memoized
-from scinet3.util.numerical import cosine_similarity
+from scinet3.util.numerical import (cosine_similarity, cosine_similarity_matrix, row_norms)
 
-from scipy.sparse import csr_matrix
+from scipy.sparse import (csr_matrix, vstack)
 
 class ModelList(list):
     @property
@@ -23,9 +24,40 @@ class ModelList(list):
         if len(self) == 1: #contain only one object, the centroid is itself
             return list(self)[0].vec
         else:
-            return (csr_matrix([model.vec.toarray()[0,:] 
-                                for model in self]).sum(0)                 
-                    / len(self))    
+            #averaging by a sparse product, the vectors are not densified
+            weights = csr_matrix(np.ones((1, len(self))) / len(self))
+            return (weights * vstack([model.vec for model in self], format = "csr")).tocsr()
+
+    @property
+    def vec(self):
+        """
+        the centroid, so that the list can be compared as a single object
+        """
+        return self.centroid
+
+    @property
+    def vec_norm(self):
+        return row_norms(self.centroid)[0]
+
+    def similarities(self, others, metric = "cosine"):
+        """
+        The similarities of this list to each of `others`, by one batched call
+        
+        Param:
+        others: list of Document/Keyword, or list of DocumentList/KeywordList
+        
+        Return:
+        array of float, in the order of `others`
+        """
+        if metric != "cosine":
+            raise NotImplementedError("Only cosine similarity metric is implemented for now")
+        
+        if len(others) == 0:
+            return np.array([])
+            
+        return cosine_similarity_matrix(self.centroid, 
+                                        vstack([other.vec for other in others], format = "csr"),
+                                        B_norms = np.array([other.vec_norm for other in others]))[0]
 
     def __repr__(self):
         return "%s:(%s)" %(self.__class__.__name__, pprint.pformat(list(self)))
@@ -41,6 +73,13 @@ class ModelList(list):
     def ids_str(self):
         return ",".join(sorted([str(obj.id) for obj in self]))
 
+    @property
+    def memo_key(self):
+        """
+        the key identifying the list in the `memoized` caches
+        """
+        return (self.__class__.__name__, tuple(sorted([obj.id for obj in self])))
+
     def __eq__(self, other):
         return self.__class__ == other.__class__ and self.ids_str == other.ids_str
 
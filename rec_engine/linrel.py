@@ -5,28 +5,74 @@ from numpy import matrix
 from collections import OrderedDict
 from types import IntType, FloatType
 
-from scinet3.data import FeatureMatrixAndIndexMapping
+from scinet3.data import (FeatureMatrixAndIndexMapping, ArrayIndexMapping, ids_to_rows, rows_to_ids, has_ids)
 from scinet3.model import (Document, Keyword)
 from scinet3.modellist import (DocumentList, KeywordList)
+from scinet3.docstore import DocumentSequence
 
 from scinet3.rec_engine.base import Recommender
-from scinet3.linrel import linrel
+from scinet3.linrel import (projection, linrel_scores, linrel_top_n, feature_key, LinRelState, LINREL_SOLVERS)
+from scinet3.util.numerical import select_submatrix
 
 random.seed(123456)
 
 class LinRelRecommender(Recommender): 
+    def _linrel_projection(self, K, fb, 
+                           id2ind_map, mu, 
+                           state = None, feature_key = None):
+        """
+        The feedback vector and the LinRel projection matrix W(K * W is the a_t matrix)
+
+        Params: see `generic_rank`
+
+        Return:
+        (y_t, W)
+        """
+        if isinstance(fb, dict):
+            ids = fb.keys()
+            values = np.array([fb[_id] for _id in ids], dtype = np.float64)
+        else:
+            ids, values = list(fb[0]), np.asarray(fb[1], dtype = np.float64)
+            
+        def submatrix(ids):
+            idx_in_K = ids_to_rows(id2ind_map, ids)
+            K_sub = K[idx_in_K, :]
+            return K_sub
+        
+        if state is not None and K.shape[1] <= len(ids): #the primal form inverts the smaller matrix, see `choose_form`
+            state = None
+            
+        if state is not None: #the row order is decided by the state
+            id2pos = dict([(_id, pos) for pos, _id in enumerate(ids)])
+            ids = state.update(ids, submatrix, feature_key, mu, self.linrel_solver)
+            values = values[np.array([id2pos[_id] for _id in ids], dtype = np.int64)]
+
+        #prepare the matrices
+        K_t = submatrix(ids)
+        y_t = matrix(values).T
+
+        if state is not None:
+            return y_t, state.projection(K_t)
+        else:
+            print "doing linrel.."
+            return y_t, projection(K_t, mu, solver = self.linrel_solver)
+        
     def generic_rank(self, K, fb, 
                      id2ind_map,ind2id_map,
-                     mu, c):
+                     mu, c, 
+                     state = None, feature_key = None):
         """
         Generic object(document/keyword in our case) ranking using LinRel.
         
         Params:
         K: matrix, the whole data matrix
-        fb: dict(integer->float), feedbacks
-        id2ind_map: dict(integer->integer), mapping from object id to matrix indices
-        ind2id_map: dict(integer->integer), mapping from matrix row index to object id
+        fb: dict(integer->float), feedbacks, or (list of object ids, array of feedbacks)
+        id2ind_map: dict(integer->integer) or ArrayIndexMapping, mapping from object id to matrix indices
+        ind2id_map: dict(integer->integer) or ArrayReverseIndexMapping, mapping from matrix row index to object id
         mu, c: the LinRel parameters
+        state(optional): LinRelState, if given, it is updated with the rows in `fb` and used instead of the full computation, 
+                         unless the primal form is cheaper(more rows in `fb` than columns in K)
+        feature_key(optional): string, the key of K's columns, required if `state` is given
         
         Return:
         (
@@ -37,21 +83,9 @@ class LinRelRecommender(Recommender):
         
         Dict items order by score in descending order
         """
-        ids = fb.keys()
-        def submatrix():
-            idx_in_K = [id2ind_map[id] for id in ids]
-            K_sub = K[idx_in_K, :]
-            return K_sub
-        
-        def fb_vec():
-            y_t = matrix([fb.get(id, 0) for id in ids]).T
-            return y_t
-        
-        #prepare the matrices
-        K_t = submatrix()
-        y_t = fb_vec()
-
-        scores, exploitation_scores, exploration_scores  = linrel(y_t, K_t, K, mu, c) #do the linrel
+        y_t, W = self._linrel_projection(K, fb, id2ind_map, mu, 
+                                         state, feature_key)
+        scores, exploitation_scores, exploration_scores = linrel_scores(y_t, K, W, c)
         
         def make_dict(matrix):
             """
@@ -61,14 +95,46 @@ class LinRelRecommender(Recommender):
             """
             sorted_tuple = sorted(enumerate(np.array(matrix.T).tolist()[0]), key = lambda (id, score): score, reverse = True)
             
-            return OrderedDict([(ind2id_map[ind], score)
-                         for ind, score in sorted_tuple])
+            return OrderedDict(zip(rows_to_ids(ind2id_map, [ind for ind, _ in sorted_tuple]), 
+                                   [score for _, score in sorted_tuple]))
 
         scores =  make_dict(scores)
         exploitation_scores =  make_dict(exploitation_scores)
         exploration_scores =  make_dict(exploration_scores)
         
         return scores, exploitation_scores, exploration_scores
+
+    def generic_top_n(self, K, fb, 
+                      id2ind_map, ind2id_map,
+                      mu, c, top_n,
+                      state = None, feature_key = None):
+        """
+        Like `generic_rank`, but only the top_n objects are selected(without sorting all the objects).
+        
+        If `linrel_block_size` is set, K is evaluated in blocks of that many rows to bound the memory usage.
+        
+        Params:
+        top_n: integer, the number of objects to return
+        others: see `generic_rank`
+
+        Return:
+        (
+        list: object ids,
+        array of float: scores, 
+        array of float: exploitation scores, 
+        array of float: exploration scores
+        )
+        
+        All ordered by score in descending order, ties broken by matrix row index
+        """
+        y_t, W = self._linrel_projection(K, fb, id2ind_map, mu, 
+                                         state, feature_key)
+        
+        idx, scores, exploitation_scores, exploration_scores = linrel_top_n(y_t, K, W, c, top_n, 
+                                                                            block_size = self.linrel_block_size)
+
+        return (rows_to_ids(ind2id_map, idx),
+                scores, exploitation_scores, exploration_scores)
     
     def _filter_objs(self, filters, **kwargs):
         """
@@ -84,7 +150,17 @@ class LinRelRecommender(Recommender):
             
         return list(sel_objs)
         
-    def _submatrix_and_indexing(self, row_objs, col_objs, obj_feature_matrix, row_obj2ind_map, col_obj2ind_map):
+    @classmethod
+    def _obj_ids(cls, objs):
+        """
+        the ids of the objects, read from the store if they are all the documents
+        """
+        if isinstance(objs, DocumentSequence): #no need to create the documents
+            return objs.ids
+        return [obj.id for obj in objs]
+
+    def _submatrix_and_indexing(self, row_objs, col_objs, obj_feature_matrix, row_obj2ind_map, col_obj2ind_map, 
+                                obj_feature_matrix_csc = None):
         """
         Return the submatrix and associated index mapping
         
@@ -103,24 +179,27 @@ class LinRelRecommender(Recommender):
         row_objs: list of Model, the ids of the row objects to be included in the submatrix
         col_objs: list of Model, the ids of the column objects to be included in the submatrix
         obj_feature_matrix: matrix,  the feature matrix for the whole dataset
-        row_obj2ind_map: dict of (integer, integer), the row-object-to-matrix-index mapping
+        row_obj2ind_map: dict of (integer, integer) or ArrayIndexMapping, the row-object-to-matrix-index mapping
         row_ind2obj_map: dict of (integer, integer), the reserse mapping the above one
+        obj_feature_matrix_csc(optional): matrix, obj_feature_matrix in CSC format, 
+                                          used when selecting by columns is cheaper
         
         Return:
         - the feature matrix concerning only the objects
-        - the object to matrix index mapping
-        - the inverse index to object mapping
+        - the object to matrix index mapping(ArrayIndexMapping)
+        - the inverse index to object mapping(ArrayReverseIndexMapping)
         """
-        row_obj_indx = [row_obj2ind_map[obj.id] for obj in row_objs]
-        col_obj_indx = [col_obj2ind_map[obj.id] for obj in col_objs]
+        row_ids = self._obj_ids(row_objs)
+        row_obj_indx = ids_to_rows(row_obj2ind_map, row_ids)
+        col_obj_indx = ids_to_rows(col_obj2ind_map, self._obj_ids(col_objs))
         
         # get the sub matrix
-        # the following way of submatrix slicing is from:
-        # http://stackoverflow.com/questions/21060995/submatrix-in-scipy
-        submatrix = obj_feature_matrix.tocsr()[row_obj_indx, :].tocsc()[:, col_obj_indx]
+        # by working on the index arrays, without converting the whole matrix
+        submatrix = select_submatrix(obj_feature_matrix, row_obj_indx, col_obj_indx, 
+                                     csc = obj_feature_matrix_csc)
         
-        obj2ind_submap = dict([(obj.id, ind) for obj, ind in zip(row_objs, xrange(len(row_objs)))])
-        ind2obj_submap = dict([(ind, obj.id) for obj, ind in zip(row_objs, xrange(len(row_objs)))])
+        obj2ind_submap = ArrayIndexMapping(row_ids)
+        ind2obj_submap = obj2ind_submap.reverse()
 
         return submatrix, obj2ind_submap, ind2obj_submap
 
@@ -140,27 +219,96 @@ class LinRelRecommender(Recommender):
         else:
             raise 
         
+    def _candidate_fbs(self, fb_vec, ind2id_map, candidate_id2ind_map):
+        """
+        The feedbacks of the candidates, read from the feedback vector of the session
+
+        Params:
+        fb_vec: (array of row indices, array of feedbacks), the session feedback vector over the whole matrix
+        ind2id_map: dict(integer->integer) or ArrayReverseIndexMapping, mapping from the whole matrix row index to object id
+        candidate_id2ind_map: dict(integer->integer) or ArrayIndexMapping, mapping from candidate object id to submatrix row index
+
+        Return:
+        (list of object ids, array of feedbacks), or None if none of the candidates has feedback
+        """
+        idx, values = fb_vec
+        ids = rows_to_ids(ind2id_map, idx)
+        mask = has_ids(candidate_id2ind_map, ids)
+
+        if not mask.any():
+            return None
+        return [_id for _id, m in zip(ids, mask) if m], values[mask]
+        
+    def _linrel_state(self, session, name, fbs, M, key = None):
+        """
+        Get the LinRel state persisted in session, if incremental LinRel is used
+        
+        Params:
+        session: Session
+        name: string, "kws" or "docs"
+        fbs: the feedbacks used as the training rows, None if all candidates are used
+        M: matrix, the feature matrix used
+        key(optional): string, the key of M's columns(see `linrel.feature_key`), made from M if not given
+
+        Return:
+        (LinRelState, feature key) or (None, None) if incremental LinRel is not used. 
+        It is not used either when all candidates are the training rows, as the dual form state would be as large as them
+        """
+        if not self.linrel_incremental or fbs is None:
+            return None, None
+            
+        return (LinRelState.load(session, name), 
+                key or feature_key(M))
+
+    def _feature_key(self, M, col_objs, all_col_objs, col_obj2ind_map):
+        """
+        The key of the submatrix columns(see `linrel.feature_key`), None if incremental LinRel is not used
+
+        Params:
+        M: matrix, the whole feature matrix
+        col_objs: list of Model, the objects selected as the columns
+        all_col_objs: list of Model, all the column objects
+        col_obj2ind_map: dict or ArrayIndexMapping, mapping from column object id to M's column index
+        """
+        if not self.linrel_incremental:
+            return None
+        elif col_objs is all_col_objs: #no filter, all columns are used
+            return feature_key(M)
+        else:
+            return feature_key(M, ids_to_rows(col_obj2ind_map, self._obj_ids(col_objs)))
+        
     def recommend_keywords(self, fmim,
                            session, top_n, mu, c, 
-                           sampler=None):
+                           sampler=None, feature_key = None):
         """
         fmim: FeatureMatrixAndIndexMapping, the fmim for the sub-matrix        
         session: Session,
         top_n: how many kws are returned
         mu,c: float, the parameters for LinRel algorithm
+        feature_key(optional): string, the key of the sub-matrix columns in the whole matrix, see `_feature_key`
         
         Return
         KeywordList: a list of keyword ids as well as their scores
         """        
-        kws = Keyword.get_many(fmim.kw_ind.keys())
-        fbs = dict([(kw.id, kw.fb(session)) for kw in kws])
+        fbs = None
+        if self.linrel_fb_only: #only those with feedback are used as training rows
+            fbs = self._candidate_fbs(session.kw_fb_vec, self.kw_ind_r, fmim.kw_ind)
+            
+        state, key = self._linrel_state(session, "kws", fbs, fmim.kw2doc_m, feature_key)
         
-        id_with_scores, id_with_explt_scores, id_with_explr_scores = self.generic_rank(fmim.kw2doc_m, fbs, 
-                                                                                       fmim.kw_ind, fmim.kw_ind_r,
-                                                                                       mu, c)
+        if fbs is None: #all candidates are used
+            kws = Keyword.get_many(fmim.kw_ind.keys())
+            fbs = dict([(kw.id, kw.fb(session)) for kw in kws])
+        
+        kw_ids, scores, _, _ = self.generic_top_n(fmim.kw2doc_m, fbs, 
+                                                  fmim.kw_ind, fmim.kw_ind_r,
+                                                  mu, c, top_n,
+                                                  state = state, feature_key = key)
+        if state is not None:
+            state.save(session, "kws")
         
         kws = []
-        for kw_id, score in id_with_scores.items()[:top_n]:
+        for kw_id, score in zip(kw_ids, scores.tolist()):
             kw = Keyword.get(kw_id)
             kw['score'] = score
             kw['recommended'] = True
@@ -170,18 +318,30 @@ class LinRelRecommender(Recommender):
         
     def recommend_documents(self, fmim,
                             session, top_n, mu, c, 
-                            sampler = None):
+                            sampler = None, feature_key = None):
         """
         return a list of document ids as well as the scores
+
+        feature_key: see `recommend_keywords`
         """
-        docs = Document.get_many(fmim.doc_ind.keys())
-        fbs = dict([(doc.id, doc.fb(session)) for doc in docs])
-        
-        id_with_scores, id_with_explt_scores, id_with_explr_scores = self.generic_rank(fmim.doc2kw_m, fbs, 
-                                                                                       fmim.doc_ind,fmim.doc_ind_r,
-                                                                                       mu, c)
+        fbs = None
+        if self.linrel_fb_only: #only those with feedback are used as training rows
+            fbs = self._candidate_fbs(session.doc_fb_vec, self.doc_ind_r, fmim.doc_ind)
+
+        state, key = self._linrel_state(session, "docs", fbs, fmim.doc2kw_m, feature_key)
+
+        if fbs is None: #all candidates are used
+            docs = Document.get_many(fmim.doc_ind.keys())
+            fbs = dict([(doc.id, doc.fb(session)) for doc in docs])
+
+        doc_ids, scores, _, _ = self.generic_top_n(fmim.doc2kw_m, fbs, 
+                                                   fmim.doc_ind, fmim.doc_ind_r,
+                                                   mu, c, top_n,
+                                                   state = state, feature_key = key)
+        if state is not None:
+            state.save(session, "docs")
         docs = []
-        for doc_id, score in id_with_scores.items()[:top_n]:
+        for doc_id, score in zip(doc_ids, scores.tolist()):
             doc = Document.get(doc_id)
             doc["score"] = score
             doc['recommended'] = True
@@ -229,8 +389,10 @@ class LinRelRecommender(Recommender):
             filtered_docs = Document.all_docs
         
         
-        kw2doc_submat, kw_ind_map, kw_ind_map_r = self._submatrix_and_indexing(filtered_kws, filtered_docs, self.kw2doc_m, self.kw_ind, self.doc_ind)
-        doc2kw_submat, doc_ind_map, doc_ind_map_r = self._submatrix_and_indexing(filtered_docs, filtered_kws, self.doc2kw_m, self.doc_ind, self.kw_ind)
+        kw2doc_submat, kw_ind_map, kw_ind_map_r = self._submatrix_and_indexing(filtered_kws, filtered_docs, self.kw2doc_m, self.kw_ind, self.doc_ind, 
+                                                                               self.kw2doc_m_csc)
+        doc2kw_submat, doc_ind_map, doc_ind_map_r = self._submatrix_and_indexing(filtered_docs, filtered_kws, self.doc2kw_m, self.doc_ind, self.kw_ind, 
+                                                                                 self.doc2kw_m_csc)
         
         print "document2keyword matrix shape=", doc2kw_submat.shape
         
@@ -239,11 +401,13 @@ class LinRelRecommender(Recommender):
         #do the recommendation
         rec_kws = self.recommend_keywords(fmim,
                                           session, recom_kw_num or self.recom_kw_num, 
-                                          linrel_kw_mu or self.linrel_kw_mu, linrel_kw_c or self.linrel_kw_c)
+                                          linrel_kw_mu or self.linrel_kw_mu, linrel_kw_c or self.linrel_kw_c, 
+                                          feature_key = self._feature_key(self.kw2doc_m, filtered_docs, Document.all_docs, self.doc_ind))
         
         rec_docs = self.recommend_documents(fmim,
                                             session, recom_doc_num or self.recom_doc_num, 
-                                            linrel_doc_mu or self.linrel_doc_mu, linrel_doc_c or self.linrel_doc_c)
+                                            linrel_doc_mu or self.linrel_doc_mu, linrel_doc_c or self.linrel_doc_c, 
+                                            feature_key = self._feature_key(self.doc2kw_m, filtered_kws, Keyword.all_kws, self.kw_ind))
         
         #get the associated keywords
         assoc_kws = self.associated_keywords_from_docs(rec_docs, rec_kws)
@@ -254,6 +418,10 @@ class LinRelRecommender(Recommender):
                  linrel_kw_mu, linrel_kw_c, linrel_doc_mu, linrel_doc_c, #linrel parameters
                  kw_filters = None, doc_filters = None, #filters
                  kw_samplers = None, doc_samplers = None, #samplers
+                 linrel_solver = "cholesky", #how the linrel matrix is inverted
+                 linrel_incremental = False, #keep the linrel state in session across iterations
+                 linrel_fb_only = True, #use only the objects with feedback as linrel training rows
+                 linrel_block_size = None, #number of rows evaluated at a time
                  *args, **kwargs):
         """
         Params:
@@ -261,6 +429,12 @@ class LinRelRecommender(Recommender):
         linrel_kw_mu, linrel_kw_c, linrel_doc_mu, linrel_doc_c: float, 
             linrel parameters for keyword/document recommendation
         kw_filters,doc_filters: list of filters to be applied to keywords/documents
+        linrel_solver: string, "inv"(explicit inverse) or "cholesky"(factorization and triangular solves)
+        linrel_incremental: boolean, whether the dual form LinRel state is kept in session and updated with the new feedback rows only. 
+                            It requires `linrel_fb_only`, as the state grows with the training rows
+        linrel_fb_only: boolean, whether only the objects that received feedback in the session are used as the training rows(K_t, y_t).
+                        If False or no feedback is received, all candidates are used.
+        linrel_block_size: integer, if given, the candidates are scored in blocks of this many rows to bound the memory usage
         
         args: the matrix and index mapping stuff
         """
@@ -292,6 +466,18 @@ class LinRelRecommender(Recommender):
 
         self.kw_samplers = kw_samplers
         self.doc_samplers = doc_samplers
+
+        assert linrel_solver in LINREL_SOLVERS, "linrel_solver should be one of %r, but is %r" %(LINREL_SOLVERS, linrel_solver)
+        self.linrel_solver = linrel_solver
+
+        assert linrel_fb_only or not linrel_incremental, "linrel_incremental requires linrel_fb_only, otherwise the state grows to all candidates"
+        self.linrel_incremental = linrel_incremental
+
+        self.linrel_fb_only = linrel_fb_only
+
+        assert linrel_block_size is None or (type(linrel_block_size) is IntType and linrel_block_size > 0), \
+            "linrel_block_size should be positive integer or None, but is %r" %(linrel_block_size)
+        self.linrel_block_size = linrel_block_size
         
         super(LinRelRecommender, self).__init__(*args, **kwargs)
         
@@ -5,6 +5,7 @@ import numpy as np
 from numpy import matrix
 
 from scinet3.model import (Document, Keyword)
+from scinet3.data import rows_to_ids
 from scinet3.modellist import (KeywordList, DocumentList)
 from scinet3.linrel import linrel
 from scinet3.rec_engine.base import Recommender
@@ -51,8 +52,7 @@ class QueryBasedRecommender(Recommender):
         """
         word_vec = self._word_vec(kw_ids)
         row_idx, _ = np.nonzero(self.doc2kw_m * word_vec)
-        return [self.doc_ind_r[row_id] 
-                for row_id in matrix2array(row_idx)]
+        return rows_to_ids(self.doc_ind_r, matrix2array(row_idx))
         
     def sample_documents_associated_with_keywords(self, keywords, n):
          """
@@ -163,13 +163,10 @@ class QueryBasedRecommender(Recommender):
                                reverse = True)
         
         #get the top_n documents
-        docs = DocumentList([])
-        for ind, score in sorted_scores[:top_n]:
-            doc_id = self.doc_ind_r[ind]
-            doc = Document.get(doc_id)
+        docs = Document.get_many(rows_to_ids(self.doc_ind_r, [ind for ind, _ in sorted_scores[:top_n]]))
+        for doc, (_, score) in zip(docs, sorted_scores[:top_n]):
             doc['score'] = score
             doc["recommended"] = True
-            docs.append(doc)
 
         return docs, existing_keywords                         
         
@@ -62,6 +62,13 @@ class NearSightedRobot(object):
         feedback object
         """
         fb = {}
+
+        # similarities to the targets, computed in one batch for all the candidates
+        doc_candidates = list(set(docs) - self.docs_selected)
+        doc_sims = dict(zip(doc_candidates, self.target_docs.similarities(doc_candidates)))
+
+        kw_candidates = list(set(kws) - self.kws_selected)
+        kw_sims = dict(zip(kw_candidates, self.target_kws.similarities(kw_candidates)))
         
         # if the targets appears in the list
         # no hesitating to select them
@@ -73,7 +80,7 @@ class NearSightedRobot(object):
             if len(doc_intersect) > doc_n: #exceed the desired document number
                 #select the one closest to targets
                 doc_intersect = set(sorted(doc_intersect, 
-                                           key = lambda doc: self.target_docs.similarity_to(doc), 
+                                           key = lambda doc: doc_sims[doc], 
                                            reverse = True)[:doc_n])
             doc_n -= len(doc_intersect)
             self.docs_selected |= doc_intersect
@@ -86,7 +93,7 @@ class NearSightedRobot(object):
             if len(kw_intersect) > kw_n: #exceed the desired keyword number
                 #select the one closest to targets
                 kw_intersect = set(sorted(kw_intersect, 
-                                          key = lambda kw: self.target_kws.similarity_to(kw), 
+                                          key = lambda kw: kw_sims[kw], 
                                           reverse = True)[:kw_n])
             kw_n -= len(kw_intersect)
             self.kws_selected |= kw_intersect
@@ -94,12 +101,12 @@ class NearSightedRobot(object):
         
         if doc_n: # there are still documents to select
             top_docs += sorted(set(docs) - self.docs_selected, 
-                               key = lambda doc: self.target_docs.similarity_to(doc), 
+                               key = lambda doc: doc_sims[doc], 
                            reverse = True)[:doc_n]
 
         if kw_n: # there are still keywords to select
             top_kws += sorted(set(kws) - self.kws_selected, 
-                              key = lambda kw: self.target_kws.similarity_to(kw), 
+                              key = lambda kw: kw_sims[kw], 
                               reverse = True)[:kw_n]
         
         fb["docs"] = [[doc.id, 1] 
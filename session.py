@@ -2,9 +2,13 @@
 import cPickle as pickle
 import uuid
 from collections import defaultdict
-from types import IntType, StringType, DictType
+from types import (IntType, LongType, FloatType, StringType, UnicodeType, DictType)
+
+import numpy as np
+from redis.exceptions import ResponseError
 
 from scinet3.model import Document, Keyword
+from scinet3.data import (ids_to_rows, rows_to_ids, has_ids)
 # from scinet3.redis_util import (isnumber, dict2right_type)
 
 class RecommendationSessionHandler(object):
@@ -41,6 +45,10 @@ class RecommendationSessionHandler(object):
         raise NotImplemented
     
 class RedisRecommendationSessionHandler(RecommendationSessionHandler):
+    #keys(without the session prefix) of the feedback state, read at once by `SessionSnapshot`
+    _FB_HASH_KEYS = ("kw_feedbacks", "doc_feedbacks")
+    _FB_STRING_KEYS = ()
+    
     def __init__(self, conn, session_id):
         """
         if session_id is not given or empty string, generate a new session id
@@ -72,6 +80,18 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
     def get_session(cls, conn, session_id=None):
         #factory method, return the session
         return cls(conn, session_id)    
+
+    def snapshot(self):
+        """
+        Snapshot of this session for one request, see `SessionSnapshot`
+        """
+        return SessionSnapshot(self)
+
+    def write_batch(self):
+        """
+        Write-only batch on this session, see `SessionWriteBatch`
+        """
+        return SessionWriteBatch(self)
         
     ###################################
     #The following long list of function
@@ -173,23 +193,45 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
         self.redis.set('session:%s:%s' %(self.session_id, key), pickle.dumps(current_value))
             
     def _dict_list_getter(self, key):
-        val = self.redis.get('session:%s:%s' %(self.session_id, key))
-        if val is None:
-            return defaultdict(list)
-        else:
-            return pickle.loads(val)
+        """
+        generic getter for {key: list, ...} data structure, see `_dict_list_setter`
+        """
+        fields = list(self._with_migration(key, "dict_list", 
+                                           lambda: self.redis.smembers(self._full_key(key))))
+
+        hist = defaultdict(list)
+        if fields:
+            pipe = self.redis.pipeline(transaction = False)
+            for field in fields:
+                pipe.lrange(self._full_key(key, field), 0, -1)
+            
+            for field, items in zip(fields, pipe.execute()):
+                hist[_compact_decode(field)] = map(_compact_decode, items)
+                
+        return hist
 
     def _dict_list_setter(self, key, data):
         """
         generic setter for {key: list, ...} data structure
         
+        Each list is a redis list, the value is appended to it by RPUSH.
+        The (encoded) dictionary keys are kept in a redis set under `key`.
+        
         `key`: the redis key
         data: dictionary data to be incorporated into
         """
-        hist = getattr(self, key)
-        for kw, val in data.items():
-            hist[kw].append(val)
-        return self.redis.set('session:%s:%s' %(self.session_id, key), pickle.dumps(hist))
+        if not data:
+            return
+
+        #the field set is updated first, so that an older pickled value is migrated before appending
+        fields = map(_compact_encode, data.keys())
+        self._with_migration(key, "dict_list", 
+                             lambda: self.redis.sadd(self._full_key(key), *fields))
+
+        pipe = self.redis.pipeline()
+        for field, val in zip(fields, data.values()):
+            pipe.rpush(self._full_key(key, field), _compact_encode(val))
+        pipe.execute()
 
     ###############################
     # user feedback history
@@ -227,6 +269,30 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
         #              for _id, fb in self.get("doc_feedbacks", {}).items()])
 
 
+    @property
+    def kw_fb_vec(self):
+        """
+        keyword feedback as a sparse vector over the keyword matrix rows(`Keyword.kw_ind`), 
+        the keywords not in the matrix are skipped
+
+        Return:
+        (array of int32: row indices, array of float: feedback values), sorted by row index
+        """
+        key = "session:%s:%s" %(self.session_id, "kw_feedbacks")
+        fbs = self.redis.hgetall(key)
+        return _indexed_vec(Keyword.kw_ind, [_id.decode("utf-8") for _id in fbs.keys()], 
+                            map(float, fbs.values()))
+
+    @property
+    def doc_fb_vec(self):
+        """
+        document feedback as a sparse vector over the document matrix rows(`Document.doc_ind`), see `kw_fb_vec`
+        """
+        key = "session:%s:%s" %(self.session_id, "doc_feedbacks")
+        fbs = self.redis.hgetall(key)
+        return _indexed_vec(Document.doc_ind, map(int, fbs.keys()), 
+                            map(float, fbs.values()))
+
     def update_kw_feedback(self, kw, fb):
         """update keyword feedback"""
         key = "session:%s:%s" %(self.session_id, "kw_feedbacks")
@@ -239,7 +305,85 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
         self.redis.hmset(key, {doc.id: fb})
         # self.hmset("doc_feedbacks", {doc.id: fb})
 
+    def update_kw_fb_vec(self, idx, values):
+        """
+        update the feedback of the keywords at matrix rows `idx` to `values`
+        """
+        if len(idx):
+            key = "session:%s:%s" %(self.session_id, "kw_feedbacks")
+            self.redis.hmset(key, dict(zip(rows_to_ids(Keyword.kw_ind_r, idx), np.asarray(values).tolist())))
 
+    def update_doc_fb_vec(self, idx, values):
+        """
+        update the feedback of the documents at matrix rows `idx` to `values`
+        """
+        if len(idx):
+            key = "session:%s:%s" %(self.session_id, "doc_feedbacks")
+            self.redis.hmset(key, dict(zip(rows_to_ids(Document.doc_ind_r, idx), np.asarray(values).tolist())))
+
+
+    ####################################
+    # running statistics of the feedbacks, 
+    # kept in the redis hashes `<name>_count`, `<name>_sum` and `<name>_ema`(encoded by `_compact_encode`)
+    ####################################
+    def _add_fb_stats(self, name, fbs, beta = None):
+        """
+        add the feedbacks to the running statistics. 
+        The previous statistics are read in one pipeline and the new ones written in another.
+        
+        fbs: dict, object id -> feedback
+        beta(optional): float, weight of the feedback in the exponential moving average(EMA), 
+                        which is kept only if given
+        
+        Return:
+        dict, object id -> (count, sum, EMA) after the addition, EMA is None if `beta` is not given
+        """
+        if not fbs:
+            return {}
+
+        ids = fbs.keys()
+        fields = map(_compact_encode, ids)
+        suffixes = ("_count", "_sum") + (("_ema", ) if beta is not None else ())
+        
+        pipe = self.redis.pipeline(transaction = False)
+        for suffix in suffixes:
+            pipe.hmget(self._full_key(name + suffix), fields)
+        old_stats = pipe.execute()
+
+        stats = {}
+        for i, _id in enumerate(ids):
+            fb = fbs[_id]
+            count = _decode_stat(old_stats[0][i], 0) + 1
+            fb_sum = _decode_stat(old_stats[1][i], 0.) + fb
+            if beta is None:
+                ema = None
+            elif count == 1: #nothing to average with
+                ema = fb
+            else:
+                #the mean stands in for the EMA not kept before
+                ema = beta * fb + (1 - beta) * _decode_stat(old_stats[2][i], (fb_sum - fb) / (count - 1))
+            stats[_id] = (count, fb_sum, ema)
+
+        pipe = self.redis.pipeline(transaction = False)
+        for suffix, values in zip(suffixes, zip(*stats.values())):
+            pipe.hmset(self._full_key(name + suffix), 
+                       dict(zip(map(_compact_encode, stats.keys()), map(_compact_encode, values))))
+        pipe.execute()
+        
+        return stats
+        
+    def add_kw_fb_stats(self, fbs, beta = None):
+        """
+        add keyword feedbacks(dict, keyword id -> feedback) to the running statistics, see `_add_fb_stats`
+        """
+        return self._add_fb_stats("kw_fb_stats", fbs, beta)
+
+    def add_doc_fb_stats(self, fbs, beta = None):
+        """
+        add document feedbacks(dict, document id -> feedback) to the running statistics, see `_add_fb_stats`
+        """
+        return self._add_fb_stats("doc_fb_stats", fbs, beta)
+        
     ####################################
     #by use of **feedback propagator**
     #to track the docs and kws whose feedback
@@ -248,12 +392,12 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
     @property
     def affected_docs(self):
         return [Document.get(doc_id) 
-                for doc_id in self.get("affected_docs", set())]
+                for doc_id in self.sget("affected_docs")]
 
     @property
     def affected_kws(self):
         return [Keyword.get(kw_id)
-                for kw_id in self.get("affected_kws", set())]
+                for kw_id in self.sget("affected_kws")]
         
     def add_affected_docs(self, *docs):
         doc_ids = [doc.id for doc in docs]
@@ -278,22 +422,22 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
     # 1      [[some_doc_ids, ...],
     # ...    ....,
     # n      [some_doc_ids, ...]]
+    #
+    # Each iteration is an item of a redis list(see `rpush`), so recording one is O(1).
+    # The ids of the latest round are also kept as a redis set under `last_recom_doc_ids`
     ########################
     def add_doc_recom_list(self, docs):
         doc_ids = [doc.id for doc in docs]
         
-        prev_doc_ids = self.get("recommended_docs", []) #list of list of integers
-        prev_doc_ids.append(doc_ids)
-        
-        self.set("recommended_docs", prev_doc_ids)
+        self.rpush("recommended_docs", doc_ids)
+
+        self.delete("last_recom_doc_ids")
+        self.sadd("last_recom_doc_ids", *doc_ids)
     
     def add_kw_recom_list(self, kws):
         kw_ids = [kw.id for kw in kws]
         
-        prev_kw_ids = self.get("recommended_kws", []) #list of list of integers
-        prev_kw_ids.append(kw_ids)
-        
-        self.set("recommended_kws", prev_kw_ids)
+        self.rpush("recommended_kws", kw_ids)
 
     @property
     def recom_docs(self):
@@ -301,7 +445,7 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
         Recommended documents list, from latest to oldest
         """
         return [Document.get_many(id_list)
-                for id_list in  self.get("recommended_docs", [])]
+                for id_list in  self.lrange("recommended_docs")]
         
     @property
     def recom_kws(self):
@@ -309,7 +453,7 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
         Recommended keywords list, from latest to oldest
         """
         return [Keyword.get_many(id_list)
-                for id_list in  self.get("recommended_kws", [])]
+                for id_list in  self.lrange("recommended_kws")]
 
     @property
     def last_recom_docs(self):
@@ -317,76 +461,780 @@ class RedisRecommendationSessionHandler(RecommendationSessionHandler):
         the most recent recommended documents 
         """
         try:
-            return self.recom_docs[-1]
+            return Document.get_many(self.lrange("recommended_docs", -1, -1)[0])
         except IndexError:
             raise Exception("No recent recommended documents available.")
 
+    @property
+    def last_recom_doc_ids(self):
+        """
+        ids of the most recent recommended documents, for O(1) membership test
+        
+        The recommendation history is not read, unless the session was recorded by older versions
+        
+        Return:
+        set of integer
+        """
+        doc_ids = self.sget("last_recom_doc_ids")
+        
+        if not doc_ids: #recorded by older versions?
+            hist = self.lrange("recommended_docs", -1, -1)
+            if hist:
+                doc_ids = set(hist[0])
+                self.sadd("last_recom_doc_ids", *doc_ids)
+                
+        return doc_ids
+
     #############################
     #generic wrapper functions
     #############################
     
+    def _full_key(self, *parts):
+        return ":".join(("session", self.session_id) + parts)
+
+    def _with_migration(self, key, kind, func):
+        """
+        call `func`, which operates on the native redis structure under `key`.
+        
+        If `key` still holds a pickled value written by older versions, 
+        it is migrated(see `_migrate`) and `func` is called again
+        """
+        try:
+            return func()
+        except ResponseError as e:
+            if not str(e).startswith("WRONGTYPE"):
+                raise
+            self._migrate(key, kind)
+            return func()
+
+    def _migrate(self, key, kind):
+        """
+        convert the pickled value under `key` to the native redis structure
+
+        kind: string, "hash", "set", "list" or "dict_list"
+        """
+        print "migrating pickled %s to redis %s" %(key, kind)
+        value = pickle.loads(self.redis.get(self._full_key(key)))
+        self.redis.delete(self._full_key(key))
+
+        if kind == "hash":
+            self.hmset(key, value)
+        elif kind == "set":
+            self.sadd(key, *value)
+        elif kind == "list":
+            self.rpush(key, *value)
+        elif kind == "dict_list":
+            for field, vals in value.items():
+                for val in vals:
+                    self._dict_list_setter(key, {field: val})
+        else:
+            raise ValueError("unknown kind %r" %kind)
+
     def set(self, key, value):
         self.redis.set("session:%s:%s" %(self.session_id, key),  pickle.dumps(value))
 
     def get(self, key, default=None):
-        data = self.redis.get('session:%s:%s' %(self.session_id, key))
+        """
+        get the value specified by key
+
+        hashes and sets(see `hmset` and `sadd`) are returned as dict and set
+        """
+        try:
+            data = self.redis.get('session:%s:%s' %(self.session_id, key))
+        except ResponseError as e: #not a string
+            if not str(e).startswith("WRONGTYPE"):
+                raise
+            
+            key_type = self.redis.type(self._full_key(key))
+            if key_type == "hash":
+                return self.hgetall(key)
+            elif key_type == "set":
+                return self.sget(key)
+            elif key_type == "list":
+                return self.lrange(key)
+            else:
+                raise
+
         if not data:
             return default
         return  pickle.loads(data)
         
     def hmset(self, key, value):
         """
-        set value for hash map
+        set value for hash map, O(1) per field
+
+        The fields and values are encoded compactly(see `_compact_encode`)
+        
         key: string
         value: dict
         """
         assert type(value) is DictType, "value must be dict, but is %r" %value
         
-        d = self.get(key, {})
-
-        assert type(d) is DictType, "`d` must be dict, but is %r" %d
-        
-        d.update(value)
+        if not value:
+            return
+            
+        mapping = dict([(_compact_encode(k), _compact_encode(v))
+                        for k, v in value.items()])
         
-        self.set(key,  d)
+        self._with_migration(key, "hash", 
+                             lambda: self.redis.hmset(self._full_key(key), mapping))
 
     def hget(self, key, key2):
         """
-        get the dict specified by key
+        get the value of field `key2` in the hash map specified by key
         """
-        
-        data = self.get(key)
-        assert type(data) is DictType, "data must be dict, but is %r" %data
-        return data[key2]
+        data = self._with_migration(key, "hash", 
+                                    lambda: self.redis.hget(self._full_key(key), _compact_encode(key2)))
+        if data is None:
+            raise KeyError(key2)
+        return _compact_decode(data)
 
     def hgetall(self, key):
         """
         get the dict specified by key
         """
-        data = self.get(key, {})
-        assert type(data) is DictType, "data must be dict, but is %r" %data
-        return data
+        data = self._with_migration(key, "hash", 
+                                    lambda: self.redis.hgetall(self._full_key(key)))
+        return dict([(_compact_decode(k), _compact_decode(v))
+                     for k, v in data.items()])
 
     def sadd(self, key, *values):
         """
-        add values to set specified by key
+        add values to set specified by key, O(1) per value
         """
-        s = self.get(key, set())
+        if not values:
+            return
 
-        assert isinstance(s, set), "`d` must be set, but is %r" %d
-        
-        s |= set(values)
-        
-        self.set(key,  s)
+        members = map(_compact_encode, values)
+        self._with_migration(key, "set", 
+                             lambda: self.redis.sadd(self._full_key(key), *members))
 
     def sget(self, key):
         """
         get the set specified by key
         """
+        data = self._with_migration(key, "set", 
+                                    lambda: self.redis.smembers(self._full_key(key)))
+        return set(map(_compact_decode, data))
+
+    def rpush(self, key, *values):
+        """
+        append values to the list specified by key, O(1) per value
+        """
+        if not values:
+            return
+
+        items = map(_compact_encode, values)
+        self._with_migration(key, "list", 
+                             lambda: self.redis.rpush(self._full_key(key), *items))
+
+    def lrange(self, key, start = 0, end = -1):
+        """
+        get the items from `start` to `end`(inclusive, negative ones count from the end) of the list specified by key
+        """
+        data = self._with_migration(key, "list", 
+                                    lambda: self.redis.lrange(self._full_key(key), start, end))
+        return map(_compact_decode, data)
+
+    def get_many(self, keys, default = None):
+        """
+        get the values specified by keys(see `get`) in one pipeline
+        """
+        pipe = self.redis.pipeline(transaction = False)
+        for key in keys:
+            pipe.get(self._full_key(key))
+
+        values = []
+        for key, data in zip(keys, pipe.execute(raise_on_error = False)):
+            if isinstance(data, ResponseError): #not a string
+                values.append(self.get(key, default))
+            elif not data:
+                values.append(default)
+            else:
+                values.append(pickle.loads(data))
+        return values
+
+    def hgetall_many(self, keys):
+        """
+        get the dicts specified by keys(see `hgetall`) in one pipeline
+        """
+        pipe = self.redis.pipeline(transaction = False)
+        for key in keys:
+            pipe.hgetall(self._full_key(key))
+
+        values = []
+        for key, data in zip(keys, pipe.execute(raise_on_error = False)):
+            if isinstance(data, ResponseError): #pickled by older versions
+                values.append(self.hgetall(key))
+            else:
+                values.append(dict([(_compact_decode(k), _compact_decode(v))
+                                    for k, v in data.items()]))
+        return values
+        
+    def delete(self, *keys):
+        if keys:
+            self.redis.delete(*[self._full_key(key) for key in keys])
+
+
+def _compact_encode(value):
+    """
+    compact encoding that keeps the type, used for hash fields/values, set members and list items:
+    
+    integers, floats and strings are encoded as "i:1", "f:0.5" and "s:abc"(unicode as "u:<utf-8 bytes>"), 
+    other values are pickled as "p:<pickle>"
+    """
+    value_type = type(value)
+    if value_type in (IntType, LongType):
+        return "i:%d" %value
+    elif value_type is FloatType:
+        return "f:%r" %value
+    elif value_type is StringType:
+        return "s:" + value
+    elif value_type is UnicodeType:
+        return "u:" + value.encode("utf-8")
+    else:
+        return "p:" + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+_COMPACT_DECODERS = {"i": int, 
+                     "f": float, 
+                     "s": str, 
+                     "u": lambda s: s.decode("utf-8"), 
+                     "p": pickle.loads}
+
+def _compact_decode(s):
+    """
+    inverse of `_compact_encode`
+    """
+    return _COMPACT_DECODERS[s[0]](s[2:])
+
+def _decode_stat(s, default):
+    """
+    decode the running statistic, `default` if missing
+
+    The plain numbers written by HINCRBY/HINCRBYFLOAT in older versions are accepted as well
+    """
+    if s is None:
+        return default
+    elif s[1:2] == ":":
+        return _compact_decode(s)
+    else:
+        return type(default)(float(s))
+
+def _sorted_vec(idx, values, dtype = np.float64):
+    """
+    sparse vector (row indices, values) sorted by row index
+    """
+    idx = np.asarray(idx, dtype = np.int32)
+    values = np.asarray(values, dtype = dtype)
+    order = np.argsort(idx, kind = "mergesort")
+    return idx[order], values[order]
+
+def _indexed_vec(id2ind_map, ids, values):
+    """
+    sparse vector over the matrix rows, see `_sorted_vec`. 
+    
+    The ids not in the mapping(e.g, documents left out of the feature matrix) are skipped
+    """
+    known = has_ids(id2ind_map, ids)
+    return _sorted_vec(ids_to_rows(id2ind_map, [_id for _id, k in zip(ids, known) if k]), 
+                       np.asarray(values, dtype = np.float64)[known])
+
+def _encode(value):
+    """
+    encode the value the same way as the redis client does, 
+    so that the cached value equals to the one read back from redis
+    """
+    if isinstance(value, str):
+        return value
+    elif isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, float):
+        return repr(value)
+    else:
+        return str(value)
+
+class RedisSnapshot(object):
+    """
+    Redis connection wrapper that reads each key at most once and buffers the writes.
+    
+    `get`, `set`, `delete`, `type`, `hget`, `hmget`, `hgetall`, `hmset`, `sadd`, `smembers`, `rpush` and `lrange` 
+    are served from memory. So are the commands queued in `pipeline`.
+    The other commands are not supported and raise AttributeError.
+    """
+    #the commands reading a key, by the kind of the key they read
+    _READS = {"get": "string", 
+              "hget": "hash", "hmget": "hash", "hgetall": "hash", 
+              "smembers": "set", 
+              "lrange": "list"}
+    
+    def __init__(self, conn):
+        self.conn = conn
+        
+        self.__strings = {} #key -> string or None
+        self.__hashes = {} #key -> dict
+        self.__sets = {} #key -> set
+        self.__lists = {} #key -> list
+        self.__pushed = {} #key -> list, the items pushed to the lists not read yet
+        self.__writes = [] #list of (command name, args)
+
+    def prefetch(self, string_keys = [], hash_keys = []):
+        """
+        read the keys in one pipeline
+        """
+        self.warm([(key, "string") for key in string_keys] + 
+                  [(key, "hash") for key in hash_keys])
+
+    def warm(self, keys):
+        """
+        read the keys not read yet, in one pipeline
+
+        keys: list of (key, kind), kind is "string", "hash", "set" or "list"
         
-        data = self.get(key, set())
-        assert isinstance(data, set) , "data must be set, but is %r" %data
-        return data
+        The keys failed to read(e.g, of another type) are left out, 
+        so that the error is raised when they are used
+        """
+        readers = {"string": lambda pipe, key: pipe.get(key),
+                   "hash": lambda pipe, key: pipe.hgetall(key),
+                   "set": lambda pipe, key: pipe.smembers(key),
+                   "list": lambda pipe, key: pipe.lrange(key, 0, -1)}
+        caches = {"string": self.__strings, 
+                  "hash": self.__hashes, 
+                  "set": self.__sets, 
+                  "list": self.__lists}
         
-    def delete(self, key):
-        self.redis.delete('session:%s:%s' %(self.session_id, key))
+        keys = [(key, kind) for key, kind in set(keys)
+                if not caches[kind].has_key(key)]
+        if not keys:
+            return
+            
+        pipe = self.conn.pipeline(transaction = False)
+        for key, kind in keys:
+            readers[kind](pipe, key)
+            
+        for (key, kind), value in zip(keys, pipe.execute(raise_on_error = False)):
+            if isinstance(value, ResponseError):
+                continue
+            if kind == "list":
+                value = value + self.__pushed.pop(key, [])
+            caches[kind][key] = value
+        
+    def get(self, key):
+        if not self.__strings.has_key(key):
+            self.__strings[key] = self.conn.get(key)
+        return self.__strings[key]
+
+    def set(self, key, value):
+        self.__strings[key] = _encode(value)
+        self.__writes.append(("set", (key, value)))
+
+    def delete(self, *keys):
+        for key in keys:
+            self.__strings[key] = None
+            self.__hashes[key] = {}
+            self.__sets[key] = set()
+            self.__lists[key] = []
+            self.__pushed.pop(key, None)
+        self.__writes.append(("delete", keys))
+
+    def type(self, key):
+        for key_type, cache in (("string", self.__strings), ("hash", self.__hashes), 
+                                ("set", self.__sets), ("list", self.__lists)):
+            if cache.get(key):
+                return key_type
+        if self.__pushed.get(key):
+            return "list"
+        return self.conn.type(key)
+        
+    def __hash(self, key):
+        if not self.__hashes.has_key(key):
+            self.__hashes[key] = self.conn.hgetall(key)
+        return self.__hashes[key]
+        
+    def hget(self, key, field):
+        return self.__hash(key).get(_encode(field))
+
+    def hmget(self, key, fields, *args):
+        h = self.__hash(key)
+        return [h.get(_encode(field)) for field in list(fields) + list(args)]
+        
+    def hgetall(self, key):
+        return dict(self.__hash(key))
+
+    def hmset(self, key, mapping):
+        self.__hash(key).update([(_encode(k), _encode(v))
+                                 for k, v in mapping.items()])
+        self.__writes.append(("hmset", (key, mapping)))
+
+    def __set(self, key):
+        if not self.__sets.has_key(key):
+            self.__sets[key] = self.conn.smembers(key)
+        return self.__sets[key]
+
+    def smembers(self, key):
+        return set(self.__set(key))
+
+    def sadd(self, key, *values):
+        self.__set(key).update(map(_encode, values))
+        self.__writes.append(("sadd", (key, ) + values))
+
+    def __list(self, key):
+        if not self.__lists.has_key(key):
+            self.__lists[key] = self.conn.lrange(key, 0, -1) + self.__pushed.pop(key, [])
+        return self.__lists[key]
+        
+    def lrange(self, key, start, end):
+        items = self.__list(key)
+        n = len(items)
+        if start < 0:
+            start = max(n + start, 0)
+        if end < 0:
+            end = n + end
+        return items[start: end + 1]
+
+    def rpush(self, key, *values):
+        """
+        append the values to the list, without reading it
+        """
+        items = map(_encode, values)
+        if self.__lists.has_key(key):
+            self.__lists[key].extend(items)
+        else:
+            self.__pushed.setdefault(key, []).extend(items)
+        self.__writes.append(("rpush", (key, ) + values))
+
+    def pipeline(self, transaction = True):
+        """
+        pipeline whose commands are served by this snapshot, see `RedisSnapshotPipeline`
+        """
+        return RedisSnapshotPipeline(self)
+        
+    def flush(self):
+        """
+        write the buffered changes in one pipeline
+        """
+        if self.__writes:
+            pipe = self.conn.pipeline()
+            for command, args in self.__writes:
+                getattr(pipe, command)(*args)
+            pipe.execute()
+            
+            self.__writes = []
+
+    def discard(self):
+        """
+        forget the buffered changes and the values read
+        """
+        self.__writes = []
+        self.__strings = {}
+        self.__hashes = {}
+        self.__sets = {}
+        self.__lists = {}
+        self.__pushed = {}
+        
+    def __getattr__(self, command):
+        #other commands would bypass the buffered state, so they are refused instead of sent to redis
+        raise AttributeError("%r is not supported by the session snapshot" %command)
+
+class RedisSnapshotPipeline(object):
+    """
+    Pipeline on `RedisSnapshot`. 
+
+    The queued commands are run against the snapshot by `execute`, 
+    so that the writes are buffered in the snapshot and the reads are served by it
+    (the keys not read yet are read in one pipeline).
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.commands = [] #list of (command name, args, kwargs)
+
+    def __getattr__(self, command):
+        getattr(self.snapshot, command) #raise AttributeError if not supported
+        
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self, raise_on_error = True):
+        snapshot = self.snapshot
+        snapshot.warm([(args[0], snapshot._READS[command])
+                       for command, args, _ in self.commands
+                       if snapshot._READS.has_key(command)])
+
+        results = []
+        for command, args, kwargs in self.commands:
+            try:
+                results.append(getattr(snapshot, command)(*args, **kwargs))
+            except ResponseError as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+                
+        self.commands = []
+        return results
+        
+class SessionSnapshot(RedisRecommendationSessionHandler):
+    """
+    Snapshot of a session for one request.
+
+    The keyword and document feedbacks are loaded in one pipelined read when the snapshot is taken.
+    Afterwards, every key is read from redis at most once and 
+    the writes are kept in memory until `flush`, which sends them in one pipeline.
+
+    Used as a context manager, it flushes on exit, unless an exception is raised:
+
+    with session.snapshot() as snapshot:
+        ...
+    """
+    def __init__(self, session):
+        self.session = session
+        self.session_id = session.session_id
+        
+        self.redis = RedisSnapshot(session.redis)
+        self.redis.prefetch(string_keys = [self._full_key(key) for key in self._FB_STRING_KEYS],
+                            hash_keys = [self._full_key(key) for key in self._FB_HASH_KEYS])
+
+        self.__kw_feedbacks = None
+        self.__doc_feedbacks = None
+
+    @property
+    def kw_feedbacks(self):
+        """keyword feedback, shared by the callers and thus should not be modified"""
+        if self.__kw_feedbacks is None:
+            self.__kw_feedbacks = super(SessionSnapshot, self).kw_feedbacks
+        return self.__kw_feedbacks
+            
+    @property
+    def doc_feedbacks(self):
+        """document feedback, shared by the callers and thus should not be modified"""
+        if self.__doc_feedbacks is None:
+            self.__doc_feedbacks = super(SessionSnapshot, self).doc_feedbacks
+        return self.__doc_feedbacks
+
+    def update_kw_feedback(self, kw, fb):
+        super(SessionSnapshot, self).update_kw_feedback(kw, fb)
+        if self.__kw_feedbacks is not None:
+            self.__kw_feedbacks[kw] = float(fb)
+
+    def update_doc_feedback(self, doc, fb):
+        super(SessionSnapshot, self).update_doc_feedback(doc, fb)
+        if self.__doc_feedbacks is not None:
+            self.__doc_feedbacks[doc] = float(fb)
+
+    def update_kw_fb_vec(self, idx, values):
+        super(SessionSnapshot, self).update_kw_fb_vec(idx, values)
+        self.__kw_feedbacks = None
+
+    def update_doc_fb_vec(self, idx, values):
+        super(SessionSnapshot, self).update_doc_fb_vec(idx, values)
+        self.__doc_feedbacks = None
+
+    def flush(self):
+        """write the changes to redis"""
+        self.redis.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.redis.discard()
+
+class RedisWriteBatch(object):
+    """
+    Write-only redis connection stand-in that merges `set`, `hmset` and `sadd` in memory
+    """
+    def __init__(self):
+        self.strings = {} #key -> value
+        self.hashes = {} #key -> dict
+        self.sets = {} #key -> set
+
+    def set(self, key, value):
+        self.strings[key] = value
+
+    def hmset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def sadd(self, key, *values):
+        self.sets.setdefault(key, set()).update(values)
+
+class SessionWriteBatch(RedisRecommendationSessionHandler):
+    """
+    Write-only view of a session. 
+
+    `set`, `hmset`, `sadd` and the methods built on them(e.g, `add_affected_docs`) are merged in memory, 
+    later writes to the same key/field overriding the earlier ones.
+    `flush` sends them to redis in one pipeline. Reading is not supported.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.session_id = session.session_id
+
+        self.redis = RedisWriteBatch()
+
+    def flush(self):
+        """
+        write the merged changes to the session.
+
+        Pickled values of older versions under the hashes/sets are migrated first, 
+        which are found by one pipelined TYPE query
+        """
+        conn = self.session.redis
+        batch = self.redis
+        
+        native_keys = [(key, "hash") for key in batch.hashes] + [(key, "set") for key in batch.sets]
+        if native_keys:
+            pipe = conn.pipeline(transaction = False)
+            for key, _ in native_keys:
+                pipe.type(key)
+                
+            prefix_len = len(self._full_key(""))
+            for (key, kind), key_type in zip(native_keys, pipe.execute()):
+                if key_type == "string":
+                    self.session._migrate(key[prefix_len:], kind)
+
+        pipe = conn.pipeline()
+        for key, value in batch.strings.items():
+            pipe.set(key, value)
+        for key, mapping in batch.hashes.items():
+            pipe.hmset(key, mapping)
+        for key, members in batch.sets.items():
+            pipe.sadd(key, *members)
+        pipe.execute()
+
+        self.redis = RedisWriteBatch()
+
+class VectorizedRecommendationSessionHandler(RedisRecommendationSessionHandler):
+    """
+    Session that keeps the keyword and document feedbacks as sparse float32 vectors 
+    aligned with the matrix rows(`Keyword.kw_ind` and `Document.doc_ind`), 
+    so that they can be read as arrays without building objects.
+
+    Each vector is a single redis value, which holds the int32 row indices followed by the float32 values, sorted by row index
+    """
+    _FB_HASH_KEYS = ()
+    _FB_STRING_KEYS = ("kw_fb_vec", "doc_fb_vec")
+    
+    def snapshot(self):
+        return VectorizedSessionSnapshot(self)
+        
+    def _get_vec(self, key):
+        return _decode_vec(self.redis.get(self._full_key(key)))
+
+    def _update_vec(self, key, idx, values):
+        """
+        the entries in (idx, values) override the existing ones(the last one wins if an index repeats)
+
+        The vector is read and written under WATCH/MULTI, which is retried if the vector changes meanwhile, 
+        so that concurrent updates are not lost
+        """
+        full_key = self._full_key(key)
+        
+        def patch(pipe):
+            vec = _decode_vec(pipe.get(full_key))
+            pipe.multi()
+            pipe.set(full_key, _encode_vec(*_patched_vec(vec, idx, values)))
+            
+        self.redis.transaction(patch, full_key)
+
+    @property
+    def kw_fb_vec(self):
+        """
+        (array of int32: row indices, array of float32: feedback values), see `RedisRecommendationSessionHandler.kw_fb_vec`
+        """
+        return self._get_vec("kw_fb_vec")
+
+    @property
+    def doc_fb_vec(self):
+        """
+        (array of int32: row indices, array of float32: feedback values), see `RedisRecommendationSessionHandler.doc_fb_vec`
+        """
+        return self._get_vec("doc_fb_vec")
+
+    @property
+    def kw_feedbacks(self):
+        """keyword feedback"""
+        idx, values = self.kw_fb_vec
+        return dict(zip(Keyword.get_many(rows_to_ids(Keyword.kw_ind_r, idx)), values.tolist()))
+
+    @property
+    def doc_feedbacks(self):
+        """document feedback"""
+        idx, values = self.doc_fb_vec
+        return dict(zip(Document.get_many(rows_to_ids(Document.doc_ind_r, idx)), values.tolist()))
+
+    def update_kw_feedback(self, kw, fb):
+        """update keyword feedback"""
+        self.update_kw_fb_vec([Keyword.kw_ind[kw.id]], [fb])
+
+    def update_doc_feedback(self, doc, fb):
+        """update document feedback"""
+        self.update_doc_fb_vec([Document.doc_ind[doc.id]], [fb])
+
+    def update_kw_fb_vec(self, idx, values):
+        self._update_vec("kw_fb_vec", idx, values)
+
+    def update_doc_fb_vec(self, idx, values):
+        self._update_vec("doc_fb_vec", idx, values)
+
+class VectorizedSessionSnapshot(SessionSnapshot, VectorizedRecommendationSessionHandler):
+    """
+    Snapshot of a `VectorizedRecommendationSessionHandler`
+
+    The updates of the feedback vectors are merged in memory. 
+    `flush` applies them to the session as one patch per vector(see `VectorizedRecommendationSessionHandler._update_vec`), 
+    so the entries updated by others meanwhile are kept
+    """
+    def __init__(self, session):
+        super(VectorizedSessionSnapshot, self).__init__(session)
+
+        self.__vecs = {} #key -> (idx, values), the vector seen by the snapshot
+        self.__patches = {} #key -> (idx, values), the merged updates
+
+    def _get_vec(self, key):
+        if not self.__vecs.has_key(key):
+            self.__vecs[key] = super(VectorizedSessionSnapshot, self)._get_vec(key)
+        return self.__vecs[key]
+        
+    def _update_vec(self, key, idx, values):
+        self.__vecs[key] = _patched_vec(self._get_vec(key), idx, values)
+        self.__patches[key] = _patched_vec(self.__patches.get(key, _decode_vec(None)), idx, values)
+
+    def flush(self):
+        super(VectorizedSessionSnapshot, self).flush()
+
+        for key, (idx, values) in self.__patches.items():
+            self.session._update_vec(key, idx, values)
+        self.__patches = {}
+
+def _decode_vec(data):
+    """
+    the sparse vector (array of int32: row indices, array of float32: values) packed by `_encode_vec`, 
+    empty if `data` is None or empty
+    """
+    if not data:
+        return np.array([], dtype = np.int32), np.array([], dtype = np.float32)
+    
+    n = len(data) / 8
+    return (np.frombuffer(data[:4 * n], dtype = np.int32), 
+            np.frombuffer(data[4 * n:], dtype = np.float32))
+
+def _encode_vec(idx, values):
+    """
+    pack the sparse vector as the int32 row indices followed by the float32 values
+    """
+    return np.asarray(idx, dtype = np.int32).tostring() + np.asarray(values, dtype = np.float32).tostring()
+
+def _patched_vec(vec, idx, values):
+    """
+    the sparse vector `vec` with the entries in (idx, values) overriding the existing ones
+    (the last one wins if an index repeats), sorted by row index
+    """
+    old_idx, old_values = vec
+    all_idx = np.concatenate([np.asarray(idx, dtype = np.int32)[::-1], old_idx])
+    all_values = np.concatenate([np.asarray(values, dtype = np.float32)[::-1], old_values])
+
+    new_idx, first = np.unique(all_idx, return_index = True)
+    return new_idx.astype(np.int32), all_values[first]
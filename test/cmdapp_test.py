@@ -59,6 +59,21 @@ class CmdAppTest(unittest.TestCase):
         self.assertAlmostEqual(1 / 4., kws[2].fb(self.session))
         self.assertAlmostEqual(0., kws[3].fb(self.session))
         
+    def test_receive_feedbacks_in_snapshot(self):
+        with self.session.snapshot() as snapshot:
+            self.app.receive_feedbacks(snapshot, self.fb)
+        
+        docs = Document.get_many([1,2,3])
+        self.assertAlmostEqual(0.183701573217 * .3  + .7 * .5, docs[0].fb(self.session))
+        self.assertAlmostEqual(0.191506501383, docs[1].fb(self.session))
+
+        kws = Keyword.get_many(["a", "redis"])
+        self.assertAlmostEqual(0.56689342264886755 * .5 / (0.56689342264886755 + 0.49704058656839417), kws[0].fb(self.session))
+        self.assertAlmostEqual(1 / 4. * .3 + .5 * .7, kws[1].fb(self.session))
+
+        self.assertEqual([], self.session.affected_docs)
+        self.assertEqual([], self.session.affected_kws)
+        
     def test_recommend_initial(self):
         docs , kws = self.app.recommend(start = True, query = "python, redis")
         self.assertEqual(3, len(docs))
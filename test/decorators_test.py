@@ -0,0 +1,84 @@
+##############################
+# Test the bounded memoizer
+##############################
+import unittest
+import time
+
+from scinet3.decorators import (memoized, cache_infos)
+
+class Obj(object):
+    def __init__(self, _id):
+        self.memo_key = ("Obj", _id)
+
+class MemoizedTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def counted(self, **kwargs):
+        @memoized(**kwargs)
+        def f(x, y = 1):
+            self.calls.append(x)
+            return x
+        return f
+
+    def test_hit_and_miss(self):
+        f = self.counted()
+
+        self.assertEqual(1, f(1))
+        self.assertEqual(1, f(1))
+        self.assertEqual(1, f(1, y = 2))
+
+        self.assertEqual([1, 1], self.calls)
+        self.assertEqual({"hits": 1, "misses": 2, "evictions": 0, "size": 2, "maxsize": 10000},
+                         f.cache_info())
+
+        f.cache_clear()
+        self.assertEqual({"hits": 0, "misses": 0, "evictions": 0, "size": 0, "maxsize": 10000},
+                         f.cache_info())
+
+    def test_lru(self):
+        f = self.counted(maxsize = 2)
+        f(1); f(2); f(1); f(3) #2 is evicted
+        f(1); f(2)
+
+        self.assertEqual([1, 2, 3, 2], self.calls)
+        self.assertEqual(2, f.cache_info()["evictions"])
+        self.assertEqual(2, f.cache_info()["size"])
+
+    def test_ttl(self):
+        f = self.counted(ttl = .05)
+        f(1); f(1)
+        time.sleep(.1)
+        f(1)
+
+        self.assertEqual([1, 1], self.calls)
+
+    def test_memo_key(self):
+        """
+        objects with the same memo_key share the cache entry
+        """
+        f = self.counted()
+        a, b = Obj(1), Obj(1)
+        f(a)
+        f(b)
+        self.assertEqual([a], self.calls)
+
+    def test_unhashable(self):
+        f = self.counted()
+        f([1]); f([1])
+
+        self.assertEqual([[1], [1]], self.calls)
+        self.assertEqual(0, f.cache_info()["size"])
+
+    def test_plain_decorator(self):
+        @memoized
+        def g(x):
+            return x * 2
+
+        self.assertEqual(4, g(2))
+        self.assertEqual(4, g(2))
+        self.assertEqual(1, g.cache_info()["hits"])
+        self.assertTrue(g.cache_info() in cache_infos().values())
+
+if __name__ == "__main__":
+    unittest.main()
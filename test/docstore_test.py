@@ -0,0 +1,62 @@
+##############################
+# Test the columnar document store
+##############################
+import unittest
+
+from scinet3.docstore import (DocumentStore, DocumentSequence)
+
+class DocumentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = [{"id": 3, "title": u"caf\u00e9", "year": 2012, "score": None, "keywords": '["a"]'},
+                     {"id": 1, "title": "redis", "year": None, "score": .5, "keywords": '["b"]'},
+                     {"id": 8, "title": None, "year": 2013, "score": 1, "keywords": '["c"]'}]
+        
+        self.doc_ind = {1: 0, 5: 1, 3: 2, 8: 3}
+        self.store = DocumentStore(self.doc_ind, self.rows + [{"id": 9, "title": "not in the matrix"}])
+
+    def test_row(self):
+        self.assertEqual({"id": 3, "title": u"caf\u00e9", "year": 2012, "score": None}, 
+                         self.store.row(2))
+        self.assertEqual({"id": 1, "title": u"redis", "year": None, "score": .5}, 
+                         self.store.row(0))
+        self.assertEqual({"id": 8, "title": None, "year": 2013, "score": 1.}, 
+                         self.store.row(3))
+
+    def test_presence(self):
+        self.assertEqual(3, len(self.store))
+        self.assertEqual([0, 2, 3], self.store.positions().tolist())
+        
+        self.assertTrue(self.store.has(1))
+        self.assertFalse(self.store.has(5)) #in the matrix only
+        self.assertFalse(self.store.has(9)) #in the table only
+        
+        self.assertEqual([9], [row["id"] for row in self.store.leftover_rows])
+
+    def test_one_buffer_per_string_field(self):
+        title = self.store.columns["title"]
+        #in the order the rows come
+        self.assertEqual(u"caf\u00e9".encode("utf-8") + "redis", title.buffer)
+        self.assertEqual([5, 0, 0, 0], title.starts.tolist())
+        self.assertEqual([10, 0, 5, 0], title.ends.tolist())
+
+    def test_mixed_types(self):
+        store = DocumentStore({1: 0, 2: 1, 3: 2}, 
+                              [{"id": 1, "score": 1, "tag": None, "note": "a"}, 
+                               {"id": 2, "score": .5, "tag": None, "note": 2},
+                               {"id": 3, "score": None, "tag": None, "note": None}])
+        
+        self.assertEqual([1., .5, None], [store.row(pos)["score"] for pos in xrange(3)])
+        self.assertEqual([None] * 3, [store.row(pos)["tag"] for pos in xrange(3)])
+        self.assertEqual([u"a", 2, None], [store.row(pos)["note"] for pos in xrange(3)])
+    
+    def test_sequence(self):
+        docs = DocumentSequence(self.store, self.store.row)
+
+        self.assertEqual(3, len(docs))
+        self.assertEqual([1, 3, 8], docs.ids)
+        self.assertEqual([1, 3, 8], [doc["id"] for doc in docs])
+        self.assertEqual(8, docs[-1]["id"])
+        self.assertEqual([3, 8], [doc["id"] for doc in docs[1:]])
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+###############################
+# Testing the iterative feedback propagator
+###############################
+import unittest
+import numpy as np
+from scipy.sparse import bmat
+
+from util import (config_doc_kw_model, get_session, NumericTestCase)
+
+#config model, 
+#only done once
+config_doc_kw_model()
+
+from scinet3.model import (Document, Keyword)
+from scinet3.fb_propagator import IterativePropagator as ppgt
+from scinet3.fb_updater import OverrideUpdater as upd
+
+class IterativePropagatorTest(NumericTestCase):
+    def assertArrayAlmostEqual(self, arr1, arr2):
+        #the scores are as precise as the tolerance
+        for x,y in zip(arr1, arr2):
+            self.assertAlmostEqual(x, y, places = 5)
+        
+    def setUp(self):
+        self.session = get_session()
+        
+        self.session.add_doc_recom_list(Document.get_many([1,2]))
+
+        self.fb = {"docs": [[1, .5]],
+                   "kws": [["redis", .8]],
+                   "dockws": [["database", 2, .6]]}
+
+    def tearDown(self):
+        ppgt.config(damping = .5, max_iter = 50, min_fb = 1e-3)
+
+    def fixed_point(self, damping):
+        """
+        the scores solved directly
+        """
+        P_kw2doc = ppgt._row_normalized(Keyword.kw2doc_m)
+        P_doc2kw = ppgt._row_normalized(Document.doc2kw_m)
+        P = bmat([[None, P_kw2doc], [P_doc2kw, None]]).toarray()
+        
+        s = np.concatenate(ppgt.seeds(self.fb))
+        x = np.linalg.solve(np.eye(len(s)) - damping * P, s)
+        
+        return x[:Keyword.kw2doc_m.shape[0]], x[Keyword.kw2doc_m.shape[0]:]
+
+    def test_seeds(self):
+        s_kw, s_doc = ppgt.seeds(self.fb)
+        
+        self.assertAlmostEqual(.8, s_kw[Keyword.kw_ind["redis"]])
+        self.assertAlmostEqual(.6, s_kw[Keyword.kw_ind["database"]])
+        self.assertAlmostEqual(.5, s_doc[Document.doc_ind[1]])
+        self.assertAlmostEqual(.8 + .6, s_kw.sum())
+        self.assertAlmostEqual(.5, s_doc.sum())
+
+    def test_iterate(self):
+        x_kw, x_doc, iter_n = ppgt.iterate(*ppgt.seeds(self.fb))
+        expected_kw, expected_doc = self.fixed_point(.5)
+        
+        self.assertTrue(iter_n < ppgt.max_iter)
+        self.assertArrayAlmostEqual(expected_kw, x_kw)
+        self.assertArrayAlmostEqual(expected_doc, x_doc)
+
+    def test_iterate_no_damping(self):
+        """
+        nothing is propagated, so the scores are the seeds
+        """
+        ppgt.config(damping = 0)
+        s_kw, s_doc = ppgt.seeds(self.fb)
+        x_kw, x_doc, iter_n = ppgt.iterate(s_kw, s_doc)
+        
+        self.assertEqual(2, iter_n)
+        self.assertArrayAlmostEqual(s_kw, x_kw)
+        self.assertArrayAlmostEqual(s_doc, x_doc)
+
+    def test_explicit_fb_full_weight(self):
+        """
+        the explicit feedback is not scaled down by the damping
+        """
+        x_kw, x_doc, iter_n = ppgt.iterate(*ppgt.seeds(self.fb))
+        
+        self.assertTrue(x_kw[Keyword.kw_ind["redis"]] >= .8)
+        self.assertTrue(x_doc[Document.doc_ind[1]] >= .5)
+
+    def test_normalized_matrix_cached(self):
+        P = ppgt._row_normalized(Keyword.kw2doc_m)
+        self.assertTrue(P is ppgt._row_normalized(Keyword.kw2doc_m))
+        
+        #another matrix gets its own normalized copy
+        m = Keyword.kw2doc_m.copy()
+        self.assertFalse(P is ppgt._row_normalized(m))
+
+    def test_max_iter(self):
+        ppgt.config(max_iter = 1)
+        x_kw, x_doc, iter_n = ppgt.iterate(*ppgt.seeds(self.fb))
+        
+        self.assertEqual(1, iter_n)
+        self.assertArrayAlmostEqual(ppgt.seeds(self.fb)[0], x_kw)
+
+    def test_propagate(self):
+        ppgt.propagate(self.fb, self.session)
+        x_kw, x_doc = self.fixed_point(.5)
+
+        #the objects reached are affected
+        affected_kws = set([Keyword.kw_ind_r[ind] for ind in np.flatnonzero(x_kw > ppgt.min_fb)])
+        affected_docs = set([Document.doc_ind_r[ind] for ind in np.flatnonzero(x_doc > ppgt.min_fb)])
+        self.assertEqual(affected_kws, set([kw.id for kw in self.session.affected_kws]))
+        self.assertEqual(affected_docs, set([doc.id for doc in self.session.affected_docs]))
+        
+        redis = Keyword.get("redis")
+        self.assertAlmostEqual(x_kw[Keyword.kw_ind["redis"]], redis.fb_from_kw(self.session), places = 5)
+        
+        doc = Document.get(1)
+        self.assertAlmostEqual(x_doc[Document.doc_ind[1]], doc.fb_from_doc(self.session), places = 5)
+
+        #the score is weighted by alpha
+        upd.update(self.session)
+        self.assertAlmostEqual(.7 * x_kw[Keyword.kw_ind["redis"]], redis.fb(self.session), places = 5)
+        self.assertAlmostEqual(.7 * x_doc[Document.doc_ind[1]], doc.fb(self.session), places = 5)
+
+    def test_bad_config(self):
+        for kwargs in [{"damping": 1}, {"damping": 1.5}, {"damping": -.1}, 
+                       {"tol": 0}, {"max_iter": 0}, {"min_fb": -1}, 
+                       {"max_iter": 10, "damping": 1}, #nothing set if any is invalid
+                       {"alpha": .5}]:
+            self.assertRaises(AssertionError, ppgt.config, **kwargs)
+            
+        self.assertEqual(.5, ppgt.damping)
+        self.assertEqual(50, ppgt.max_iter)
+        self.assertEqual(1e-3, ppgt.min_fb)
+        
+if __name__ == "__main__":
+    unittest.main()
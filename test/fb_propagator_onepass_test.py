@@ -83,3 +83,54 @@ class OnePassPropagatorTest(unittest.TestCase):
 
 
 
+
+    def test_propagate(self):
+        """
+        The whole payload in one batch gives the same result as `test_all_together`
+        """
+        recom_docs = [Document.get(_id) for _id in [1,2,3]]
+        self.session.add_doc_recom_list(recom_docs)
+
+        ppgt.propagate({"docs": [[1, .5]],
+                        "kws": [["redis", .5]],
+                        "dockws": [["redis", 1, .5]]}, 
+                       self.session)
+
+        upd.update(self.session)
+
+        self.assertAlmostEqual(0.56689342264886755 * .5 / (0.56689342264886755 + 0.49704058656839417), Keyword.get("a").fb(self.session))
+        self.assertAlmostEqual(1 / 4. * .3 + .5 * .7, Keyword.get("redis").fb(self.session))
+        self.assertAlmostEqual(1 / 4., Keyword.get("database").fb(self.session))
+        
+        self.assertAlmostEqual(0.183701573217 * .3  + .7 * .5, recom_docs[0].fb(self.session))
+        self.assertAlmostEqual(0.191506501383, recom_docs[1].fb(self.session))
+        self.assertAlmostEqual(0, recom_docs[2].fb(self.session))
+
+    def test_write_batch(self):
+        doc = Document.get(1)
+        kw = Keyword.get("redis")
+        
+        batch = self.session.write_batch()
+        ppgt.fb_from_doc(doc, .5, batch)
+        ppgt.fb_from_dockw(kw, doc, .8, batch)
+
+        #nothing written before flush
+        self.assertEqual(0., doc.fb_from_doc(self.session))
+        self.assertEqual([], self.session.affected_kws)
+
+        batch.flush()
+
+        self.assertEqual(.5, doc.fb_from_doc(self.session))
+        self.assertEqual({kw: .8}, doc.fb_from_kw(self.session))
+        self.assertEqual({doc: .8}, kw.fb_from_doc(self.session)) #the later one overrides
+        self.assertEqual(set(doc.keywords), set(self.session.affected_kws))
+        self.assertEqual([doc], self.session.affected_docs)
+
+    def test_propagate_migrates_pickled_values(self):
+        doc = Document.get(1)
+        kw = Keyword.get("redis")
+        self.session.set(kw._redis_key_fb_from_doc, {2: .3})
+        
+        ppgt.propagate({"docs": [[1, .5]]}, self.session)
+        
+        self.assertEqual({doc: .5, Document.get(2): .3}, kw.fb_from_doc(self.session))
@@ -0,0 +1,190 @@
+###############################
+# Testing the feedback updaters
+###############################
+import unittest
+from collections import (defaultdict, namedtuple)
+from util import (config_doc_kw_model, get_session, get_vectorized_session)
+
+#config model, 
+#only done once
+config_doc_kw_model()
+
+from scinet3.model import (Document, Keyword)
+from scinet3.fb_propagator import OnePassPropagator as ppgt
+from scinet3.fb_updater import (OverrideUpdater, VectorizedOverrideUpdater, MeanUpdater, EMAUpdater)
+
+Document.load_all_from_db() #so that `Keyword.docs` is complete
+
+class VectorizedOverrideUpdaterTest(unittest.TestCase):
+    """
+    VectorizedOverrideUpdater should give the same numbers as OverrideUpdater
+    """
+    def setUp(self):
+        self.fb = {"docs": [[1, .5], [4, .3]],
+                   "kws": [["redis", .5], ["mysql", .9]],
+                   "dockws": [["redis", 1, .5], ["python", 5, .2]]}
+        
+    def assertSameUpdate(self, fb_list, session_getter = get_session):
+        sessions = []
+        for updater in (OverrideUpdater, VectorizedOverrideUpdater):
+            session = session_getter()
+            for fb in fb_list:
+                session.add_doc_recom_list(Document.get_many([1, 2, 3, 5]))
+                ppgt.propagate(fb, session)
+                updater.update(session)
+            sessions.append(session)
+            
+        expected, actual = sessions
+        
+        self.assertEqual(set(expected.kw_feedbacks.keys()), set(actual.kw_feedbacks.keys()))
+        for kw, fb in expected.kw_feedbacks.items():
+            self.assertAlmostEqual(fb, kw.fb(actual))
+
+        self.assertEqual(set(expected.doc_feedbacks.keys()), set(actual.doc_feedbacks.keys()))
+        for doc, fb in expected.doc_feedbacks.items():
+            self.assertAlmostEqual(fb, doc.fb(actual))
+
+        #the loop is done
+        self.assertEqual([], actual.affected_kws)
+        self.assertEqual([], actual.affected_docs)
+        self.assertEqual({}, Keyword.get("redis").fb_from_doc(actual))
+        self.assertEqual(0., Document.get(1).fb_from_doc(actual))
+            
+    def test_same_as_override(self):
+        self.assertSameUpdate([self.fb])
+
+    def test_several_iterations(self):
+        self.assertSameUpdate([self.fb, 
+                               {"docs": [[2, 1.]], "kws": [["a", .1]]}])
+
+    def test_on_vectorized_session(self):
+        self.assertSameUpdate([self.fb], get_vectorized_session)
+
+    def test_zero_weight_sum(self):
+        """
+        keyword "tornado" appears in none of the recommended documents
+        """
+        session = get_session()
+        session.add_doc_recom_list(Document.get_many([1, 2]))
+        ppgt.propagate({"docs": [[3, .5]]}, session)
+        
+        VectorizedOverrideUpdater.update(session)
+
+        self.assertEqual(0, Keyword.get("tornado").fb(session))
+        self.assertAlmostEqual(.5 * .7, Document.get(3).fb(session)) #no keyword feedback
+
+    def test_unindexed_recommended_doc(self):
+        """
+        the recommended documents not in the matrix are left out of the weight sum
+        """
+        expected, actual = get_session(), get_session()
+        for session in (expected, actual):
+            session.add_doc_recom_list(Document.get_many([1, 2, 3, 5]))
+        actual.sadd("last_recom_doc_ids", -1)
+
+        for session in (expected, actual):
+            ppgt.propagate(self.fb, session)
+            VectorizedOverrideUpdater.update(session)
+
+        for kw, fb in expected.kw_feedbacks.items():
+            self.assertAlmostEqual(fb, kw.fb(actual))
+
+class MeanUpdaterTest(unittest.TestCase):
+    def setUp(self):
+        self.fb_list = [{"docs": [[1, .5]], "kws": [["redis", .5]]},
+                        {"docs": [[1, .9], [4, .3]]},
+                        {"docs": [[1, .1]], "dockws": [["python", 5, .2]]}]
+
+    def loop_values(self):
+        """
+        the feedback values of each loop, given by `OverrideUpdater`
+        """
+        session = get_session()
+        values = defaultdict(list)
+        for fb in self.fb_list:
+            session.add_doc_recom_list(Document.get_many([1, 2, 3, 5]))
+            ppgt.propagate(fb, session)
+            
+            objs = session.affected_kws + session.affected_docs
+            OverrideUpdater.update(session)
+            
+            for obj in objs:
+                values[obj].append(obj.fb(session))
+        return values
+        
+    def run_updater(self, updater, session):
+        for fb in self.fb_list:
+            session.add_doc_recom_list(Document.get_many([1, 2, 3, 5]))
+            ppgt.propagate(fb, session)
+            updater.update(session)
+        return session
+
+    def assertUpdate(self, summarize, updater, session):
+        self.run_updater(updater, session)
+        
+        values = self.loop_values()
+        for obj, obj_values in values.items():
+            self.assertAlmostEqual(summarize(obj_values), obj.fb(session))
+
+        self.assertEqual(len([obj for obj in values.keys() if isinstance(obj, Keyword)]), 
+                         len(session.kw_feedbacks))
+        self.assertEqual([], session.affected_kws)
+        self.assertEqual([], session.affected_docs)
+        
+    def test_mean(self):
+        mean = lambda values: sum(values) / len(values)
+        self.assertUpdate(mean, MeanUpdater, get_session())
+        self.assertUpdate(mean, MeanUpdater, get_vectorized_session())
+        
+    def test_ema(self):
+        def ema(values):
+            avg = values[0]
+            for value in values[1:]:
+                avg = .5 * value + .5 * avg
+            return avg
+        
+        self.assertUpdate(ema, EMAUpdater, get_session())
+        self.assertUpdate(ema, EMAUpdater, get_vectorized_session())
+        
+    def test_running_stats(self):
+        session = self.run_updater(MeanUpdater, get_session())
+        values = self.loop_values()[Document.get(1)] #document 1 received feedbacks in every loop
+        
+        stats = session.add_doc_fb_stats({1: .2})
+        self.assertEqual([1], stats.keys())
+        self.assertEqual(4, stats[1][0])
+        self.assertAlmostEqual(sum(values) + .2, stats[1][1])
+        self.assertEqual(None, stats[1][2]) #no EMA for the mean
+
+        #compactly encoded
+        self.assertEqual(4, session.hget("doc_fb_stats_count", 1))
+
+    def test_ema_stats(self):
+        session = self.run_updater(EMAUpdater, get_session())
+        
+        stats = session.add_doc_fb_stats({1: .2}, beta = .5)
+        self.assertAlmostEqual(.5 * .2 + .5 * Document.get(1).fb(session), stats[1][2])
+
+    def test_unindexed(self):
+        """
+        the objects not in the matrix are left out of the feedback vectors
+        """
+        Unindexed = namedtuple("Unindexed", "id")
+
+        rows, fbs = MeanUpdater._indexed(Keyword.kw_ind, 
+                                         [Keyword.get("redis"), Unindexed("no-such-keyword"), Keyword.get("python")], 
+                                         [.1, .2, .3])
+        self.assertEqual([Keyword.kw_ind["redis"], Keyword.kw_ind["python"]], list(rows))
+        self.assertEqual([.1, .3], fbs)
+
+        rows, fbs = EMAUpdater._indexed(Document.doc_ind, [Unindexed(-1)], [.2])
+        self.assertEqual(0, len(rows))
+        self.assertEqual([], fbs)
+
+        #nothing to update is fine
+        session = get_vectorized_session()
+        session.update_doc_fb_vec(rows, fbs)
+        self.assertEqual({}, session.doc_feedbacks)
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,14 @@
 import unittest
 import torndb
+import os, json, shutil, tempfile
 
-from scinet3.data import load_fmim
+from scinet3.data import (load_fmim, gen_kw_doc_matrix, get_test_data, 
+                          save_index_bundle, load_index_bundle, FeatureMatrixAndIndexMapping, 
+                          ArrayIndexMapping, ArrayReverseIndexMapping, ids_to_rows, rows_to_ids, has_ids, csr_row)
+
+def get_test_data_with_ids():
+    return [dict(doc, id = doc_id) 
+            for doc_id, doc in enumerate(get_test_data(), 1)]
 
 class FmimGenerationTest(unittest.TestCase):
     """
@@ -19,6 +26,27 @@ class FmimGenerationTest(unittest.TestCase):
         self.assertEqual(self.fmim.kw2doc_m.shape, (8, 10))
         self.assertEqual(self.fmim.doc2kw_m.shape, (10, 8))
         
+    def test_csr_and_csc(self):
+        self.assertEqual("csr", self.fmim.kw2doc_m.format)
+        self.assertEqual("csr", self.fmim.doc2kw_m.format)
+
+        self.assertEqual("csc", self.fmim.kw2doc_m_csc.format)
+        self.assertEqual("csc", self.fmim.doc2kw_m_csc.format)
+
+        self.assertEqual(self.fmim.kw2doc_m.toarray().tolist(), 
+                         self.fmim.kw2doc_m_csc.toarray().tolist())
+
+    def test_csr_row(self):
+        m = self.fmim.doc2kw_m
+        for row in xrange(m.shape[0]):
+            idx, values = csr_row(m, row)
+            self.assertEqual(sorted(m[row, :].nonzero()[1].tolist()), sorted(idx.tolist()))
+            self.assertEqual(m[row, idx].toarray().flatten().tolist(), values.tolist())
+
+            #views, not copies
+            self.assertTrue(idx.base is not None)
+            self.assertTrue(values.base is not None)
+        
     def test_index_mapping(self):
         kws = [u'a', u'database', u'mysql', u'python', u'redis', u'the', u'tornado', u'web']
         for ind, kw in enumerate(kws):
@@ -37,3 +65,151 @@ class FmimGenerationTest(unittest.TestCase):
 
     def tearDown(self):
         self.conn.close()
+
+class KwDocMatrixGenerationTest(unittest.TestCase):
+    """
+    Test the matrix building from documents
+    """
+    def setUp(self):
+        self.docs = [{"id": 3, "keywords": ["redis", "database", "redis"]},
+                     {"id": 1, "keywords": ["python", None, "database"]}]
+
+    def test_vocabulary_in_the_same_pass(self):
+        d = gen_kw_doc_matrix(iter(self.docs), tfidf = False)
+
+        self.assertEqual({"database": 0, "python": 1, "redis": 2}, d["kw_ind"])
+        self.assertEqual({3: 0, 1: 1}, d["doc_ind"])
+        
+        #duplicates are summed
+        self.assertEqual([[1, 1], [0, 1], [2, 0]], d["kw2doc_m"].toarray().tolist())
+        self.assertEqual([[1, 0, 2], [1, 1, 0]], d["doc2kw_m"].toarray().tolist())
+
+    def test_given_vocabulary(self):
+        d = gen_kw_doc_matrix(self.docs, ["redis", "python", "database", "mysql"], "keywords", tfidf = False)
+
+        self.assertEqual({"redis": 0, "python": 1, "database": 2, "mysql": 3}, d["kw_ind"])
+        self.assertEqual([[2, 0], [0, 1], [1, 1], [0, 0]], d["kw2doc_m"].toarray().tolist())
+
+class IndexBundleTest(unittest.TestCase):
+    """
+    Test the saving and memory-mapped loading of the index bundle
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.bundle_path = os.path.join(self.path, "test_index")
+        
+        self.fmim = FeatureMatrixAndIndexMapping(**gen_kw_doc_matrix(get_test_data_with_ids(), tfidf = True))
+        save_index_bundle(self.bundle_path, self.fmim)
+
+    def test_round_trip(self):
+        fmim = load_index_bundle(self.bundle_path)
+
+        for name in ("kw2doc_m", "doc2kw_m", "kw2doc_m_csc", "doc2kw_m_csc"):
+            self.assertEqual(getattr(self.fmim, name).format, getattr(fmim, name).format)
+            self.assertEqual(getattr(self.fmim, name).toarray().tolist(), getattr(fmim, name).toarray().tolist())
+            
+        self.assertEqual(self.fmim.kw_ind, fmim.kw_ind)
+        self.assertEqual(self.fmim.doc_ind, fmim.doc_ind)
+        self.assertEqual(self.fmim.kw_ind_r, fmim.kw_ind_r)
+        self.assertEqual(self.fmim.doc_ind_r, fmim.doc_ind_r)
+
+    def test_memory_mapped(self):
+        fmim = load_index_bundle(self.bundle_path)
+        
+        #read-only, backed by the bundle files
+        self.assertFalse(fmim.kw2doc_m.data.flags.writeable)
+        self.assertFalse(fmim.doc2kw_m_csc.indices.flags.writeable)
+
+        fmim = load_index_bundle(self.bundle_path, mmap_mode = None)
+        self.assertTrue(fmim.kw2doc_m.data.flags.writeable)
+
+    def test_version_mismatch(self):
+        with open(os.path.join(self.bundle_path, "meta.json"), "w") as f:
+            json.dump({"version": 0}, f)
+            
+        self.assertRaises(ValueError, load_index_bundle, self.bundle_path)
+
+    def test_overwrite(self):
+        fmim = FeatureMatrixAndIndexMapping(**gen_kw_doc_matrix(get_test_data_with_ids()[:2], tfidf = False))
+        save_index_bundle(self.bundle_path, fmim)
+
+        self.assertEqual((2, 4), load_index_bundle(self.bundle_path).doc2kw_m.shape)
+        self.assertEqual(["test_index"], os.listdir(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_array_backed_mapping(self):
+        fmim = load_index_bundle(self.bundle_path)
+
+        self.assertTrue(isinstance(fmim.kw_ind, ArrayIndexMapping))
+        self.assertTrue(isinstance(fmim.doc_ind_r, ArrayReverseIndexMapping))
+
+class ArrayIndexMappingTest(unittest.TestCase):
+    """
+    ArrayIndexMapping/ArrayReverseIndexMapping should behave like the dicts
+    """
+    def setUp(self):
+        self.doc_ids = [7, 3, 10, 1]
+        self.kws = [u"database", u"python", u"redis", u"\u00e9t\u00e9"]
+        
+        self.doc_ind = ArrayIndexMapping(self.doc_ids)
+        self.kw_ind = ArrayIndexMapping(self.kws)
+
+    def test_as_dict(self):
+        self.assertEqual({7: 0, 3: 1, 10: 2, 1: 3}, self.doc_ind)
+        self.assertEqual(dict((kw, ind) for ind, kw in enumerate(self.kws)), self.kw_ind)
+        self.assertEqual({0: 7, 1: 3, 2: 10, 3: 1}, self.doc_ind.reverse())
+        
+        self.assertEqual(2, self.doc_ind[10])
+        self.assertEqual(2, self.kw_ind["redis"]) #str or unicode
+        self.assertEqual(3, self.kw_ind[u"\u00e9t\u00e9"])
+        self.assertEqual(u"\u00e9t\u00e9", self.kw_ind.reverse()[3])
+        self.assertEqual(10, self.doc_ind.reverse()[2])
+        
+        self.assertEqual(4, len(self.kw_ind))
+        self.assertEqual(self.kws, self.kw_ind.keys())
+        self.assertEqual(self.doc_ids, list(self.doc_ind))
+        
+    def test_missing(self):
+        self.assertRaises(KeyError, self.doc_ind.__getitem__, 2)
+        self.assertRaises(KeyError, self.doc_ind.__getitem__, 100)
+        self.assertRaises(KeyError, self.kw_ind.__getitem__, "redi")
+        self.assertRaises(KeyError, self.kw_ind.__getitem__, "redis" * 10) #longer than any keyword
+        self.assertRaises(KeyError, self.doc_ind.reverse().__getitem__, 4)
+        self.assertRaises(KeyError, self.doc_ind.reverse().__getitem__, -1)
+
+        self.assertFalse(self.kw_ind.has_key("mysql"))
+        self.assertTrue("python" in self.kw_ind)
+        self.assertEqual(None, self.doc_ind.get(5))
+        self.assertFalse(-1 in self.doc_ind.reverse())
+        
+    def test_bulk_translation(self):
+        self.assertEqual([3, 0, 2], self.doc_ind.rows([1, 7, 10]).tolist())
+        self.assertEqual([1, 7, 10], self.doc_ind.reverse().ids([3, 0, 2]))
+        self.assertEqual([True, False, True], self.kw_ind.contains(["redis", "mysql", "python"]).tolist())
+        self.assertRaises(KeyError, self.kw_ind.rows, ["redis", "mysql"])
+        
+        self.assertEqual([], self.doc_ind.rows([]).tolist())
+
+    def test_string_ids(self):
+        """
+        the keywords are not padded, and those sharing the prefix are told apart
+        """
+        kws = [u"information retrieval", u"a", u"information", u"information theory", u"\u00e9t\u00e9"]
+        kw_ind = ArrayIndexMapping(kws)
+
+        self.assertEqual(sum(len(kw.encode("utf-8")) for kw in kws), len(kw_ind._ids.buffer))
+        self.assertEqual(range(5), kw_ind.rows(kws).tolist())
+        self.assertEqual(kws, kw_ind.reverse().ids(range(5)))
+        self.assertEqual([False, False, True], 
+                         kw_ind.contains([u"informatio", u"information science", "a"]).tolist())
+
+    def test_dict_fallback(self):
+        doc_ind = {7: 0, 3: 1, 10: 2, 1: 3}
+        doc_ind_r = dict((ind, doc_id) for doc_id, ind in doc_ind.items())
+        
+        for id2ind, ind2id in ((doc_ind, doc_ind_r), (self.doc_ind, self.doc_ind.reverse())):
+            self.assertEqual([3, 0], ids_to_rows(id2ind, [1, 7]).tolist())
+            self.assertEqual([1, 7], rows_to_ids(ind2id, [3, 0]))
+            self.assertEqual([True, False], has_ids(id2ind, [1, 2]).tolist())
@@ -8,7 +8,7 @@ from scinet3.filters import (FilterRepository,
                              kw_fb_threshold_filter,
                              doc_fb_threshold_filter)
 
-from util import (config_doc_kw_model, get_session)
+from util import (config_doc_kw_model, get_session, get_vectorized_session)
 config_doc_kw_model()
 Document.load_all_from_db()
 
@@ -33,6 +33,17 @@ class FiltersTest(unittest.TestCase):
 
         self.assertEqual(expected, actual)
         
+    def test_kw_fb_threshold_filter_on_vectorized_session(self):
+        session = get_vectorized_session()
+        session.update_kw_feedback(Keyword.get("python"), .2)
+        session.update_kw_feedback(Keyword.get("a"), .0999999)
+        
+        actual = kw_fb_threshold_filter(0.1, session, 
+                                        with_fb = True)
+        expected = Keyword.get_many(["python"])
+
+        self.assertEqual(expected, actual)
+        
     def test_kw_fb_threshold_filter(self):
         #change the feedback
         self.session.update_kw_feedback(Keyword.get("python"), .2)
@@ -55,6 +66,17 @@ class FiltersTest(unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_doc_fb_threshold_filter_on_vectorized_session(self):
+        session = get_vectorized_session()
+        session.update_doc_feedback(Document.get(1), .2)
+        session.update_doc_feedback(Document.get(2), .0999999)
+        
+        actual = doc_fb_threshold_filter(0.1, session, 
+                                         with_fb = True)
+        expected = Document.get_many([1])
+
+        self.assertEqual(expected, actual)
+
     def test_doc_fb_threshold_filter(self):
         #change the feedback
         self.session.update_doc_feedback(Document.get(1), .2)
@@ -1,11 +1,12 @@
 ###############################
 # Testing the LinRel recommender
 ###############################
-from util import (config_doc_kw_model, get_session, NumericTestCase)
+from util import (config_doc_kw_model, get_session, NumericTestCase, get_vectorized_session)
 
 from scinet3.model import (Document, Keyword)
 from scinet3.rec_engine.linrel import LinRelRecommender
 from scinet3.data import FeatureMatrixAndIndexMapping
+from scinet3.linrel import LinRelState
 
 _, fmim = config_doc_kw_model()
 
@@ -73,6 +74,23 @@ class LinRelUtilityTest(NumericTestCase):
         self.assertAlmostEqual(0.4217401124578374, explt_scores[6])
         self.assertAlmostEqual(0.09130062384139383, explr_scores[6])
 
+    def test_generic_top_n(self):
+        fb = {1: .7,
+              2: .7, 
+              8: .7}
+        total_scores, explt_scores, explr_scores = self.r.generic_rank(fmim.doc2kw_m, fb, 
+                                                                       fmim.doc_ind, fmim.doc_ind_r,
+                                                                       1., .5)
+        
+        ids, scores, explts, explrs = self.r.generic_top_n(fmim.doc2kw_m, fb, 
+                                                           fmim.doc_ind, fmim.doc_ind_r,
+                                                           1., .5, 4)
+        
+        self.assertEqual(total_scores.keys()[:4], ids)
+        self.assertArrayAlmostEqual(total_scores.values()[:4], scores)
+        self.assertArrayAlmostEqual([explt_scores[_id] for _id in ids], explts)
+        self.assertArrayAlmostEqual([explr_scores[_id] for _id in ids], explrs)
+
 class LinRelRecommenderWithoutFilterTest(NumericTestCase):
     """
     No filter is used
@@ -81,6 +99,7 @@ class LinRelRecommenderWithoutFilterTest(NumericTestCase):
         self.r = LinRelRecommender(2, 2, 
                                    1., .1, 1., .1,
                                    None, None,
+                                   linrel_fb_only = False,
                                    **fmim.__dict__)
         
         
@@ -122,6 +141,118 @@ class LinRelRecommenderWithoutFilterTest(NumericTestCase):
         self.assertEqual(Document.get_many([1,8]), docs)
         self.assertEqual(Keyword.get_many(["redis", "database", "a", "python"]), kws)
 
+class LinRelRecommenderFeedbackOnlyTest(NumericTestCase):
+    """
+    Only the objects with feedback are used as LinRel training rows(the default)
+    """
+    def setUp(self):
+        self.r = LinRelRecommender(2, 2, 
+                                   1., .1, 1., .1,
+                                   None, None,
+                                   **fmim.__dict__)
+        
+        self.session = get_session()
+
+        self.session.update_kw_feedback(Keyword.get("redis"), .7)
+        self.session.update_kw_feedback(Keyword.get("database"), .6)
+        
+        self.session.update_doc_feedback(Document.get(1), .7)
+        self.session.update_doc_feedback(Document.get(2), .7)
+        self.session.update_doc_feedback(Document.get(8), .7)
+
+    def test_recommend_keywords(self):
+        kws = self.r.recommend_keywords(fmim, 
+                                        self.session, 4, 1, .5)
+        self.assertEqual(list(Keyword.get_many(["redis", "database", "the", "mysql"])), 
+                         kws)
+
+    def test_recommend_documents(self):
+        docs = self.r.recommend_documents(fmim,
+                                          self.session, 4, 1, .5)
+        self.assertEqual(list(Document.get_many([1,2,8,6])), 
+                         docs)
+        #the same as ranking by the documents with feedback only
+        self.assertAlmostEqual(0.5130407362992312, docs[-1]["score"])
+
+    def test_recommend_documents_blocked(self):
+        r = LinRelRecommender(2, 2, 
+                              1., .1, 1., .1,
+                              None, None,
+                              linrel_block_size = 3,
+                              **fmim.__dict__)
+        docs = r.recommend_documents(fmim,
+                                     self.session, 4, 1, .5)
+        self.assertEqual(list(Document.get_many([1,2,8,6])), 
+                         docs)
+        
+    def test_recommend_on_vectorized_session(self):
+        session = get_vectorized_session()
+        for kw, fb in self.session.kw_feedbacks.items():
+            session.update_kw_feedback(kw, fb)
+        for doc, fb in self.session.doc_feedbacks.items():
+            session.update_doc_feedback(doc, fb)
+        
+        docs = self.r.recommend_documents(fmim,
+                                          session, 4, 1, .5)
+        self.assertEqual(list(Document.get_many([1,2,8,6])), 
+                         docs)
+        self.assertAlmostEqual(0.5130407362992312, docs[-1]["score"], places = 6) #float32 feedbacks
+
+        kws = self.r.recommend_keywords(fmim, 
+                                        session, 4, 1, .5)
+        self.assertEqual(list(Keyword.get_many(["redis", "database", "the", "mysql"])), 
+                         kws)
+        
+    def test_recommend_without_feedback(self):
+        """
+        all candidates are used if there is no feedback at all
+        """
+        docs, kws = self.r.recommend(get_session(), 
+                                     4, 4, 
+                                     1, .5,
+                                     1., .5)
+        self.assertEqual(4, len(docs))
+        
+    def test_recommend_using_default(self):
+        docs, kws = self.r.recommend(self.session)
+
+        self.assertEqual(Document.get_many([1,6]), docs)
+        self.assertEqual(Keyword.get_many(["redis", "database", "a", "python"]), kws)
+
+    def test_recommend_incremental(self):
+        r = LinRelRecommender(2, 2, 
+                              1., .1, 1., .1,
+                              None, None,
+                              linrel_incremental = True,
+                              **fmim.__dict__)
+        
+        #the first round builds the state and the second one reuses it
+        for i in xrange(2):
+            docs, kws = r.recommend(self.session, 
+                                    4, 4, 
+                                    1, .5,
+                                    1., .5)
+
+            self.assertEqual(Document.get_many([1,2,8,6]), docs)
+            self.assertEqual(Keyword.get_many(["redis", "database", "the", "mysql", "a", "python"]), kws)
+
+        #new feedback is added to the state
+        self.session.update_doc_feedback(Document.get(6), .7)
+        docs, kws = r.recommend(self.session, 
+                                4, 4, 
+                                1, .5,
+                                1., .5)
+        state = LinRelState.load(self.session, "docs")
+        self.assertEqual([1, 2, 8], sorted(state.ids[:3]))
+        self.assertEqual([6], state.ids[3:])
+        self.assertEqual("cholesky", state.solver) #the configured solver
+        
+    def test_incremental_needs_fb_only(self):
+        self.assertRaises(AssertionError, LinRelRecommender, 
+                          2, 2, 1., .1, 1., .1, None, None,
+                          linrel_incremental = True, linrel_fb_only = False, 
+                          **fmim.__dict__)
+        
 class LinRelRecommenderWithFilterTest(NumericTestCase):
     """
     Filters is used
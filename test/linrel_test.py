@@ -9,7 +9,7 @@ from scipy.sparse import csr_matrix
 from util import (config_doc_kw_model, get_session, NumericTestCase)
 
 from scinet3.model import (Document, Keyword)
-from scinet3.linrel import linrel
+from scinet3.linrel import (linrel, linrel_scores, linrel_top_n, projection, choose_form, feature_key, LinRelState)
 
 #config model, 
 #only done once
@@ -34,4 +34,123 @@ class LinRelTest(NumericTestCase):
         
         self.assertArrayAlmostEqual([0.35511143,0.26666667,0.53700971,0.35511143,0.6451382,0.26666667,0.51974334],
                          np.transpose(scores).tolist()[0])
+
+    def test_forms_and_solvers(self):
+        """
+        both forms and both solvers should give the same scores
+        """
+        D = csr_matrix(np.array([[1, 0, 0, 0, 1, 1],
+                                 [0, 1, 1, 0, 0, 0],
+                                 [1, 0, 0, 1, 0, 0],
+                                 [1, 0, 0, 0, 1, 1],
+                                 [1, 1, 0, 1, 0, 0],
+                                 [0, 1, 1, 0, 0, 0],
+                                 [1, 1, 1, 0, 0, 0],
+                             ]))
+        D_t = D[0:3,:]
+        y_t = csr_matrix([[.3], [.3], [.7]])
+
+        self.assertEqual("dual", choose_form(D_t))
+        self.assertEqual("primal", choose_form(D))
         
+        expected = [0.35511143,0.26666667,0.53700971,0.35511143,0.6451382,0.26666667,0.51974334]
+        for form in ("primal", "dual"):
+            for solver in ("inv", "cholesky"):
+                scores, _, _ = linrel(y_t, D_t, D, 1, .2, form = form, solver = solver)
+                self.assertArrayAlmostEqual(expected,
+                                            np.transpose(scores).tolist()[0])
+
+        self.assertRaises(ValueError, linrel, y_t, D_t, D, 1, .2, form = "blah")
+        self.assertRaises(ValueError, linrel, y_t, D_t, D, 1, .2, solver = "blah")
+        
+
+    def test_blocked_top_n(self):
+        """
+        blocked evaluation should give the same top rows as the full one
+        """
+        D = csr_matrix(np.array([[1, 0, 0, 0, 1, 1],
+                                 [0, 1, 1, 0, 0, 0],
+                                 [1, 0, 0, 1, 0, 0],
+                                 [1, 0, 0, 0, 1, 1],
+                                 [1, 1, 0, 1, 0, 0],
+                                 [0, 1, 1, 0, 0, 0],
+                                 [1, 1, 1, 0, 0, 0],
+                             ]))
+        D_t = D[0:3,:]
+        y_t = csr_matrix([[.3], [.3], [.7]])
+        W = projection(D_t, 1, solver = "cholesky")
+
+        scores, explt_scores, explr_scores = linrel_scores(y_t, D, W, .2)
+        for block_size in (None, 1, 2, 3, 100):
+            idx, top_scores, top_explt, top_explr = linrel_top_n(y_t, D, W, .2, 4, block_size = block_size)
+
+            #row 0 and 3 are identical, the smaller index comes first
+            self.assertEqual([4, 2, 6, 0], idx.tolist())
+            self.assertArrayAlmostEqual(np.asarray(scores).ravel()[idx], top_scores)
+            self.assertArrayAlmostEqual(np.asarray(explt_scores).ravel()[idx], top_explt)
+            self.assertArrayAlmostEqual(np.asarray(explr_scores).ravel()[idx], top_explr)
+
+class LinRelStateTest(NumericTestCase):
+    def setUp(self):
+        self.D = csr_matrix(np.array([[1, 0, 0, 0, 1, 1],
+                                      [0, 1, 1, 0, 0, 0], 
+                                      [1, 0, 0, 1, 0, 0],
+                                      [1, 0, 0, 0, 1, 1],
+                                      [1, 1, 0, 1, 0, 0],
+                                      [0, 1, 1, 0, 0, 0],
+                                      [1, 1, 1, 0, 0, 0],
+                                  ]))
+        self.fb = {0: .3, 1: .3, 2: .7, 4: .5}
+        self.state = LinRelState()
+
+    def get_rows(self, ids):
+        return self.D[list(ids), :]
+
+    def assertSameAsLinRel(self, ids, solver = "inv"):
+        state_ids = self.state.update(ids, self.get_rows, "features", 1., solver)
+        
+        y_t = csr_matrix([[self.fb[_id]] for _id in state_ids])
+        scores, _, _ = linrel_scores(y_t, self.D, self.state.projection(self.get_rows(state_ids)), .2)
+        
+        expected, _, _ = linrel(csr_matrix([[self.fb[_id]] for _id in ids]), self.get_rows(ids), self.D, 1., .2)
+        self.assertArrayAlmostEqual(np.transpose(expected).tolist()[0],
+                                    np.transpose(scores).tolist()[0])
+        return state_ids
+        
+    def test_incremental_update(self):
+        self.assertEqual([0, 1], self.assertSameAsLinRel([0, 1]))
+        self.assertEqual([0, 1, 4, 2], self.assertSameAsLinRel([4, 2, 1, 0]))
+
+    def test_incremental_update_cholesky(self):
+        self.assertEqual([0, 1], self.assertSameAsLinRel([0, 1], "cholesky"))
+        self.assertEqual([0, 1, 4, 2], self.assertSameAsLinRel([4, 2, 1, 0], "cholesky"))
+
+        #the factor is kept, not the inverse
+        L = self.state.factor
+        self.assertArrayAlmostEqual(np.tril(L).ravel(), L.ravel())
+        D_t = self.get_rows(self.state.ids).toarray()
+        self.assertArrayAlmostEqual((np.dot(D_t, D_t.T) + np.eye(4)).ravel(), np.dot(L, L.T).ravel())
+        
+    def test_solver_change(self):
+        self.assertSameAsLinRel([0, 1], "cholesky")
+        self.assertEqual([2, 1, 0], self.assertSameAsLinRel([2, 1, 0])) #rebuilt, not [0, 1, 2]
+        self.assertEqual("inv", self.state.solver)
+
+    def test_rebuild(self):
+        self.assertSameAsLinRel([0, 1, 2])
+        
+        #row 0 is gone
+        self.assertEqual([1, 2], self.assertSameAsLinRel([1, 2]))
+
+        #feature set is changed
+        self.state.update([1, 2, 4], self.get_rows, "other features", 1.)
+        self.assertEqual([1, 2, 4], self.state.ids)
+
+    def test_feature_key(self):
+        self.assertEqual(feature_key(self.D), feature_key(self.D.copy()))
+        self.assertNotEqual(feature_key(self.D), feature_key(self.D[:, :5]))
+
+        #the selected columns
+        self.assertEqual(feature_key(self.D, [0, 2]), feature_key(self.D, np.array([0, 2])))
+        self.assertNotEqual(feature_key(self.D, [0, 2]), feature_key(self.D, [2, 0]))
+        self.assertNotEqual(feature_key(self.D), feature_key(self.D, [0, 2]))
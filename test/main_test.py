@@ -0,0 +1,81 @@
+##############################
+# Testing the web app startup and the recommend API
+##############################
+import unittest, json
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.options import options
+
+import scinet3.main as main
+from scinet3.model import Document
+
+def config_options():
+    options.mysql_host = "ugluk"
+    options.mysql_port = 3306
+    options.mysql_database = "scinet3"
+    options.mysql_user = "hxiao"
+    options.mysql_password = "xh24206688"
+    options.table = "test"
+
+    options.redis_host = "ugluk"
+    options.redis_db = "test"
+
+    options.recom_kw_num = 3
+    options.samp_kw_num = 2
+    options.recom_doc_num = 3
+    options.samp_doc_num = 1
+
+    options.kw_fb_threshold = 0.
+    options.doc_fb_threshold = 0.
+
+    #more than one process, so no autoreloading, but nothing is forked in the tests
+    options.processes = 2
+
+class MainAppTest(AsyncHTTPTestCase):
+    def get_app(self):
+        config_options()
+
+        #the same as the startup before forking
+        self.fmim = main.load_corpus()
+        return main.Application(self.fmim)
+
+    def recommend(self, **data):
+        response = self.fetch("/api/1.0/recommend", method = "POST", body = json.dumps(data))
+        self.assertEqual(200, response.code)
+        return json.loads(response.body)
+
+    def test_load_corpus(self):
+        self.assertTrue(Document.all_docs_loaded)
+        self.assertEqual(10, len(Document.all_docs))
+        self.assertEqual((10, 8), self.fmim.doc2kw_m.shape)
+
+    def test_session(self):
+        result = self.recommend(query = "redis")
+        self.assertEqual(0, result["errcode"])
+        self.assertTrue(result["session_id"])
+        self.assertTrue(len(result["docs"]) > 0)
+        self.assertTrue("title" in result["docs"][0])
+        self.assertTrue(any([kw["display"] for kw in result["kws"]]))
+
+        #feedback on the recommendation
+        session_id = result["session_id"]
+        result = self.recommend(session_id = session_id,
+                                kw_fb = [{"id": "redis", "score": .7}],
+                                doc_fb = [{"id": result["docs"][0]["id"], "score": .5}])
+        self.assertEqual(0, result["errcode"])
+        self.assertEqual(session_id, result["session_id"])
+        self.assertTrue(len(result["docs"]) > 0)
+
+    def test_import_with_cmdapp(self):
+        """
+        the shared options are defined once, so both entry points can be imported together
+        """
+        import scinet3.cmdapp
+        self.assertEqual("cholesky", options.linrel_solver)
+
+    def test_no_feedback_in_session(self):
+        result = self.recommend(session_id = "some-session")
+        self.assertEqual(main.ERR_INVALID_POST_DATA, result["errcode"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ import unittest
 from types import DictType
 
 from scinet3.model import Document, Keyword
+from copy import copy
 
 from util import config_doc_kw_model, get_session
 
@@ -41,18 +42,70 @@ class ModelTest(unittest.TestCase):
         kw = Keyword.get("redis")
         self.assertEqual(kw.id, "redis")
         self.assertEqual(set(kw.docs), set(Document.get_many(doc_ids)))
+        self.assertEqual(set(doc_ids), set(kw.doc_ids))
+        self.assertEqual(set([Document.doc_ind[doc_id] for doc_id in doc_ids]), set(kw.doc_rows.tolist()))
         
         #that is as far as we can test
         #no numerical testing
         self.assertTrue(type(kw._doc_weight) is DictType)
 
 
+    def test_keyword_docs_without_store(self):
+        """
+        the documents of keyword are read from the feature matrix, loaded or not
+        """
+        store, Document.store = Document.store, None
+        try:
+            self.assertEqual(set(Document.get_many([1, 2, 6])), set(Keyword.get("redis").docs))
+        finally:
+            Document.store = store
+
     def test_get_nonexist(self):
         """
         Get non-exist object
         """
         self.assertRaises(ValueError, Document.get, -1)
         
+    def test_document_store(self):
+        """
+        documents are made from the columnar store on demand
+        """
+        self.assertTrue(Document.store.has(1))
+        self.assertFalse(Document.store.has(-1))
+        
+        self.assertEqual(10, len(Document.all_docs))
+        self.assertEqual(range(1, 11), sorted(Document.all_docs.ids))
+        self.assertEqual(sorted(Document.all_docs.ids), sorted([doc.id for doc in Document.all_docs]))
+        
+        doc = Document.all_docs[0]
+        self.assertEqual(doc, Document.get(doc.id))
+        self.assertEqual(doc.title, Document.get(doc.id).title)
+        self.assertEqual(Document.get(doc.id).dict, doc.dict)
+
+    def test_views(self):
+        """
+        the documents made from the store are kept as long as the store
+        """
+        doc = Document.get(1)
+        self.assertTrue(doc is Document.get(1))
+        self.assertTrue(doc is Document.get_many([1, 2])[0])
+        self.assertTrue(doc._kw_weight is Document.get(1)._kw_weight)
+
+        #all of them, the state set on them stays
+        docs = list(Document.all_docs)
+        docs[0].score = .5
+        self.assertEqual(len(docs), len(Document.views))
+        self.assertTrue(all(doc is view for doc, view in zip(docs, Document.all_docs)))
+        self.assertEqual(.5, Document.all_docs[0].score)
+        
+        #made again for a new store
+        store = Document.store
+        Document.store = copy(store)
+        try:
+            self.assertFalse(docs[0] is Document.all_docs[0])
+        finally:
+            Document.store = store
+        
     def test_get_many(self):
         doc_ids = [1,2]
         kw_ids = ["a", "the"]
@@ -87,3 +140,125 @@ class ModelTest(unittest.TestCase):
         self.assertAlmostEqual(0.2613424459663648, kw1.similarity_to(kw3))
         
         self.assertRaises(NotImplementedError, kw1.similarity_to, kw3, "not implemented metric")
+
+class QueryCountingConnection(object):
+    """
+    database connection wrapper that counts the queries
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.query_n = 0
+
+    def __getattr__(self, name):
+        self.query_n += 1
+        return getattr(self.conn, name)
+        
+class GetManyTest(unittest.TestCase):
+    """
+    documents not loaded are fetched in batch
+    """
+    def setUp(self):
+        #nothing is loaded
+        self.store, Document.store = Document.store, None
+        self.loaded = Document._Document__all_docs_by_id.copy()
+        Document._Document__all_docs_by_id.clear()
+        
+        self.conn = Document.db_conn
+        Document.db_conn = QueryCountingConnection(self.conn)
+
+    def tearDown(self):
+        Document.store = self.store
+        Document._Document__all_docs_by_id.clear()
+        Document._Document__all_docs_by_id.update(self.loaded)
+        Document.db_conn = self.conn
+        Document.get_many_chunk_size = 500
+        
+    def test_one_query(self):
+        info = Document.cache_info()
+        docs = Document.get_many([3, 1, 2, 1])
+
+        self.assertEqual([3, 1, 2, 1], [doc.id for doc in docs])
+        self.assertEqual("redis: key-value-storage database (ONE)", docs[1].title)
+        self.assertEqual(1, Document.db_conn.query_n)
+        self.assertEqual(info["misses"] + 3, Document.cache_info()["misses"])
+        
+        #loaded now
+        self.assertEqual(Document.get_many([1, 2]), Document.get_many([1, 2]))
+        self.assertEqual(1, Document.db_conn.query_n)
+        self.assertEqual(info["hits"] + 4, Document.cache_info()["hits"])
+        
+    def test_chunks(self):
+        Document.get_many_chunk_size = 2
+        
+        self.assertEqual(range(1, 6), [doc.id for doc in Document.get_many(range(1, 6))])
+        self.assertEqual(3, Document.db_conn.query_n)
+
+    def test_missing(self):
+        try:
+            Document.get_many([1, -1, 2, -2])
+        except ValueError as e:
+            self.assertTrue("-1" in str(e) and "-2" in str(e))
+        else:
+            self.fail("ValueError should be raised")
+        self.assertEqual(1, Document.db_conn.query_n)
+
+class LazyFieldsTest(unittest.TestCase):
+    """
+    only ids and keywords are loaded, the display fields are fetched when serialized
+    """
+    def setUp(self):
+        Document.set_lazy_fields(True, cache_size = 3)
+        Document.load_all_from_db()
+        
+        self.conn = Document.db_conn
+        Document.db_conn = QueryCountingConnection(self.conn)
+
+    def tearDown(self):
+        Document.db_conn = self.conn
+        Document.set_lazy_fields(False)
+        Document.load_all_from_db()
+        
+    def test_startup(self):
+        self.assertEqual(set(["id"]), set(Document.store.fields))
+        self.assertTrue("title" in Document.display_field_names)
+        self.assertFalse("keywords" in Document.display_field_names)
+        
+        doc = Document.get(1)
+        self.assertEqual(set(Keyword.get_many(["redis", "database", "a"])), set(doc.keywords))
+        self.assertEqual(0, Document.db_conn.query_n)
+        
+    def test_attribute(self):
+        doc = Document.get(1)
+        self.assertEqual("redis: key-value-storage database (ONE)", doc.title)
+        self.assertEqual(1, Document.db_conn.query_n)
+
+        #cached
+        self.assertEqual("redis: key-value-storage database (ONE)", Document.get(1).title)
+        self.assertEqual(1, Document.db_conn.query_n)
+        
+        #not a display field, nothing is fetched
+        doc = Document.get(2)
+        self.assertRaises(AttributeError, getattr, doc, "nonexist_field")
+        self.assertFalse(hasattr(doc, "nonexist_field"))
+        self.assertEqual(1, Document.db_conn.query_n)
+        
+    def test_dicts(self):
+        docs = Document.get_many([1, 2, 3])
+        docs[0]["score"] = 1.
+        
+        dicts = Document.dicts(docs)
+        self.assertEqual(1, Document.db_conn.query_n)
+        self.assertEqual([1, 2, 3], [d["id"] for d in dicts])
+        self.assertEqual("redis: key-value-storage database (ONE)", dicts[0]["title"])
+        self.assertEqual(1., dicts[0]["score"])
+        self.assertFalse(dicts[0].has_key("_lazy_fields"))
+
+        self.assertEqual(dicts[1], docs[1].dict)
+        self.assertEqual(1, Document.db_conn.query_n)
+
+    def test_cache_bounded(self):
+        Document.dicts(Document.get_many([1, 2, 3, 4]))
+        
+        self.assertEqual(3, len(Document.display_fields_cache))
+        self.assertEqual(1, Document.display_fields_cache.evictions)
+        self.assertFalse(1 in Document.display_fields_cache)
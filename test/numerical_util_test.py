@@ -7,7 +7,8 @@ from scipy import (linalg, mat, dot)
 from scipy.sparse import csr_matrix
 
 from util import NumericTestCase
-from scinet3.util.numerical import (cosine_similarity, matrix2array)
+from scinet3.util.numerical import (cosine_similarity, cosine_similarity_matrix, row_norms, 
+                                    matrix2array, top_k, select_submatrix)
 
 
 class ConsineSimilarityTest(unittest.TestCase):
@@ -46,6 +47,41 @@ class ConsineSimilarityTest(unittest.TestCase):
         self.assertAlmostEqual(self.expected,
                                cosine_similarity(v1, v2))
 
+    def test_zero_vector(self):
+        self.assertEqual(0, cosine_similarity(csr_matrix([self.row1]), csr_matrix([[0] * 8])))
+
+class CosineSimilarityMatrixTest(NumericTestCase):
+    def setUp(self):
+        self.A = np.array([[2, 1, 0, 2, 0, 1, 1, 1],
+                           [0, 0, 0, 0, 0, 0, 0, 0]])
+        self.B = np.array([[2, 1, 1, 1, 1, 0, 1, 1],
+                           [2, 1, 0, 2, 0, 1, 1, 1],
+                           [0, 0, 3, 0, 0, 0, 0, 0]])
+
+        self.expected = np.array([[.8215838362577491, 1, 0],
+                                  [0, 0, 0]])
+
+    def test_row_norms(self):
+        expected = np.sqrt((self.B ** 2).sum(1))
+        self.assertArrayAlmostEqual(expected, row_norms(self.B))
+        self.assertArrayAlmostEqual(expected, row_norms(csr_matrix(self.B)))
+
+    def test_dense_and_sparse(self):
+        for A, B in [(self.A, self.B), 
+                     (csr_matrix(self.A), csr_matrix(self.B)), 
+                     (self.A, csr_matrix(self.B))]:
+            self.assertArrayAlmostEqual(self.expected.ravel(), cosine_similarity_matrix(A, B).ravel())
+
+    def test_one_vs_many(self):
+        sims = cosine_similarity_matrix(csr_matrix(self.A[0]), csr_matrix(self.B))
+        self.assertEqual((1, 3), sims.shape)
+        self.assertArrayAlmostEqual(self.expected[0], sims[0])
+
+    def test_precomputed_norms(self):
+        sims = cosine_similarity_matrix(csr_matrix(self.A), csr_matrix(self.B), 
+                                        A_norms = row_norms(self.A), B_norms = row_norms(self.B))
+        self.assertArrayAlmostEqual(self.expected.ravel(), sims.ravel())
+
 class Matrix2arrayTest(NumericTestCase):
     def setUp(self):
         self.array = np.array([1,2,3])
@@ -59,3 +95,47 @@ class Matrix2arrayTest(NumericTestCase):
         a = matrix2array(csr_matrix(self.array))
 
         self.assertArrayAlmostEqual(self.array, a)
+
+class TopKTest(unittest.TestCase):
+    def setUp(self):
+        self.scores = np.array([.1, .5, .3, .5, .2, .5, .0])
+
+    def test_basic(self):
+        self.assertEqual([1, 3, 5, 2], top_k(self.scores, 4).tolist())
+        
+    def test_ties_on_the_boundary(self):
+        """the smaller index wins, as in stable sorting"""
+        self.assertEqual([1, 3], top_k(self.scores, 2).tolist())
+
+    def test_same_as_sorting(self):
+        expected = [ind for ind, _ in sorted(enumerate(self.scores), key = lambda (_, score): score, reverse = True)]
+        self.assertEqual(expected, top_k(self.scores, 100).tolist())
+        self.assertEqual(expected, top_k(mat(self.scores).T, len(self.scores)).tolist())
+
+    def test_empty(self):
+        self.assertEqual([], top_k(self.scores, 0).tolist())
+
+class SelectSubmatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.M = np.array([[1, 0, 2, 0],
+                           [0, 3, 0, 4],
+                           [5, 0, 0, 6],
+                           [0, 0, 7, 0]])
+        
+    def assertSelected(self, rows, cols):
+        expected = self.M[rows, :][:, cols]
+        for csc in (None, csr_matrix(self.M).tocsc()):
+            submatrix = select_submatrix(csr_matrix(self.M), rows, cols, csc = csc)
+            self.assertEqual("csr", submatrix.format)
+            self.assertEqual(expected.tolist(), submatrix.toarray().tolist())
+
+    def test_basic(self):
+        self.assertSelected([2, 0], [3, 0, 2])
+
+    def test_one_row_or_column(self):
+        self.assertSelected([1], [0, 1, 2, 3])
+        self.assertSelected([0, 1, 2, 3], [2])
+
+    def test_repeated_indices(self):
+        self.assertSelected([2, 0, 2], [3, 0, 3, 2])
+        self.assertSelected([1, 1], [1, 1])
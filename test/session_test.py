@@ -5,9 +5,11 @@
 import unittest
 
 import redis
+import numpy as np
 from scinet3.model import Document, Keyword
+from scinet3.session import (_compact_encode, _compact_decode)
 
-from util import (config_doc_kw_model, get_session)
+from util import (config_doc_kw_model, get_session, get_vectorized_session)
 
 config_doc_kw_model()
 
@@ -64,6 +66,71 @@ class RedisWrapperTest(unittest.TestCase):
         
 
 
+class NativeStructureTest(unittest.TestCase):
+    """
+    Test on the native redis structures behind the wrapper methods
+    """
+    def setUp(self):
+        self.session = get_session()
+
+    def test_compact_encoding(self):
+        for value in [1, 10 ** 20, .1, 1e-300, "abc", "a:b", u"\u00e4", "", (1, "a"), None]:
+            encoded = _compact_encode(value)
+            self.assertEqual(value, _compact_decode(encoded))
+            self.assertEqual(type(value), type(_compact_decode(encoded)))
+
+        self.assertEqual("i:1", _compact_encode(1))
+        self.assertEqual("f:0.5", _compact_encode(.5))
+        self.assertEqual("s:redis", _compact_encode("redis"))
+
+    def test_native_types(self):
+        self.session.hmset("a_hash", {"k": 1.})
+        self.session.sadd("a_set", 1, 2)
+        self.session.kw_score_hist = {"redis": .5}
+        
+        self.assertEqual("hash", self.session.redis.type(self.session._full_key("a_hash")))
+        self.assertEqual("set", self.session.redis.type(self.session._full_key("a_set")))
+        self.assertEqual("list", self.session.redis.type(self.session._full_key("kw_score_hist", "s:redis")))
+
+    def test_dict_list(self):
+        self.assertEqual({}, self.session.kw_score_hist)
+        self.assertEqual({}, self.session.hgetall("kw_fb_stats_count"))
+
+        self.session.kw_score_hist = {"redis": .5, "python": .2}
+        self.session.kw_score_hist = {"redis": .7}
+        
+        self.assertEqual({"redis": [.5, .7], "python": [.2]}, self.session.kw_score_hist)
+
+    def test_migration(self):
+        """
+        pickled values written by older versions are migrated when touched
+        """
+        self.session.set("old_hash", {"hmkey1": 1.2, 1: "value"})
+        self.session.hmset("old_hash", {"hmkey2": 1})
+        self.assertEqual({"hmkey1": 1.2, 1: "value", "hmkey2": 1}, self.session.hgetall("old_hash"))
+
+        self.session.set("old_set", {1, "asdf"})
+        self.session.sadd("old_set", 2)
+        self.assertEqual({1, 2, "asdf"}, self.session.sget("old_set"))
+
+        self.session.set("old_set2", {1, "asdf"})
+        self.assertEqual({1, "asdf"}, self.session.sget("old_set2"))
+
+        self.session.set("kw_explt_score_hist", {"redis": [.1, .2]})
+        self.session.kw_explt_score_hist = {"redis": .3, "python": .4}
+        self.assertEqual({"redis": [.1, .2, .3], "python": [.4]}, self.session.kw_explt_score_hist)
+
+    def test_migration_in_snapshot(self):
+        self.session.set("affected_kws", {"redis"})
+        self.session.set("kw_redis_fb_from_docs", {1: .5})
+        
+        with self.session.snapshot() as snapshot:
+            snapshot.add_affected_kws(Keyword.get("python"))
+            Keyword.get("redis").rec_fb_from_doc(Document.get(2), .3, snapshot)
+            
+        self.assertEqual({"redis", "python"}, self.session.sget("affected_kws"))
+        self.assertEqual({1: .5, 2: .3}, self.session.hgetall("kw_redis_fb_from_docs"))
+
 class RedisSessionTest(unittest.TestCase):
     """
     Test on the session-related methods
@@ -121,6 +188,233 @@ class RedisSessionTest(unittest.TestCase):
         
         self.assertEqual(doc.fb(self.session), 1)
 
+class SessionSnapshotTest(unittest.TestCase):
+    """
+    Test on the per-request session snapshot
+    """
+    def setUp(self):
+        self.session = get_session()
+        
+        self.kw = Keyword.get('redis')
+        self.doc = Document.get(1)
+        
+        self.session.update_kw_feedback(self.kw, .5)
+        self.session.update_doc_feedback(self.doc, .5)
+
+    def test_read_from_memory(self):
+        snapshot = self.session.snapshot()
+        self.assertEqual(None, snapshot.get("some_key"))
+
+        #changed behind the snapshot
+        self.session.update_kw_feedback(self.kw, 1)
+        self.session.set("some_key", 1)
+        
+        #feedbacks are read when the snapshot is taken
+        self.assertEqual({self.kw: .5}, snapshot.kw_feedbacks)
+        self.assertEqual({self.doc: .5}, snapshot.doc_feedbacks)
+        self.assertEqual(.5, self.kw.fb(snapshot))
+
+        #other keys when first read
+        self.assertEqual(None, snapshot.get("some_key"))
+
+    def test_unsupported_command(self):
+        """
+        commands not served by the snapshot are refused, rather than sent to redis
+        """
+        snapshot = self.session.snapshot()
+        snapshot.set("some_key", 1)
+        
+        self.assertRaises(AttributeError, getattr, snapshot.redis, "hdel")
+        self.assertRaises(AttributeError, getattr, snapshot.redis.pipeline(), "hdel")
+
+        #nothing written
+        self.assertEqual(None, self.session.get("some_key"))
+
+    def test_write_on_flush(self):
+        snapshot = self.session.snapshot()
+        
+        snapshot.update_kw_feedback(self.kw, 1)
+        snapshot.update_doc_feedback(Document.get(2), .8)
+        snapshot.set("some_key", 1)
+        snapshot.add_affected_kws(self.kw)
+
+        #visible to the snapshot only
+        self.assertEqual({self.kw: 1}, snapshot.kw_feedbacks)
+        self.assertEqual(.8, Document.get(2).fb(snapshot))
+        self.assertEqual(1, snapshot.get("some_key"))
+        self.assertEqual([self.kw], snapshot.affected_kws)
+
+        self.assertEqual({self.kw: .5}, self.session.kw_feedbacks)
+        self.assertEqual(None, self.session.get("some_key"))
+        self.assertEqual([], self.session.affected_kws)
+
+        snapshot.flush()
+
+        self.assertEqual({self.kw: 1}, self.session.kw_feedbacks)
+        self.assertEqual({self.doc: .5, Document.get(2): .8}, self.session.doc_feedbacks)
+        self.assertEqual(1, self.session.get("some_key"))
+        self.assertEqual([self.kw], self.session.affected_kws)
+
+    def test_delete(self):
+        self.session.set("some_key", 1)
+        
+        snapshot = self.session.snapshot()
+        self.assertEqual(1, snapshot.get("some_key"))
+
+        snapshot.delete("some_key")
+        self.assertEqual(None, snapshot.get("some_key"))
+        self.assertEqual(1, self.session.get("some_key"))
+
+        snapshot.flush()
+        self.assertEqual(None, self.session.get("some_key"))
+
+    def test_context_manager(self):
+        with self.session.snapshot() as snapshot:
+            snapshot.update_kw_feedback(self.kw, 1)
+
+        self.assertEqual({self.kw: 1}, self.session.kw_feedbacks)
+
+        #changes are discarded on exception
+        try:
+            with self.session.snapshot() as snapshot:
+                snapshot.update_kw_feedback(self.kw, .1)
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual({self.kw: 1}, self.session.kw_feedbacks)
+
+    def test_batch_discarded_on_exception(self):
+        """
+        the pipelined/batched writes are buffered in the snapshot as well
+        """
+        try:
+            with self.session.snapshot() as snapshot:
+                batch = snapshot.write_batch()
+                batch.update_kw_fb_vec([Keyword.kw_ind["redis"]], [.1])
+                batch.add_affected_docs(self.doc)
+                batch.flush()
+
+                snapshot.kw_score_hist = {"redis": .3}
+                snapshot.add_kw_fb_stats({"redis": .3})
+
+                #visible to the snapshot only
+                self.assertEqual({self.kw: .1}, snapshot.kw_feedbacks)
+                self.assertEqual([self.doc], snapshot.affected_docs)
+                self.assertEqual({"redis": [.3]}, snapshot.kw_score_hist)
+                self.assertEqual({self.kw: .5}, self.session.kw_feedbacks)
+                
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual({self.kw: .5}, self.session.kw_feedbacks)
+        self.assertEqual([], self.session.affected_docs)
+        self.assertEqual({}, self.session.kw_score_hist)
+
+        with self.session.snapshot() as snapshot:
+            batch = snapshot.write_batch()
+            batch.add_affected_docs(self.doc)
+            batch.flush()
+            snapshot.kw_score_hist = {"redis": .3}
+
+        self.assertEqual([self.doc], self.session.affected_docs)
+        self.assertEqual({"redis": [.3]}, self.session.kw_score_hist)
+
+class FeedbackVectorTest(unittest.TestCase):
+    """
+    Test on the feedbacks as vectors, for both session representations
+    """
+    def setUp(self):
+        self.sessions = [get_session(), get_vectorized_session()]
+
+    def test_fb_vec(self):
+        for session in self.sessions:
+            session.update_kw_feedback(Keyword.get("redis"), .5)
+            session.update_kw_feedback(Keyword.get("a"), .25)
+            session.update_doc_feedback(Document.get(2), 1)
+            
+            idx, values = session.kw_fb_vec
+            self.assertEqual([Keyword.kw_ind["a"], Keyword.kw_ind["redis"]], idx.tolist())
+            self.assertEqual([.25, .5], values.tolist())
+
+            idx, values = session.doc_fb_vec
+            self.assertEqual([Document.doc_ind[2]], idx.tolist())
+            self.assertEqual([1.], values.tolist())
+
+    def test_update_fb_vec(self):
+        for session in self.sessions:
+            session.update_kw_feedback(Keyword.get("redis"), .5)
+            session.update_kw_fb_vec([Keyword.kw_ind["python"], Keyword.kw_ind["redis"]], [.75, .25])
+
+            self.assertEqual({Keyword.get("python"): .75, Keyword.get("redis"): .25}, session.kw_feedbacks)
+
+            session.update_doc_fb_vec([Document.doc_ind[1]], [.5])
+            self.assertEqual(.5, Document.get(1).fb(session))
+
+    def test_vectorized_storage(self):
+        session = self.sessions[1]
+        session.update_kw_feedback(Keyword.get("redis"), .1)
+        session.update_kw_feedback(Keyword.get("redis"), .2)
+
+        self.assertEqual("string", session.redis.type(session._full_key("kw_fb_vec")))
+
+        idx, values = session.kw_fb_vec
+        self.assertEqual(np.int32, idx.dtype)
+        self.assertEqual(np.float32, values.dtype)
+        self.assertEqual([Keyword.kw_ind["redis"]], idx.tolist())
+        self.assertAlmostEqual(.2, values[0])
+
+        self.assertEqual({}, session.doc_feedbacks)
+
+    def test_vectorized_snapshot(self):
+        session = self.sessions[1]
+        session.update_kw_feedback(Keyword.get("redis"), .5)
+
+        with session.snapshot() as snapshot:
+            self.assertEqual(.5, Keyword.get("redis").fb(snapshot))
+
+            snapshot.update_kw_feedback(Keyword.get("python"), .25)
+            self.assertEqual({Keyword.get("redis"): .5, Keyword.get("python"): .25}, snapshot.kw_feedbacks)
+            self.assertEqual({Keyword.get("redis"): .5}, session.kw_feedbacks)
+
+        self.assertEqual({Keyword.get("redis"): .5, Keyword.get("python"): .25}, session.kw_feedbacks)
+
+    def test_vectorized_snapshot_patches(self):
+        """
+        the snapshot patches the vector on flush, so the updates made meanwhile are kept
+        """
+        session = self.sessions[1]
+
+        with session.snapshot() as snapshot:
+            snapshot.update_kw_feedback(Keyword.get("python"), .25)
+            snapshot.update_kw_feedback(Keyword.get("redis"), .75)
+            
+            #changed behind the snapshot
+            session.update_kw_feedback(Keyword.get("a"), .5)
+            session.update_kw_feedback(Keyword.get("redis"), .5)
+
+        self.assertEqual({Keyword.get("a"): .5, Keyword.get("redis"): .75, Keyword.get("python"): .25}, 
+                         session.kw_feedbacks)
+        
+    def test_unknown_ids_skipped(self):
+        """
+        feedbacks on ids not in the matrix index are left out of the vectors
+        """
+        session = self.sessions[0]
+        session.update_kw_feedback(Keyword.get("redis"), .5)
+        session.update_doc_feedback(Document.get(2), 1)
+        session.redis.hmset(session._full_key("kw_feedbacks"), {"no-such-keyword": .1})
+        session.redis.hmset(session._full_key("doc_feedbacks"), {12345: .1})
+
+        idx, values = session.kw_fb_vec
+        self.assertEqual([Keyword.kw_ind["redis"]], idx.tolist())
+        self.assertEqual([.5], values.tolist())
+
+        idx, values = session.doc_fb_vec
+        self.assertEqual([Document.doc_ind[2]], idx.tolist())
+        self.assertEqual([1.], values.tolist())
+        
 class RecommendationTrackingTest(unittest.TestCase):
     def setUp(self):
         self.session = get_session()
@@ -135,6 +429,7 @@ class RecommendationTrackingTest(unittest.TestCase):
 
         self.session.add_kw_recom_list(iter2)        
         self.assertEqual([iter1, iter2], self.session.recom_kws)
+        self.assertEqual("list", self.session.redis.type(self.session._full_key("recommended_kws")))
 
     def test_add_docs(self):
         """
@@ -151,6 +446,23 @@ class RecommendationTrackingTest(unittest.TestCase):
         self.assertEqual([iter1, iter2], self.session.recom_docs)
 
         self.assertEqual(iter2, self.session.last_recom_docs)
+        self.assertEqual(set([2, 3, 4]), self.session.last_recom_doc_ids)
+
+    def test_last_recom_doc_ids_of_old_session(self):
+        """
+        sessions recorded without the id set
+        """
+        self.session.set("recommended_docs", [[1, 2, 3], [2, 3, 4]])
+        
+        self.assertEqual(set([2, 3, 4]), self.session.last_recom_doc_ids)
+        self.assertEqual(set([2, 3, 4]), self.session.sget("last_recom_doc_ids"))
+
+        #the history is migrated to a redis list
+        self.assertEqual("list", self.session.redis.type(self.session._full_key("recommended_docs")))
+        self.assertEqual([Document.get_many([1, 2, 3]), Document.get_many([2, 3, 4])], self.session.recom_docs)
+
+        self.session.add_doc_recom_list(Document.get_many([5]))
+        self.assertEqual(Document.get_many([5]), self.session.last_recom_docs)
         
     
 class FeedbackTrackingTest(unittest.TestCase):
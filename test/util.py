@@ -7,14 +7,14 @@
 # 5. 
 ########################################
 
-__all__ = ["get_db_conn", "config_doc_kw_model", "get_session", "NumericTestCase"]
+__all__ = ["get_db_conn", "config_doc_kw_model", "get_session", "get_vectorized_session", "NumericTestCase"]
 
 
 import torndb, redis, unittest
 
 from scinet3.data import load_fmim
 from scinet3.model import config_model
-from scinet3.session import RedisRecommendationSessionHandler
+from scinet3.session import (RedisRecommendationSessionHandler, VectorizedRecommendationSessionHandler)
 
 def get_db_conn():
     db = 'scinet3'
@@ -36,6 +36,12 @@ def get_session():
     
     redis_conn = redis.StrictRedis(host='ugluk', port=6379, db=redis_db)
     return RedisRecommendationSessionHandler.get_session(redis_conn)
+
+def get_vectorized_session():
+    redis_db="test"
+    
+    redis_conn = redis.StrictRedis(host='ugluk', port=6379, db=redis_db)
+    return VectorizedRecommendationSessionHandler.get_session(redis_conn)
     
 
 class NumericTestCase(unittest.TestCase):
@@ -0,0 +1,54 @@
+#########################
+# Size-bounded caches
+#########################
+
+__all__ = ["LRUCache"]
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    Dict-like cache holding at most `maxsize` items.
+
+    When full, the least recently used item is evicted.
+    """
+    def __init__(self, maxsize):
+        """
+        maxsize: integer, the maximum number of items, None for unbounded
+        """
+        assert maxsize is None or maxsize > 0, "maxsize should be positive or None, but is %r" %maxsize
+
+        self.maxsize = maxsize
+        self.evictions = 0
+
+        self._data = OrderedDict()
+
+    def get(self, key, default = None):
+        """
+        get the value and mark it as the most recently used
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+
+        self._data[key] = value
+        return value
+
+    def put(self, key, value):
+        if self._data.has_key(key):
+            del self._data[key]
+        elif self.maxsize is not None and len(self._data) >= self.maxsize:
+            self._data.popitem(last = False)
+            self.evictions += 1
+
+        self._data[key] = value
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self._data.has_key(key)
+
+    def __len__(self):
+        return len(self._data)
@@ -82,7 +82,5 @@ class GoalBasedEvaluator(object):
         #2: similarity scores for each itertion of recommended keywords(from newest to oldest)
         """
         
-        return ([self.desired_docs.similarity_to(docs)  #for docs
-                 for docs in recom_doc_history],
-                [self.desired_kws.similarity_to(kws) #for kws
-                 for kws in recom_kw_history])
+        return (self.desired_docs.similarities(recom_doc_history).tolist(), #for docs
+                self.desired_kws.similarities(recom_kw_history).tolist()) #for kws
@@ -1,6 +1,64 @@
 import numpy as np
-from scipy import (linalg, mat, dot)
-from scipy.sparse import isspmatrix
+from scipy.sparse import (isspmatrix, csr_matrix, csc_matrix)
+
+def row_norms(M):
+    """
+    The L2 norms of the rows of M
+    
+    For sparse matrix, they are computed on the CSR data, M is not densified
+    
+    M: sparse matrix, np.array or scipy.mat
+    
+    Return:
+    array of float
+    """
+    if isspmatrix(M):
+        M = M.tocsr()
+        rows = np.repeat(np.arange(M.shape[0]), np.diff(M.indptr))
+        return np.sqrt(np.bincount(rows, weights = np.asarray(M.data, dtype = np.float64) ** 2, 
+                                   minlength = M.shape[0]))
+    else:
+        return np.sqrt((np.asarray(M, dtype = np.float64) ** 2).sum(1))
+
+def _as_rows(M):
+    """
+    M as a matrix of row vectors, a single vector is taken as 1xN
+    """
+    if isspmatrix(M):
+        return M.tocsr()
+    else:
+        return np.atleast_2d(np.asarray(M, dtype = np.float64))
+        
+def cosine_similarity_matrix(A, B, A_norms = None, B_norms = None):
+    """
+    The cosine similarities between each row of A and each row of B, by one matrix product
+    
+    If either is sparse, the product is sparse and nothing is densified but the result
+    
+    A: MxN, B: KxN, list, np.array, scipy.mat or scipy.sparse.csr_matrix|csc_matrix...(a single vector is taken as 1xN)
+    A_norms, B_norms(optional): array, the precomputed row norms of A and B(see `row_norms`)
+    
+    Return:
+    MxK array, the similarity involving a zero vector is 0
+    """
+    A, B = _as_rows(A), _as_rows(B)
+    
+    if isspmatrix(A) or isspmatrix(B):
+        dots = csr_matrix(A).dot(csr_matrix(B).T).toarray()
+    else:
+        dots = np.dot(A, B.T)
+
+    if A_norms is None:
+        A_norms = row_norms(A)
+    if B_norms is None:
+        B_norms = row_norms(B)
+
+    norms = np.outer(A_norms, B_norms)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        sims = dots / norms
+    sims[norms == 0] = 0
+    
+    return sims
 
 def cosine_similarity(vec1, vec2):
     """
@@ -9,18 +67,9 @@ def cosine_similarity(vec1, vec2):
     vec1, vec2: list, np.array, scipy.mat or scipy.sparse.csr_matrix|csc_matrix...
     
     Return:
-    float
+    float, 0 if either is a zero vector
     """    
-    
-    if isspmatrix(vec1):
-        vec1 = vec1.todense()
-        
-    if isspmatrix(vec2):
-        vec2 = vec2.todense()
-
-    vec1, vec2 = mat(vec1), mat(vec2)    
-    
-    return (dot(vec1,vec2.T)/linalg.norm(vec1)/linalg.norm(vec2)).tolist()[0][0]
+    return float(cosine_similarity_matrix(vec1, vec2)[0, 0])
 
 
 def matrix2array(M):
@@ -35,3 +84,98 @@ def matrix2array(M):
         M = M.todense()
     return np.squeeze(np.asarray(M))
     
+
+def top_k(scores, k):
+    """
+    Indices of the k largest scores, in descending order of the score.
+
+    Ties are broken by the smaller index first, the same as stable sorting in descending order.
+    It takes an O(n) selection plus sorting the k selected, instead of sorting all the scores.
+
+    scores: array or 1xN/Nx1 matrix
+    k: integer
+    
+    Return:
+    array of integer
+    """
+    scores = np.asarray(scores).ravel()
+    n = scores.shape[0]
+
+    if k <= 0:
+        return np.array([], dtype = np.int64)
+    
+    if k >= n:
+        idx = np.arange(n)
+    else:
+        threshold = np.partition(scores, n - k)[n - k] #the k-th largest
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        idx = np.concatenate([above, ties])
+
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+def _select_major(indptr, indices, data, major_idx, minor_idx):
+    """
+    Select the major axis(rows of CSR, columns of CSC) then the minor axis, working on the index arrays.
+
+    Repeated indices are kept, the same as fancy indexing
+    
+    Return:
+    (indptr, indices, data) of the selection
+    """
+    starts = indptr[major_idx]
+    lengths = indptr[major_idx + 1] - starts
+    
+    #positions of the entries of the selected majors in indices/data
+    pos = (np.arange(lengths.sum()) + 
+           np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths))
+    majors = np.repeat(np.arange(len(major_idx)), lengths)
+    
+    #each entry is copied once for every time its minor index is selected
+    order = np.argsort(minor_idx, kind = "mergesort")
+    sorted_minor = minor_idx[order]
+    old_minor = indices[pos]
+    first = np.searchsorted(sorted_minor, old_minor, side = "left")
+    copies = np.searchsorted(sorted_minor, old_minor, side = "right") - first
+
+    entry = np.repeat(np.arange(len(pos)), copies)
+    nth_copy = np.arange(len(entry)) - np.repeat(np.cumsum(copies) - copies, copies)
+    
+    counts = np.bincount(majors[entry], minlength = len(major_idx))
+    
+    #the entries are grouped by major already, as `entry` is non-decreasing
+    return (np.concatenate([[0], np.cumsum(counts)]),
+            order[first[entry] + nth_copy], 
+            data[pos][entry])
+
+def select_submatrix(M, rows, cols, csc = None):
+    """
+    The submatrix of M with the given rows and columns(in the given order).
+    
+    It works on the index arrays directly, 
+    so the cost is proportional to the number of non-zeros in the selected rows(or columns),
+    instead of all the non-zeros in M.
+
+    M: csr_matrix
+    rows, cols: list of integer, row/column indices, repeated ones are kept(as in fancy indexing)
+    csc(optional): csc_matrix, M in CSC format. 
+                   If given, the selection goes column first when the selected columns hold fewer non-zeros than the selected rows
+
+    Return:
+    csr_matrix
+    """
+    M = M.tocsr()
+    rows = np.asarray(rows, dtype = np.int64)
+    cols = np.asarray(cols, dtype = np.int64)
+    shape = (len(rows), len(cols))
+    
+    if csc is not None:
+        rows_nnz = (M.indptr[rows + 1] - M.indptr[rows]).sum()
+        cols_nnz = (csc.indptr[cols + 1] - csc.indptr[cols]).sum()
+
+        if cols_nnz < rows_nnz:
+            indptr, indices, data = _select_major(csc.indptr, csc.indices, csc.data, cols, rows)
+            return csc_matrix((data, indices, indptr), shape = shape).tocsr()
+
+    indptr, indices, data = _select_major(M.indptr, M.indices, M.data, rows, cols)
+    return csr_matrix((data, indices, indptr), shape = shape)